@@ -0,0 +1,115 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_end_to_end import PROVIDERS, configure_services, make_dataset, start_services
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_share(path: str, provider: str, work_dir: str, endpoints: dict) -> None:
+    # what python nifty.py costs: a fresh interpreter importing, connecting and sharing once
+    logging.getLogger().setLevel(logging.WARNING)
+    configure_services(endpoints, work_dir)
+    from core import NiftyCore
+    from integrations import progress
+    progress.set_mode('none')
+    NiftyCore(path, "recipient@example.com", provider, dedup=False, work_dir=work_dir).share()
+
+
+def time_cold(path: str, provider: str, work_dir: str, endpoints: dict) -> float:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_daemon', '--cold', path, provider, work_dir,
+                             json.dumps(endpoints)], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold share failed:\n{result.stderr}")
+    return time.perf_counter() - start
+
+
+def start_daemon(socket_path: str, token_path: str, provider: str, max_jobs: int):
+    from scheduler.share_daemon import ShareDaemon, create_server, write_token
+
+    daemon = ShareDaemon(max_jobs=max_jobs, defaults={'provider': provider, 'dedup': False})
+    daemon.warm_up([provider])
+    daemon.start()
+    server = create_server(daemon, write_token(token_path), socket_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return daemon, server
+
+
+def check_priorities(jobs: list, max_jobs: int) -> bool:
+    # the first max_jobs start straight away, after that a job only starts once no
+    # higher priority job is still waiting
+    waiting = sorted(jobs, key=lambda job: job['started_at'])[max_jobs:]
+    return all(earlier['priority'] >= later['priority'] for earlier, later in zip(waiting, waiting[1:]))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare one share per process with shares handed to a warm nifty_daemon.py.')
+    parser.add_argument('--provider', choices=PROVIDERS, default='AWS', help='Provider to upload to (default: AWS)')
+    parser.add_argument('--repeat', type=int, default=5, help='Shares timed each way, the median is reported (default: 5)')
+    parser.add_argument('--burst', type=int, default=24, help='Jobs submitted at once, with mixed priorities, to check the queue order (default: 24)')
+    parser.add_argument('--max-jobs', type=int, default=2, help='Jobs the daemon runs at once (default: 2)')
+    parser.add_argument('--cold', nargs=4, metavar=('PATH', 'PROVIDER', 'WORK_DIR', 'ENDPOINTS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold:
+        path, provider, work_dir, endpoints = args.cold
+        cold_share(path, provider, work_dir, json.loads(endpoints))
+        sys.exit(0)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    from integrations import progress
+    from scheduler.daemon_client import DaemonClient
+    progress.set_mode('none')
+
+    work_dir = tempfile.mkdtemp(prefix='nifty_daemon_')
+    services, endpoints = start_services(work_dir)
+    socket_path = os.path.join(work_dir, 'nifty.sock')
+    token_path = os.path.join(work_dir, 'nifty.token')
+    path = make_dataset('small_files', work_dir, 0.01)
+
+    try:
+        cold = [time_cold(path, args.provider, work_dir, endpoints) for _ in range(args.repeat)]
+
+        daemon, server = start_daemon(socket_path, token_path, args.provider, args.max_jobs)
+        client = DaemonClient(socket_path, token_file=token_path)
+        warm = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            job = client.wait(client.submit({'file_path': path, 'recipient': "recipient@example.com"})['id'], 0.005)
+            if job['status'] != 'ok':
+                raise RuntimeError(f"Daemon job failed during {job['stage']}: {job['error']}")
+            warm.append(time.perf_counter() - start)
+
+        # a folder each, concurrent uploads to one key would race in the S3 stand-in
+        copies = [shutil.copytree(path, f"{path}_{index}") for index in range(args.burst)]
+        start = time.perf_counter()
+        ids = [client.submit({'file_path': copy, 'recipient': "recipient@example.com"}, priority=index % 3)['id']
+               for index, copy in enumerate(copies)]
+        burst = [client.wait(job_id, 0.01) for job_id in ids]
+        burst_seconds = time.perf_counter() - start
+
+        server.shutdown()
+        daemon.stop()
+    finally:
+        for service in services:
+            service.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'':<28} {'median s':>9} {'max s':>8}")
+    print(f"{'python nifty.py per share':<28} {statistics.median(cold):>9.3f} {max(cold):>8.3f}")
+    print(f"{'share through the daemon':<28} {statistics.median(warm):>9.3f} {max(warm):>8.3f}")
+    print(f"{args.burst} queued jobs finished in {burst_seconds:.2f}s, "
+          f"{sum(job['status'] == 'ok' for job in burst)} ok, "
+          f"priority order {'kept' if check_priorities(burst, args.max_jobs) else 'NOT kept'}")
+    sys.exit(0 if all(job['status'] == 'ok' for job in burst) and check_priorities(burst, args.max_jobs) else 1)
@@ -0,0 +1,257 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+
+from settings import DatabaseConfig, GoogleConfig, MailerConfig
+from core import NiftyCore
+from integrations import client_cache, progress
+from benchmarks.bench_s3_multipart import configure as configure_s3, start_local_s3
+from benchmarks.local_services import FakeGcsServer, SmtpSink
+
+MiB = 1024 * 1024
+
+BASELINE_VERSION = 1
+BUCKET = 'nifty-benchmark'
+DATASETS = ('small_files', 'huge_files', 'media', 'deep_tree')
+PROVIDERS = ('AWS', 'Google')
+MODES = ('zip', 'stream', 'files')
+
+
+def _text_block(rng: random.Random, size: int) -> bytes:
+    words = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+             for _ in range(2000)]
+    out = bytearray()
+    while len(out) < size:
+        out += b" ".join(rng.choice(words) for _ in range(64)) + b"\n"
+    return bytes(out[:size])
+
+
+def make_dataset(name: str, root: str, scale: float) -> str:
+    # deterministic for a given scale, so runs and baselines compare like with like
+    path = os.path.join(root, name)
+    if os.path.isdir(path):
+        return path
+    rng = random.Random(42)
+    block = _text_block(rng, MiB)
+    os.makedirs(path)
+
+    if name == 'small_files':
+        for index in range(max(1, int(2000 * scale))):
+            folder = os.path.join(path, f"dir_{index % 20:02d}")
+            os.makedirs(folder, exist_ok=True)
+            offset = rng.randrange(MiB - 16 * 1024)
+            with open(os.path.join(folder, f"note_{index:05d}.txt"), 'wb') as file:
+                file.write(block[offset:offset + rng.randint(1024, 16 * 1024)])
+
+    elif name == 'huge_files':
+        for index in range(3):
+            with open(os.path.join(path, f"export_{index}.log"), 'wb') as file:
+                for _ in range(max(1, int(128 * scale))):
+                    file.write(block)
+
+    elif name == 'media':
+        # random bytes don't compress, which is what photos and video look like to deflate
+        extensions = ('jpg', 'mp4', 'png', 'mov')
+        for index in range(max(1, int(24 * scale))):
+            with open(os.path.join(path, f"clip_{index:03d}.{extensions[index % len(extensions)]}"), 'wb') as file:
+                for _ in range(4):
+                    file.write(rng.randbytes(MiB))
+
+    elif name == 'deep_tree':
+        folder = path
+        for depth in range(32):
+            folder = os.path.join(folder, f"level_{depth:02d}")
+            os.makedirs(folder)
+            for index in range(max(1, int(16 * scale))):
+                offset = rng.randrange(MiB - 2048)
+                with open(os.path.join(folder, f"item_{index:03d}.json"), 'wb') as file:
+                    file.write(block[offset:offset + 2048])
+
+    else:
+        raise ValueError(f"Unknown dataset {name}")
+    return path
+
+
+def content_size(path: str) -> tuple:
+    files, size = 0, 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(folder, name))
+    return files, size
+
+
+def start_services(work_dir: str) -> tuple:
+    # starts a local stand-in for every service a share talks to, returns what to stop
+    # afterwards and the endpoints to hand configure_services in another process
+    s3_server, s3_endpoint = start_local_s3()
+    gcs = FakeGcsServer(work_dir).start()
+    smtp = SmtpSink(work_dir).start()
+    endpoints = {
+        's3': s3_endpoint,
+        'gcs': gcs.endpoint_url,
+        'gcs_credentials': gcs.credentials_file(),
+        'smtp': list(smtp.address),
+    }
+    configure_services(endpoints, work_dir)
+    return [s3_server, gcs, smtp], endpoints
+
+
+def configure_services(endpoints: dict, work_dir: str) -> None:
+    # points every setting a share reads at the stand-ins, also from another process
+    configure_s3(endpoints['s3'], BUCKET)
+
+    GoogleConfig.GGL_BUCKET_NAME = BUCKET
+    GoogleConfig.GGL_CREDENTIALS_PATH = endpoints['gcs_credentials']
+    GoogleConfig.GGL_ENDPOINT_URL = endpoints['gcs']
+
+    MailerConfig.MAIL_SMTP_SERVER, MailerConfig.MAIL_SMTP_PORT = endpoints['smtp']
+    MailerConfig.MAIL_HOST_USERNAME = "benchmark"
+    MailerConfig.MAIL_PASSWORD = "benchmark"
+    MailerConfig.MAIL_HOST_SENDER_NAME = "Benchmark"
+    MailerConfig.MAIL_HOST_SENDER_ADDRESS = "sender@example.com"
+    MailerConfig.MAIL_MAX_PER_SECOND = 1000
+    MailerConfig.MAIL_TEMPLATE_CACHE_DIR = os.path.join(work_dir, 'jinja_cache')
+
+    DatabaseConfig.DB_TYPE = "sqlite"
+    DatabaseConfig.SQLITE_DB_FILENAME = os.path.join(work_dir, 'nifty.db')
+    DatabaseConfig.UPLOAD_STATE_FILENAME = os.path.join(work_dir, 'nifty_uploads.db')
+
+    client_cache.clear()
+
+
+def run_share(path: str, provider: str, mode: str, workers: int, dedup: bool, work_dir: str) -> dict:
+    nifty = NiftyCore(path, "recipient@example.com", provider, stream=mode == 'stream', workers=workers,
+                      dedup=dedup, work_dir=work_dir, archive=mode != 'files')
+    nifty.share()
+    if nifty.mail_status != 'sent':
+        raise RuntimeError(f"Mail for {path} was not accepted by the SMTP sink")
+    return nifty._metrics.as_dict()
+
+
+def summarise(runs: list, mode: str, files: int, size: int) -> dict:
+    stages = {}
+    for name in runs[0]['stages']:
+        seconds = [run['stages'][name]['wall_seconds'] for run in runs if name in run['stages']]
+        median = statistics.median(seconds)
+        bytes_out = runs[-1]['stages'][name]['bytes_out']
+        # package reads the content, upload sends the archive; mail and db only have a latency.
+        # streamed archives are written during the upload, so package is just the scan there
+        moved = {'package': size if mode == 'zip' else None, 'upload': bytes_out}.get(name)
+        stages[name] = {
+            'median_seconds': round(median, 4),
+            'max_seconds': round(max(seconds), 4),
+            'mb_per_second': round(moved / MiB / median, 2) if moved and median else None,
+        }
+    return {
+        'files': files,
+        'bytes': size,
+        'stages': stages,
+        'total_seconds': round(statistics.median(run['total_seconds'] for run in runs), 4),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    # a stage regresses when its median is both relatively and absolutely slower, so the
+    # noise on stages that take a few milliseconds doesn't fail the run
+    regressions = []
+    for case, current in results['cases'].items():
+        previous = baseline['cases'].get(case)
+        if not previous:
+            continue
+        for name, stage in current['stages'].items():
+            before = previous['stages'].get(name)
+            if not before:
+                continue
+            delta = stage['median_seconds'] - before['median_seconds']
+            if delta > min_delta and stage['median_seconds'] > before['median_seconds'] * (1 + tolerance):
+                regressions.append((case, name, before['median_seconds'], stage['median_seconds']))
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(f"{'case':<28} {'stage':<8} {'median s':>9} {'max s':>8} {'MB/s':>8}")
+    for case, summary in results['cases'].items():
+        for name, stage in summary['stages'].items():
+            rate = f"{stage['mb_per_second']:.1f}" if stage['mb_per_second'] is not None else '-'
+            print(f"{case:<28} {name:<8} {stage['median_seconds']:>9.3f} {stage['max_seconds']:>8.3f} {rate:>8}")
+        print(f"{case:<28} {'total':<8} {summary['total_seconds']:>9.3f}")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run whole shares against local S3, GCS, SMTP and SQLite stand-ins and time every stage.')
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=list(DATASETS), help='Datasets to share (default: all)')
+    parser.add_argument('--providers', nargs='+', choices=PROVIDERS, default=list(PROVIDERS), help='Providers to upload to (default: AWS Google)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='zip to disk first, stream while uploading, or upload the files without an archive (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplies the file counts and sizes of every dataset (default: 1.0, about 1 GB in total)')
+    parser.add_argument('--repeat', type=int, default=3, help='Shares per case, the median is reported (default: 3)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Compression workers, as in nifty.py (default: 1)')
+    parser.add_argument('--dedup', action='store_true', help='Keep the content hash check on, repeats then time reusing the first upload')
+    parser.add_argument('--data-dir', type=str, default=None, help='Keep the generated datasets here between runs (default: a temporary directory)')
+    parser.add_argument('--save-baseline', type=str, default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare against this JSON file and exit 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Slowdown of a stage median accepted against the baseline (default: 0.2)')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='Seconds a stage must slow down by before it counts (default: 0.05)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Keep the INFO log of every share')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    progress.set_mode('none')
+
+    work_dir = tempfile.mkdtemp(prefix='nifty_e2e_')
+    data_dir = args.data_dir or os.path.join(work_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    services, _ = start_services(work_dir)
+
+    results = {
+        'version': BASELINE_VERSION,
+        'scale': args.scale,
+        'workers': args.workers,
+        'dedup': args.dedup,
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'cases': {},
+    }
+    try:
+        for dataset in args.datasets:
+            path = make_dataset(dataset, data_dir, args.scale)
+            files, size = content_size(path)
+            for provider in args.providers:
+                for mode in args.modes:
+                    runs = [run_share(path, provider, mode, args.workers, args.dedup, work_dir)
+                            for _ in range(args.repeat)]
+                    results['cases'][f"{dataset}/{provider}/{mode}"] = summarise(runs, mode, files, size)
+    finally:
+        for service in services:
+            service.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if (baseline.get('version'), baseline.get('scale'), baseline.get('workers')) != \
+                (BASELINE_VERSION, args.scale, args.workers):
+            print("Baseline was recorded with a different version, scale or worker count, not comparing")
+            sys.exit(2)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        for case, name, before, after in regressions:
+            print(f"REGRESSION {case} {name}: {before:.3f}s -> {after:.3f}s")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage slower than the baseline by more than {args.tolerance:.0%}")
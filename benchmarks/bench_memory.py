@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+
+from metrics.memory import MiB
+
+# each one packages or sends the same input, its peak RSS is measured in a fresh interpreter
+PATHS = ('zip', 'parallel', 'stream', 'attachment')
+DATASETS = ('huge_file', 'deep_tree')
+
+# the tree keeps its file count as it grows, the zip writers hold a few hundred bytes per
+# entry for the central directory, so memory grows with the number of files, not their size
+TREE_FILES = 2000
+TREE_DEPTH = 32
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_dataset(name: str, root: str, size_mb: int) -> str:
+    from benchmarks.bench_end_to_end import _text_block
+    import random
+
+    path = os.path.join(root, f"{name}_{size_mb}")
+    if os.path.isdir(path):
+        return path
+    os.makedirs(path)
+    block = _text_block(random.Random(42), MiB)
+
+    if name == 'huge_file':
+        with open(os.path.join(path, 'export.log'), 'wb') as file:
+            for _ in range(size_mb):
+                file.write(block)
+    elif name == 'deep_tree':
+        per_file = size_mb * MiB // TREE_FILES
+        folder = path
+        for index in range(TREE_FILES):
+            if index % (TREE_FILES // TREE_DEPTH) == 0:
+                folder = os.path.join(folder, f"level_{index // (TREE_FILES // TREE_DEPTH):02d}")
+                os.makedirs(folder)
+            with open(os.path.join(folder, f"item_{index:05d}.log"), 'wb') as file:
+                written = 0
+                while written < per_file:
+                    written += file.write(block[:per_file - written])
+    else:
+        raise ValueError(f"Unknown dataset {name}")
+    return path
+
+
+def _check_archive(zip_path: str, source: str) -> None:
+    # reading the central directory back exercises the ZIP64 records once the input is over 4 GiB
+    expected = {}
+    for folder, _, names in os.walk(source):
+        for name in names:
+            full_path = os.path.join(folder, name)
+            expected[f"{os.path.basename(source)}/{os.path.relpath(full_path, source)}"] = os.path.getsize(full_path)
+    with zipfile.ZipFile(zip_path) as zip_file:
+        actual = {info.filename: info.file_size for info in zip_file.infolist()}
+    if actual != expected:
+        raise RuntimeError(f"Archive of {source} doesn't list the files it was made from")
+
+
+def _descendants(pid: int) -> list:
+    # the compression workers are children of the forkserver, not of the process that zips
+    found = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return found
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children", encoding='ascii') as file:
+                children = [int(child) for child in file.read().split()]
+        except OSError:
+            continue
+        for child_pid in children:
+            found += [child_pid] + _descendants(child_pid)
+    return found
+
+
+def _hwm(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", encoding='ascii') as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class WorkerPeak:
+
+    # polls the peak RSS of every process below this one while the work runs, RUSAGE_CHILDREN
+    # only covers direct children and their ru_maxrss starts at the parent's
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name="worker-peak", daemon=True)
+
+    def _poll(self) -> None:
+        while True:
+            for pid in _descendants(os.getpid()):
+                self.peak = max(self.peak, _hwm(pid))
+            if self._stopped.wait(self.interval):
+                return
+
+    def __enter__(self) -> "WorkerPeak":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+
+def child(path: str, source: str, work_dir: str, workers: int, smtp: str) -> dict:
+    # imports first, so the baseline includes everything but the work itself
+    from metrics import memory
+    from zipper.file_zipper import FileZipper
+    from mailer.email_sender import EmailSender
+    from settings import MailerConfig
+
+    memory.enforce_limit()
+    # the imports' own peak, which the reset below drops, still counts against the ceiling
+    startup_peak = memory.peak_rss()
+    if not memory.reset_peak_rss():
+        raise RuntimeError("Measuring the peak RSS needs Linux's /proc/self/clear_refs")
+    before = memory.current_rss()
+
+    workers_peak = WorkerPeak()
+    if path in ('zip', 'parallel'):
+        zip_path = os.path.join(work_dir, f"{path}_{os.getpid()}.zip")
+        with workers_peak:
+            FileZipper(workers=workers if path == 'parallel' else 1).create_zip(source, zip_path)
+    elif path == 'stream':
+        stream = FileZipper().stream_zip(source)
+        buffer = bytearray(MiB)
+        while stream.readinto(buffer):
+            pass
+        stream.close()
+    elif path == 'attachment':
+        host, port = smtp.rsplit(':', 1)
+        MailerConfig.MAIL_SMTP_SERVER, MailerConfig.MAIL_SMTP_PORT = host, int(port)
+        files = [os.path.join(folder, name) for folder, _, names in os.walk(source) for name in names]
+        # the huge file on its own, the tree as one message with its first few files attached
+        if not EmailSender().send_email("recipient@example.com", "Memory benchmark", "<p>attached</p>", files[:8]):
+            raise RuntimeError("The SMTP sink didn't accept the message")
+
+    peak = memory.peak_rss()
+    # the whole life of the process is checked against the ceiling; not ru_maxrss, which
+    # carries over the parent's through the fork before exec
+    max_rss = max(startup_peak, peak)
+    if path in ('zip', 'parallel'):
+        _check_archive(zip_path, source)
+        os.remove(zip_path)
+    return {'baseline': before, 'peak': peak, 'children_peak': workers_peak.peak, 'max_rss': max_rss}
+
+
+def measure(path: str, source: str, work_dir: str, workers: int, smtp: str, limit_mb: int) -> dict:
+    command = [sys.executable, '-m', 'benchmarks.bench_memory', '--child', path, source, work_dir,
+               '--workers', str(workers), '--smtp', smtp]
+    if limit_mb:
+        command += ['--memory-limit-mb', str(limit_mb)]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{path} of {source} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure the peak RSS of packaging and mailing growing inputs and fail if it grows with them, or goes over --memory-limit-mb.')
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS), help='What to measure (default: all)')
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=list(DATASETS), help='Inputs to measure with (default: both)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[32, 128, 512], help='Input sizes in MB, smallest first (default: 32 128 512, add 5000 to cover ZIP64)')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Compression workers for the parallel path (default: 4)')
+    parser.add_argument('--max-growth-mb', type=float, default=16, help='Most the peak may grow from the smallest input to the largest (default: 16)')
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help='Run every measurement under this ceiling, as nifty.py --memory-limit-mb does, and fail if a process\'s max RSS goes over it; the largest size must be bigger than the ceiling')
+    parser.add_argument('--data-dir', type=str, default=None, help='Keep the generated inputs here between runs (default: a temporary directory)')
+    parser.add_argument('--child', nargs=3, metavar=('PATH', 'SOURCE', 'WORK_DIR'), help=argparse.SUPPRESS)
+    parser.add_argument('--smtp', type=str, default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.memory_limit_mb and not args.child and max(args.sizes) <= args.memory_limit_mb:
+        parser.error(f"--sizes needs an input bigger than the {args.memory_limit_mb} MB ceiling to check it")
+
+    if args.child:
+        from metrics import memory
+        memory.set_limit(args.memory_limit_mb)
+        print(json.dumps(child(*args.child, args.workers, args.smtp)))
+        sys.exit(0)
+
+    from benchmarks.local_services import SmtpSink
+
+    work_dir = tempfile.mkdtemp(prefix='nifty_memory_')
+    data_dir = args.data_dir or os.path.join(work_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    # in this process, so the messages it receives don't count against the sender's peak
+    sink = SmtpSink(work_dir).start()
+    smtp = "%s:%d" % sink.address
+
+    failed = False
+    print(f"{'path':<11} {'dataset':<10} {'size MB':>8} {'peak MB':>8} {'growth MB':>10} {'workers MB':>11} {'max RSS MB':>11}")
+    try:
+        for dataset in args.datasets:
+            for path in args.paths:
+                growths = []
+                for size_mb in sorted(args.sizes):
+                    source = make_dataset(dataset, data_dir, size_mb)
+                    result = measure(path, source, work_dir, args.workers, smtp, args.memory_limit_mb)
+                    growth = (result['peak'] - result['baseline']) / MiB
+                    growths.append(growth)
+                    workers = f"{result['children_peak'] / MiB:.1f}" if path == 'parallel' else '-'
+                    print(f"{path:<11} {dataset:<10} {size_mb:>8} {result['peak'] / MiB:>8.1f} {growth:>10.1f} {workers:>11} "
+                          f"{result['max_rss'] / MiB:>11.1f}")
+                    # each process on its own, a compression worker included
+                    if args.memory_limit_mb and max(result['max_rss'], result['children_peak']) > args.memory_limit_mb * MiB:
+                        print(f"    max RSS went over the {args.memory_limit_mb} MB ceiling")
+                        failed = True
+                # flat means the largest input needs no more memory than the smallest, within the allowance
+                if growths[-1] - growths[0] > args.max_growth_mb:
+                    print(f"    peak grew by {growths[-1] - growths[0]:.1f} MB with the input, over {args.max_growth_mb:.0f} MB")
+                    failed = True
+    finally:
+        sink.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+from zipper.file_zipper import FileZipper
+
+
+def make_dataset(path: str, small_files: int, large_files: int, large_size_mb: int) -> int:
+    rng = random.Random(42)
+    words = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+             for _ in range(2000)]
+
+    def text(size: int) -> bytes:
+        out = bytearray()
+        while len(out) < size:
+            out += b" ".join(rng.choice(words) for _ in range(64)) + b"\n"
+        return bytes(out[:size])
+
+    total = 0
+    os.makedirs(os.path.join(path, "small"), exist_ok=True)
+    for index in range(small_files):
+        data = text(rng.randint(4 * 1024, 256 * 1024))
+        with open(os.path.join(path, "small", f"file_{index:05d}.txt"), 'wb') as file:
+            file.write(data)
+        total += len(data)
+
+    block = text(1024 * 1024)
+    for index in range(large_files):
+        with open(os.path.join(path, f"large_{index}.log"), 'wb') as file:
+            for _ in range(large_size_mb):
+                file.write(block)
+        total += large_size_mb * 1024 * 1024
+
+    return total
+
+
+def run(source: str, total_bytes: int, workers: int, output_dir: str) -> float:
+    zip_path = os.path.join(output_dir, f"bench_{workers}.zip")
+    start = time.perf_counter()
+    FileZipper(workers=workers).create_zip(source, zip_path)
+    elapsed = time.perf_counter() - start
+
+    with zipfile.ZipFile(zip_path) as zip_file:
+        if zip_file.testzip() is not None:
+            raise RuntimeError(f"Corrupt archive produced with {workers} workers")
+    os.remove(zip_path)
+    return elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark zip throughput against the number of compression workers.')
+    parser.add_argument('--small-files', type=int, default=500, help='Number of small text files (default: 500)')
+    parser.add_argument('--large-files', type=int, default=2, help='Number of large files (default: 2)')
+    parser.add_argument('--large-size-mb', type=int, default=128, help='Size of each large file in MB (default: 128)')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='Highest worker count to test (default: cpu count)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nifty_bench_")
+    try:
+        source = os.path.join(workdir, "dataset")
+        total_bytes = make_dataset(source, args.small_files, args.large_files, args.large_size_mb)
+        print(f"Dataset: {total_bytes / 1024 / 1024:.1f} MB, {os.cpu_count()} cpus available")
+
+        counts = sorted({1} | {2 ** n for n in range(1, args.max_workers.bit_length())} | {args.max_workers})
+        baseline = None
+        print(f"{'workers':>8} {'seconds':>9} {'MB/s':>9} {'speedup':>8}")
+        for workers in counts:
+            elapsed = run(source, total_bytes, workers, workdir)
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>9.2f} {total_bytes / 1024 / 1024 / elapsed:>9.1f} {baseline / elapsed:>7.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,101 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+from settings import AwsConfig
+from integrations import client_cache
+from integrations.s3_uploader import S3FileUploader
+from integrations.transfer_tuning import s3_transfer_config, throughput
+
+MiB = 1024 * 1024
+
+# what S3FileUploader used before part sizes were adaptive
+LEGACY_CONFIG = TransferConfig(
+    multipart_threshold=1024 * 25,
+    max_concurrency=10,
+    multipart_chunksize=1024 * 25,
+    use_threads=True
+)
+
+
+def start_local_s3() -> tuple:
+    # moto's server speaks the S3 API on localhost, so no credentials or network are needed
+    from moto.server import ThreadedMotoServer
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+
+def configure(endpoint_url: str, bucket: str) -> None:
+    AwsConfig.AWS_ACCESS_KEY = "benchmark"
+    AwsConfig.AWS_SECRET_ACCESS_KEY = "benchmark"
+    AwsConfig.AWS_DEFAULT_REGION = "us-east-1"
+    AwsConfig.AWS_ENDPOINT_URL = endpoint_url
+    AwsConfig.AWS_BUCKET_NAME = bucket
+    client_cache.clear()
+
+    s3 = boto3.client('s3', endpoint_url=endpoint_url, region_name="us-east-1",
+                      aws_access_key_id="benchmark", aws_secret_access_key="benchmark")
+    try:
+        s3.create_bucket(Bucket=bucket)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+
+def upload(file_path: str, config: TransferConfig) -> float:
+    uploader = S3FileUploader()
+    client = uploader._client(uploader.region)
+    start = time.perf_counter()
+    client.upload_file(file_path, uploader.bucket_name, f"bench/{os.path.basename(file_path)}", Config=config)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare S3 multipart settings against a local S3-compatible endpoint.')
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[16, 64, 256], help='File sizes to upload (default: 16 64 256)')
+    parser.add_argument('--endpoint-url', type=str, default=None, help='Existing S3-compatible endpoint, e.g. a local minio (default: start moto)')
+    parser.add_argument('--bucket', type=str, default='nifty-benchmark', help='Bucket to upload into (default: nifty-benchmark)')
+    parser.add_argument('--legacy-max-mb', type=int, default=64, help='Skip the 25 KiB legacy config above this size (default: 64)')
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        server, endpoint_url = start_local_s3()
+    configure(endpoint_url, args.bucket)
+
+    try:
+        print(f"{'size MB':>8} {'config':<9} {'part MB':>8} {'parts':>7} {'seconds':>8} {'MB/s':>8}")
+        for size_mb in args.sizes_mb:
+            with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as file:
+                block = os.urandom(MiB)
+                for _ in range(size_mb):
+                    file.write(block)
+                file_path = file.name
+
+            try:
+                size = size_mb * MiB
+                runs = [('adaptive', s3_transfer_config(size))]
+                if size_mb <= args.legacy_max_mb:
+                    runs.insert(0, ('legacy', LEGACY_CONFIG))
+
+                for name, config in runs:
+                    seconds = upload(file_path, config)
+                    if name == 'adaptive':
+                        throughput.record(size, seconds)
+                    part_size = config.multipart_chunksize
+                    parts = max(1, -(-size // part_size)) if size >= config.multipart_threshold else 1
+                    print(f"{size_mb:>8} {name:<9} {part_size / MiB:>8.2f} {parts:>7} {seconds:>8.2f} {size_mb / seconds:>8.1f}")
+            finally:
+                os.remove(file_path)
+    finally:
+        if server:
+            server.stop()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# the CLIs and the outbox worker, with the deferred SDKs each one needs from the start
+ENTRY_POINTS = {
+    'nifty': (),
+    'nifty_batch': (),
+    'nifty_sweep': (),
+    'nifty_daemon': (),
+    'mailer.outbox': ('smtplib',),
+}
+
+# SDKs that are only imported once a share uses them, none may load at startup
+DEFERRED = ('boto3', 'botocore', 's3transfer', 'google.cloud', 'google.auth', 'mysql', 'jinja2', 'smtplib', 'requests')
+
+# cumulative import time of an entry point, the interpreter's own startup not included
+STARTUP_BUDGET_MS = 150
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> dict:
+    # -X importtime reports "self | cumulative | name" per module on stderr, in microseconds
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # children are listed before their parent, so a top level line other than the module
+        # closes an interpreter startup import such as site, whose children don't count
+        if not name[1:].startswith(' ') and name.strip() != module:
+            times = {}
+            continue
+        times[name.strip()] = int(cumulative)
+        if name.strip() == module:
+            break
+    return times
+
+
+def deferred_imports(times: dict, allowed: tuple) -> list:
+    return sorted(name for name in times
+                  if any(name == prefix or name.startswith(f"{prefix}.") for prefix in DEFERRED)
+                  and not any(name == prefix or name.startswith(f"{prefix}.") for prefix in allowed))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure the import time of the CLIs and fail when it goes over budget.')
+    parser.add_argument('--modules', nargs='+', default=list(ENTRY_POINTS), help='Modules to import (default: the CLIs and the outbox worker)')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per module, the median is reported (default: 5)')
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS, help=f'Most milliseconds a module may take to import (default: {STARTUP_BUDGET_MS})')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports listed for each module (default: 5)')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<16} {'median ms':>10} {'budget ms':>10}")
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        median_ms = statistics.median(run[module] for run in runs) / 1000
+        over = median_ms > args.budget_ms
+        print(f"{module:<16} {median_ms:>10.1f} {args.budget_ms:>10.0f}{'  OVER BUDGET' if over else ''}")
+
+        # the slowest direct and indirect imports of the last run, the module itself excluded
+        slowest = sorted(((us, name) for name, us in runs[-1].items() if name != module), reverse=True)
+        for us, name in slowest[:args.top]:
+            print(f"    {name:<40} {us / 1000:>8.1f} ms")
+
+        eager = deferred_imports(runs[-1], ENTRY_POINTS.get(module, ()))
+        if eager:
+            print(f"    imported at startup, should be deferred: {', '.join(eager)}")
+        failed = failed or over or bool(eager)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from settings import DatabaseConfig
+from database.database import SQLiteDatabase, create_schema
+from database.transfer_query import TRANSFER_INDEXES, TransferFilter
+
+
+def make_table(db: SQLiteDatabase, rows: int, recipients: int) -> None:
+    rng = random.Random(42)
+    start = datetime(2023, 1, 1)
+    create_schema(db, DatabaseConfig.SQLITE_COLS)
+    # measured without the indexes first
+    for index_name in TRANSFER_INDEXES:
+        db.connection.execute(f"DROP INDEX {index_name}")
+
+    def record(index: int) -> dict:
+        added = start + timedelta(seconds=index * 30)
+        return {
+            'sender_name': 'Benchmark',
+            'file_basename': f"file_{index}.zip",
+            'sender_address': 'sender@example.com',
+            'download_link': f"https://example.com/{index}",
+            'recipient_email': f"user{rng.randrange(recipients)}@example.com",
+            'expiry_date_dt': added + timedelta(days=7),
+            'file_size_bytes': rng.randint(1024, 1024 ** 3),
+            'files_list': [f"file_{index}.bin"],
+            'mail_status': 'sent',
+            'cloud_provider': 'AWS',
+            'object_key': f"bench/file_{index}.zip",
+            'share_metrics': None,
+            'local_datetime': added.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    for first in range(0, rows, 50000):
+        for index in range(first, min(rows, first + 50000)):
+            db.insert_data("transfers", record(index))
+        db.connection.commit()
+
+
+def timed(run) -> tuple:
+    start = time.perf_counter()
+    result = run()
+    return time.perf_counter() - start, result
+
+
+def queries(db: SQLiteDatabase, rows: int) -> list:
+    recipient = "user7@example.com"
+    middle = datetime(2023, 1, 1) + timedelta(seconds=rows // 2 * 30)
+
+    def pages(filters: TransferFilter, order_by: str, count: int) -> int:
+        after, seen = None, 0
+        for _ in range(count):
+            page = db.find_transfers(filters, limit=100, after=after, order_by=order_by)
+            seen += len(page.rows)
+            after = page.next_cursor
+            if after is None:
+                break
+        return seen
+
+    return [
+        # what callers had to do before, a raw condition with every match loaded at once
+        ("recipient, select_data", lambda: len(db.select_data("transfers", f"recipient_email = '{recipient}'"))),
+        ("recipient, first page", lambda: len(db.find_transfers(TransferFilter(recipient_email=recipient)).rows)),
+        ("recipient, 10 pages", lambda: pages(TransferFilter(recipient_email=recipient), 'id', 10)),
+        ("expired, 10 pages", lambda: pages(TransferFilter(expires_before=middle), 'expiry_date', 10)),
+        ("added in a day, stream", lambda: sum(1 for _ in db.iter_transfers(
+            TransferFilter(added_after=middle, added_before=middle + timedelta(days=1)), order_by='date_added'))),
+        ("5000 pages of all", lambda: pages(None, 'id', 5000)),
+    ]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark transfer history queries with and without indexes.')
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows in the synthetic transfers table (default: 1000000)')
+    parser.add_argument('--recipients', type=int, default=5000, help='Distinct recipients (default: 5000)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nifty_bench_")
+    try:
+        db = SQLiteDatabase(os.path.join(workdir, "bench.db"))
+        with db:
+            seconds, _ = timed(lambda: make_table(db, args.rows, args.recipients))
+            print(f"Inserted {args.rows} rows in {seconds:.1f}s")
+
+            results = {}
+            for label in ('no indexes', 'indexed'):
+                if label == 'indexed':
+                    seconds, _ = timed(lambda: [db.create_index("transfers", name, columns)
+                                                for name, columns in TRANSFER_INDEXES.items()])
+                    print(f"Built indexes in {seconds:.1f}s")
+                for name, run in queries(db, args.rows):
+                    results.setdefault(name, {})[label] = timed(run)
+
+            print(f"{'query':<24} {'rows':>7} {'no indexes ms':>14} {'indexed ms':>11} {'speedup':>8}")
+            for name, timings in results.items():
+                before, count = timings['no indexes']
+                after, _ = timings['indexed']
+                print(f"{name:<24} {count:>7} {before * 1000:>14.1f} {after * 1000:>11.1f} {before / after:>7.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,315 @@
+import base64
+import datetime
+import hashlib
+import json
+import os
+import re
+import socketserver
+import ssl
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import google_crc32c
+
+# stand-ins for the services a share talks to, all on localhost so a benchmark needs no
+# credentials or network: moto for S3 (see bench_s3_multipart), a fake of the GCS JSON
+# upload API, and an SMTP server that accepts and discards everything
+
+
+def _self_signed(directory: str, common_name: str = 'localhost') -> tuple:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(days=1))
+                   .not_valid_after(now + datetime.timedelta(days=7))
+                   .sign(key, hashes.SHA256()))
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    cert_path = os.path.join(directory, f"{common_name}.crt")
+    key_path = os.path.join(directory, f"{common_name}.key")
+    with open(cert_path, 'wb') as file:
+        file.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as file:
+        file.write(key_pem)
+    return cert_path, key_path, key_pem.decode('ascii')
+
+
+class _StoredObject:
+
+    # only the size and checksums are kept, the content itself is thrown away
+
+    def __init__(self, bucket: str, name: str) -> None:
+        self.bucket = bucket
+        self.name = name
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._crc32c = google_crc32c.Checksum()
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        self._md5.update(data)
+        self._crc32c.update(data)
+
+    def resource(self) -> dict:
+        return {
+            'kind': 'storage#object',
+            'bucket': self.bucket,
+            'name': self.name,
+            'size': str(self.size),
+            'generation': '1',
+            'md5Hash': base64.b64encode(self._md5.digest()).decode('ascii'),
+            'crc32c': base64.b64encode(self._crc32c.digest()).decode('ascii'),
+        }
+
+
+class _GcsHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeGCS'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: dict = None, headers: dict = None) -> None:
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = self._body()
+
+        # the service account credentials are pointed here to swap their JWT for a token
+        if url.path == '/token':
+            return self._reply(200, {'access_token': 'benchmark', 'expires_in': 3600, 'token_type': 'Bearer'})
+
+        match = re.fullmatch(r'/upload/storage/v1/b/([^/]+)/o', url.path)
+        if not match:
+            return self._reply(404, {'error': {'code': 404, 'message': f"No route for {url.path}"}})
+        bucket = match.group(1)
+
+        if query.get('uploadType') == 'multipart':
+            metadata, data = self._split_multipart(body)
+            stored = _StoredObject(bucket, metadata.get('name') or query.get('name'))
+            stored.write(data)
+            self.server.objects[(bucket, stored.name)] = stored
+            return self._reply(200, stored.resource())
+
+        if query.get('uploadType') == 'resumable':
+            metadata = json.loads(body) if body else {}
+            upload_id = uuid.uuid4().hex
+            self.server.sessions[upload_id] = _StoredObject(bucket, metadata.get('name') or query.get('name'))
+            host, port = self.server.server_address[:2]
+            location = f"http://{host}:{port}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+            return self._reply(200, {}, {'Location': location})
+
+        self._reply(400, {'error': {'code': 400, 'message': f"Unsupported uploadType {query.get('uploadType')}"}})
+
+    def do_PUT(self) -> None:
+        query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        data = self._body()
+        stored = self.server.sessions.get(query.get('upload_id'))
+        if stored is None:
+            return self._reply(404, {'error': {'code': 404, 'message': 'No such upload'}})
+
+        # bytes <first>-<last>/<total or *>, or bytes */<total> to ask for the status or finish
+        content_range = self.headers.get('Content-Range', '')
+        match = re.fullmatch(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)', content_range.strip())
+        if not match:
+            return self._reply(400, {'error': {'code': 400, 'message': f"Bad Content-Range {content_range}"}})
+        first, _, total = match.groups()
+        if first is not None:
+            if int(first) != stored.size:
+                return self._reply(400, {'error': {'code': 400, 'message': 'Chunk does not follow the last one'}})
+            stored.write(data)
+
+        if total != '*' and stored.size >= int(total):
+            del self.server.sessions[query['upload_id']]
+            self.server.objects[(stored.bucket, stored.name)] = stored
+            return self._reply(200, stored.resource())
+        headers = {'Range': f"bytes=0-{stored.size - 1}"} if stored.size else {}
+        self._reply(308, None, headers)
+
+    def do_DELETE(self) -> None:
+        query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        self.server.sessions.pop(query.get('upload_id'), None)
+        self._reply(499)
+
+    def _split_multipart(self, body: bytes) -> tuple:
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', '')).group(1).encode('ascii')
+        parts = body.split(b'--' + boundary)
+        # parts[0] is the preamble and the last one the closing --
+        metadata_part, data_part = parts[1], parts[2]
+        metadata = json.loads(metadata_part.split(b'\r\n\r\n', 1)[1])
+        data = data_part.split(b'\r\n\r\n', 1)[1]
+        return metadata, data[:-2] if data.endswith(b'\r\n') else data
+
+
+class FakeGcsServer:
+
+    # just enough of the JSON API for the uploads and signed links a share makes
+
+    def __init__(self, work_dir: str, host: str = '127.0.0.1') -> None:
+        self.work_dir = work_dir
+        self._server = ThreadingHTTPServer((host, 0), _GcsHandler)
+        self._server.daemon_threads = True
+        self._server.objects = {}
+        self._server.sessions = {}
+        self._thread = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def objects(self) -> dict:
+        return self._server.objects
+
+    def credentials_file(self) -> str:
+        # a service account that signs links locally and fetches its token from this server
+        _, _, private_key = _self_signed(self.work_dir, 'fake-gcs')
+        path = os.path.join(self.work_dir, 'fake-gcs.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'type': 'service_account',
+                'project_id': 'nifty-benchmark',
+                'private_key_id': 'benchmark',
+                'private_key': private_key,
+                'client_email': 'benchmark@nifty-benchmark.iam.gserviceaccount.com',
+                'client_id': '0',
+                'token_uri': f"{self.endpoint_url}/token",
+            }, file)
+        return path
+
+    def start(self) -> 'FakeGcsServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+
+    def _send(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+        self.wfile.flush()
+
+    def _starttls(self) -> None:
+        self.connection = self.server.tls.wrap_socket(self.connection, server_side=True)
+        self.rfile = self.connection.makefile('rb')
+        self.wfile = self.connection.makefile('wb')
+        self.secure = True
+
+    def handle(self) -> None:
+        self.secure = False
+        self._send("220 nifty-benchmark ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode('utf-8', 'replace').strip().partition(' ')
+            command = command.upper()
+
+            if command == 'EHLO':
+                # the first line is the greeting, the extensions follow it
+                extensions = ['nifty-benchmark', 'AUTH PLAIN LOGIN', '8BITMIME']
+                if not self.secure:
+                    extensions.insert(1, 'STARTTLS')
+                for extension in extensions:
+                    self._send(f"250-{extension}")
+                self._send("250 SIZE 0")
+            elif command == 'STARTTLS':
+                self._send("220 Ready to start TLS")
+                self._starttls()
+            elif command == 'AUTH':
+                if argument.upper() == 'LOGIN':
+                    self._send("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self._send("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                self._send("235 Authentication successful")
+            elif command == 'DATA':
+                self._send("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data_line)
+                self.server.record(size)
+                self._send("250 OK")
+            elif command == 'QUIT':
+                self._send("221 Bye")
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self._send("250 OK")
+
+
+class _SmtpServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple, tls: ssl.SSLContext) -> None:
+        super().__init__(address, _SmtpHandler)
+        self.tls = tls
+        self.messages = 0
+        self.message_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, size: int) -> None:
+        with self._lock:
+            self.messages += 1
+            self.message_bytes += size
+
+
+class SmtpSink:
+
+    # speaks STARTTLS and AUTH like a real relay, counts what it's sent and keeps none of it
+
+    def __init__(self, work_dir: str, host: str = '127.0.0.1') -> None:
+        cert_path, key_path, _ = _self_signed(work_dir, 'smtp-sink')
+        tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        tls.load_cert_chain(cert_path, key_path)
+        self._server = _SmtpServer((host, 0), tls)
+        self._thread = None
+
+    @property
+    def address(self) -> tuple:
+        return self._server.server_address[:2]
+
+    @property
+    def messages(self) -> int:
+        return self._server.messages
+
+    def start(self) -> 'SmtpSink':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,31 +1,46 @@
+import json
 import os
 from datetime import datetime, timedelta
 
 from integrations.file_upload import FileUploaderClass
+from integrations.fanout import FanOutUploader, choose_replica
+from integrations.file_set import (FileSetUploader, file_set_prefix, object_key_for_path, plan_file_set,
+                                   share_prefix)
+from integrations.upload_state import UploadStateStore
 from zipper.file_zipper import FileZipper
-from mailer.email_formatter import EmailTemplateRenderer
-from mailer.email_sender import EmailSender
+from zipper.manifest import build_manifest
+from zipper.content_hash import manifest_digest, manifest_path_keys, payload_digest
 from settings import MailerConfig
 from database.database import get_db_connection
+from metrics.share_metrics import exporter
 
 import logging_config
 import logging
 
 logger = logging.getLogger(__name__)
 
+# what a transfers row is made of, kept on disk for a share that couldn't be saved
+UNSAVED_FIELDS = ('sender_name', 'file_basename', 'sender_address', 'download_link', 'recipient_email',
+                  'expiry_date_dt', 'file_size_bytes', 'files_list', 'mail_status', 'cloud_provider',
+                  'object_key', 'share_metrics', 'local_datetime')
+
 
 class NiftyCore:
 
-    def __init__(self, file_path: str, recipient: str, provider: str='Google', template: str = 'mailer.html') -> None:
-        self.file_path = file_path
-        if not self.file_path:
+    def __init__(self, file_path: str, recipient: str, provider: str='Google', template: str = 'mailer.html',
+                 stream: bool = False, workers: int = 1, dedup: bool = True, work_dir: str = '',
+                 resume: bool = False, async_mail: bool = False, replicas: list = None,
+                 incremental: bool = False, archive: bool = True) -> None:
+        if not file_path:
             raise ValueError("File path is required.")
+        # "folder/" would otherwise name the archive, its key and the mail after an empty basename
+        self.file_path = os.path.normpath(file_path)
 
         self.recipient_email = recipient
         if not self.recipient_email:
             raise ValueError("Recipient is required.")
         
-        self.target_file = f"{os.path.basename(self.file_path)}.zip"
+        self.target_file = os.path.join(work_dir, f"{os.path.basename(self.file_path)}.zip")
         self.cloud_provider = provider
         self.template = template
 
@@ -37,26 +52,351 @@ class NiftyCore:
         self.file_basename = os.path.basename(self.file_path)
 
         self.zipped_here = False
+        self.stream = stream
+        self.workers = workers
+        self.dedup = dedup
+        self.resume = resume
+        self.async_mail = async_mail
+        self.incremental = incremental
+        self.archive = archive
+        self.mail_status = None
+        self.object_key = None
+        self.share_metrics = None
+        self._metrics = exporter.new_share()
+        self._payload = None
+        self._zipper = None
+        self._manifest = None
+        self._payload_digest = None
+        self._path_keys = None
+        self._file_digests = None
+        self._reused_upload = False
+        # (target, object_key) of every payload uploaded, indexed when the transfer is saved
+        self._uploaded_payloads = []
+        self._keep_archive = False
+        # the provider, then any other providers or regions the payload is fanned out to; the
+        # recipient is mailed the link of the one MailerConfig.MAIL_REPLICA_RULES picks for them
+        self._targets = [provider] + [target for target in (replicas or []) if target != provider]
+        self._existing = {}
+        self._replicas = {}
+        # with incremental or without an archive, every file is an object of its own under a prefix
+        self._file_set = None
+        self._prefix = None
+        self._object_keys = None
+        self._uploads = None
+        if (self.incremental or not self.archive) and len(self._targets) > 1:
+            raise ValueError("Shares uploaded file by file can't be replicated to other targets")
+
+    def _scan(self) -> None:
+        # one walk of the tree feeds the file list, the hashing, the zip writer and the size accounting
+        self._manifest = build_manifest(self.file_path)
+        self.content_size_bytes = self._manifest.total_size
 
-    def _package(self) -> None:
         if os.path.isdir(self.file_path):
+            self.files_list = self._manifest.paths
+        else:
+            self.files_list = [self.file_path]
+            self.file_size_bytes = self.content_size_bytes
+
+    def _hash_files(self, known: dict = None) -> list:
+        # known holds more (size, mtime, digest) by path_key, e.g. from the last share's files;
+        # returns the digests that had to be computed, for the caller to save
+        path_keys = self._path_keys = manifest_path_keys(self._manifest)
+        connection = get_db_connection()
+        with connection as db:
+            cached = db.get_file_hashes(path_keys)
+        # file_hashes is written on every hash, so it wins over an older share's manifest
+        cached = {**(known or {}), **cached}
+        self._payload_digest, fresh, self._file_digests = payload_digest(self._manifest, path_keys, cached,
+                                                                         os.path.isdir(self.file_path))
+        return fresh
+
+    def _find_existing_upload(self) -> bool:
+        if not self.dedup:
+            return False
+
+        fresh = self._hash_files()
+        connection = get_db_connection()
+        with connection as db:
+            db.save_file_hashes(fresh)
+            for target in self._targets:
+                existing = db.find_payload(self._payload_digest, target)
+                if existing:
+                    self._existing[target] = existing
+        if len(self._existing) < len(self._targets):
+            # a fan out uploads to the targets that don't have it yet
+            return False
+
+        target = choose_replica(self.recipient_email, self._targets)
+        object_key, file_size_bytes = self._existing[target]
+        uploader_factory = FileUploaderClass()
+        uploader = uploader_factory.create_file_uploader(target)
+        download_link = uploader.get_shareable_link(object_key)
+        if not download_link:
+            return False
+
+        logger.info(f"{self.file_basename} is unchanged since it was uploaded to {object_key}, reusing it")
+        self.download_link = download_link
+        self.file_size_bytes = file_size_bytes
+        self.object_key = object_key
+        self.cloud_provider = target
+        # the other copies are recorded against this transfer too, so they outlive it
+        for other, (other_key, _) in self._existing.items():
+            if other != target:
+                self._replicas[other] = (other_key, uploader_factory.create_file_uploader(other).get_shareable_link(other_key))
+        return True
+
+    def _plan_file_set(self) -> None:
+        # the tree is compared with the files of the last share of the same path, size and
+        # mtime decide which files are hashed again and the digests which are uploaded
+        uploader = FileUploaderClass().create_file_uploader(self.cloud_provider)
+        self._file_set = FileSetUploader(uploader)
+        self._prefix = file_set_prefix(uploader.root_folder, self.file_path)
+        connection = get_db_connection()
+        with connection as db:
+            previous = db.last_file_set(self.cloud_provider, self._prefix, datetime.now())
+
+        fresh = self._hash_files({path_key: (size, mtime, digest)
+                                  for _, path_key, size, mtime, digest, _ in previous})
+        with connection as db:
+            db.save_file_hashes(fresh)
+
+        self._object_keys, self._uploads, delta = plan_file_set(self._manifest, self._file_digests, self._prefix,
+                                                                previous)
+        self.file_size_bytes = self.content_size_bytes
+        # nothing is archived, so there's no compression ratio
+        self._metrics.add_bytes('package', self.content_size_bytes)
+        logger.info(f"{self.file_basename} since it was last shared: {delta.describe()}")
+
+    def _list_file_set(self) -> None:
+        # nothing is hashed or zipped, the upload starts as soon as the tree has been listed
+        uploader = FileUploaderClass().create_file_uploader(self.cloud_provider)
+        self._file_set = FileSetUploader(uploader)
+        self._prefix = share_prefix(uploader.root_folder, self.file_path)
+        self._object_keys = [object_key_for_path(self._prefix, rel_path) for rel_path in self._manifest.paths]
+        self._uploads = list(range(len(self._manifest)))
+        self.file_size_bytes = self.content_size_bytes
+        self._metrics.add_bytes('package', self.content_size_bytes)
+
+    def _package(self) -> None:
+        if os.path.isdir(self.file_path) and self.stream:
+            self._zipper = FileZipper(workers=self.workers)
+            self._payload = self._zipper.stream_zip(self.file_path, self._manifest)
+            self.file_path = self.target_file
+        elif os.path.isdir(self.file_path) and self.resume and self._archive_is_current():
+            logger.info(f"Resuming with {self.target_file} left by the previous attempt")
+            self.file_path = self.target_file
+            self.file_size_bytes = os.path.getsize(self.target_file)
+            self.zipped_here = True
+        elif os.path.isdir(self.file_path):
             if os.path.exists(self.target_file):
                 os.remove(self.target_file)
-            zipper = FileZipper()
-            self.files_list = zipper.list_files(self.file_path)
-            self.file_path = zipper.create_zip(self.file_path, self.target_file)
+                with UploadStateStore() as store:
+                    store.forget_archive(self.target_file)
+            self._zipper = FileZipper(workers=self.workers)
+            self.file_path = self._zipper.create_zip(self.file_path, self.target_file, self._manifest)
+            self.file_size_bytes = self._zipper.archive_size
             self.zipped_here = True
-        else:
-            self.files_list = [self.file_path]
+            self._metrics.add_bytes('package', self.content_size_bytes, self.file_size_bytes)
+            logger.info(f"Compression: {self._zipper.report.describe()}")
+
+    def _archive_is_current(self) -> bool:
+        # only an archive this share finished writing, of the same files, and still the size it was
+        with UploadStateStore() as store:
+            kept = store.kept_archive(self.target_file)
+        if kept is None:
+            return False
+        try:
+            archive_size = os.path.getsize(self.target_file)
+        except OSError:
+            return False
+        return kept == (manifest_digest(self._manifest), archive_size)
 
     def _upload(self) -> None:
+        if len(self._targets) > 1:
+            self._fan_out()
+            return
+
         uploader_factory = FileUploaderClass()
         uploader = uploader_factory.create_file_uploader(self.cloud_provider)
-        uploader.upload_file(self.file_path, f"{uploader.root_folder}/{os.path.basename(self.file_path)}")
-        self.download_link = uploader.get_shareable_link(f"{uploader.root_folder}/{os.path.basename(self.file_path)}")
+        key_path = f"{uploader.root_folder}/{os.path.basename(self.file_path)}"
+        if self._payload is not None:
+            try:
+                status = uploader.upload_fileobj(self._payload, key_path, size_hint=self.content_size_bytes)
+            finally:
+                self._payload.close()
+            self.file_size_bytes = self._payload.tell()
+            # zipped while it uploaded, so the package stage's time is part of the upload's
+            self._metrics.add_bytes('package', self.content_size_bytes, self.file_size_bytes)
+            logger.info(f"Compression: {self._zipper.report.describe()}")
+        else:
+            status = uploader.upload_file(self.file_path, key_path, resume=self.resume)
+        if status != 200:
+            if self.zipped_here and self._payload is None:
+                # the same archive is needed to pick the upload up again with --resume
+                self._keep_archive = True
+                with UploadStateStore() as store:
+                    store.keep_archive(self.target_file, manifest_digest(self._manifest), self.file_size_bytes)
+                logger.info(f"Keeping {self.target_file} so the upload can be resumed")
+            raise RuntimeError(f"Upload of {key_path} to {self.cloud_provider} failed")
+        self._metrics.add_bytes('upload', self.file_size_bytes, self.file_size_bytes)
+        self.download_link = uploader.get_shareable_link(key_path)
+        self.object_key = key_path
+        self._uploaded_payloads.append((self.cloud_provider, key_path))
+
+    def _upload_file_set(self) -> None:
+        uploaded = self._file_set.upload(self._manifest, self._uploads, self._object_keys, self.file_basename)
+        self._metrics.add_bytes('upload', uploaded, uploaded)
+        # the recipient gets a page linking every file, the unchanged ones from earlier shares too
+        self.object_key, self.download_link = self._file_set.publish_index(
+            self._prefix, self._manifest, self._object_keys,
+            file_basename=self.file_basename,
+            sender_name=self.sender_name,
+            expiry_date=self.expiry_date,
+            local_datetime=str(datetime.now())[:19])
+        if not self.download_link:
+            raise RuntimeError(f"No link could be created for {self.object_key}")
+
+    def _discard_file_set(self) -> None:
+        # a share that failed is never saved, so the sweeper would never find what it uploaded;
+        # an object an older share that hasn't expired links to, the same content under the
+        # same prefix, is left alone
+        if self._file_set is None or not self._file_set.uploaded:
+            return
+        object_keys = list(dict.fromkeys(self._file_set.uploaded))
+        self._file_set.uploaded = []
+        try:
+            connection = get_db_connection()
+            with connection as db:
+                live = db.live_object_keys(self.cloud_provider, object_keys, datetime.now())
+            doomed = [object_key for object_key in object_keys if object_key not in live]
+            deleted = self._file_set.uploader.delete_objects(doomed)
+            logger.info(f"Deleted {len(deleted)} of the {len(doomed)} objects the failed share uploaded")
+        except Exception as e:
+            logger.error(f"Could not delete the objects the failed share uploaded under {self._prefix}: {e}")
+
+    def _keep_unsaved(self) -> None:
+        # the recipient already has the links, so the objects stay and the record is kept on this
+        # machine until save_unsaved can write it, the sweeper runs that before every sweep
+        transfer = {field: getattr(self, field, None) for field in UNSAVED_FIELDS}
+        transfer['expiry_date_dt'] = self.expiry_date_dt.isoformat()
+        transfer['share_metrics'] = self._metrics.to_json()
+        record = json.dumps({
+            'transfer': transfer,
+            'files': [row[1:] for row in self._file_rows(None)],
+            'replicas': [row[1:] for row in self._replica_rows(None)],
+            'payload_digest': self._payload_digest,
+            'payloads': self._uploaded_payloads,
+        })
+        with UploadStateStore() as store:
+            store.add_unsaved(record)
+        logger.warning(f"Transfer of {self.file_basename} to {self.recipient_email} kept locally, "
+                       f"it will be saved before the next sweep")
+
+    def _abandon(self) -> None:
+        # a share that failed before its mail went out is taken back, one that failed after
+        # (in the db stage) can't be, so its record is kept for later instead
+        try:
+            if self.mail_status == 'sent':
+                self._keep_unsaved()
+            else:
+                self._discard_file_set()
+        except Exception as e:
+            logger.error(f"Could not clean up after the failed share of {self.file_basename}: {e}")
+        try:
+            self._forget_payloads()
+        except Exception as e:
+            logger.error(f"Could not forget the payloads the failed share of {self.file_basename} uploaded: {e}")
+
+    @staticmethod
+    def save_unsaved() -> int:
+        # the transfers _keep_unsaved held back, each in a transaction of its own; returns how
+        # many were saved and leaves the rest for the next time
+        saved = 0
+        with UploadStateStore() as store:
+            for unsaved_id, record in store.unsaved():
+                entry = json.loads(record)
+                transfer = entry['transfer']
+                transfer['expiry_date_dt'] = datetime.fromisoformat(transfer['expiry_date_dt'])
+                try:
+                    connection = get_db_connection()
+                    with connection as db:
+                        transfer_id = db.insert_data("transfers", transfer)
+                        db.insert_transfer_files([(transfer_id, *row) for row in entry['files']])
+                        db.insert_transfer_replicas([(transfer_id, *row) for row in entry['replicas']])
+                        for target, object_key in entry.get('payloads', []):
+                            if entry['payload_digest']:
+                                db.save_payload(entry['payload_digest'], target, object_key,
+                                                transfer['file_size_bytes'])
+                            else:
+                                db.forget_payload_key(target, object_key)
+                except Exception as e:
+                    logger.error(f"Saving the transfer of {transfer['file_basename']} failed again: {e}")
+                    break
+                store.delete_unsaved(unsaved_id)
+                saved += 1
+        return saved
+
+    def _fan_out(self) -> None:
+        pending = [target for target in self._targets if target not in self._existing]
+        # the archive, or the file itself, is read once and every pending target gets each chunk
+        source = self._payload if self._payload is not None else open(self.file_path, 'rb')
+        size_hint = self.content_size_bytes if self._payload is not None else self.file_size_bytes
+        try:
+            results = FanOutUploader(pending).upload(source, os.path.basename(self.file_path), size_hint)
+        finally:
+            source.close()
+        if self._payload is not None:
+            self.file_size_bytes = self._payload.tell()
+            self._metrics.add_bytes('package', self.content_size_bytes, self.file_size_bytes)
+            logger.info(f"Compression: {self._zipper.report.describe()}")
+
+        uploaded = [result for result in results if result.ok]
+        for result in results:
+            # per target throughput, kept apart from the upload stage that covers all of them
+            record = self._metrics.target(result.target)
+            record.wall_seconds += result.seconds
+            record.bytes_out += result.bytes
+            record.ok = result.ok
+        self._metrics.add_bytes('upload', self.file_size_bytes, sum(result.bytes for result in uploaded))
+
+        factory = FileUploaderClass()
+        for target, (object_key, _) in self._existing.items():
+            download_link = factory.create_file_uploader(target).get_shareable_link(object_key)
+            if download_link:
+                self._replicas[target] = (object_key, download_link)
+        for result in uploaded:
+            self._replicas[result.target] = (result.key_path, result.download_link)
+        if not self._replicas:
+            raise RuntimeError(f"Upload of {os.path.basename(self.file_path)} failed on every target")
+
+        self.cloud_provider = choose_replica(self.recipient_email, [target for target in self._targets
+                                                                    if target in self._replicas])
+        self.object_key, self.download_link = self._replicas[self.cloud_provider]
+        self._uploaded_payloads.extend((result.target, result.key_path) for result in uploaded)
+
+    def _save_payloads(self, db) -> None:
+        # in the transfer's transaction, so a later share only reuses an object the sweeper knows about
+        for target, object_key in self._uploaded_payloads:
+            if self._payload_digest:
+                db.save_payload(self._payload_digest, target, object_key, self.file_size_bytes)
+            else:
+                db.forget_payload_key(target, object_key)
+
+    def _forget_payloads(self) -> None:
+        # the keys were overwritten, so whatever the index held for them is gone
+        if not self._uploaded_payloads:
+            return
+        connection = get_db_connection()
+        with connection as db:
+            for target, object_key in self._uploaded_payloads:
+                db.forget_payload_key(target, object_key)
+
+    def _replica_rows(self, transfer_id: int) -> list:
+        # the transfer row itself holds the copy that was mailed
+        return [(transfer_id, target, object_key, download_link)
+                for target, (object_key, download_link) in self._replicas.items() if target != self.cloud_provider]
 
     def _complete_context(self) -> None:
-        self.file_size_bytes = os.path.getsize(self.file_path)
         self.file_size_mb = round(self.file_size_bytes / 1024 / 1024, 2)
         self.file_count = len(self.files_list)
 
@@ -68,21 +408,72 @@ class NiftyCore:
         self.local_datetime = str(datetime.now())[:19]
 
     def _create_mail_content(self) -> str:
+        # the mailer modules pull in jinja2 and smtplib, so they're imported once a share
+        # gets as far as mailing rather than when the CLI starts
+        from mailer.email_formatter import EmailTemplateRenderer
+
         self._complete_context()
         renderer = EmailTemplateRenderer(template_dir='mail_templates')
         return renderer.render_template(self.template, **self.as_dict())
 
     def _send_mail(self) -> None:
+        from mailer.email_sender import EmailSender
+
         sender = EmailSender()
-        sender.send_email(self.recipient_email, 'File Shared With You', self._create_mail_content())
+        content = self._create_mail_content()
+        self._metrics.add_bytes('mail', bytes_out=len(content))
+        sent = sender.send_email(self.recipient_email, 'File Shared With You', content)
+        self.mail_status = 'sent' if sent else 'failed'
+
+    def _queued_mail(self):
+        if not self.async_mail:
+            return None
+        from mailer.email_sender import EmailSender
+
+        self.mail_status = 'queued'
+        return EmailSender().build_message(self.recipient_email, 'File Shared With You', self._create_mail_content())
 
     def _save_to_db(self) -> None:
+        NiftyCore.save_transfers([self])
+
+    def _file_rows(self, transfer_id: int) -> list:
+        if self._manifest is None:
+            return []
+        path_keys = self._path_keys or manifest_path_keys(self._manifest)
+        # digests are only known when the dedup check hashed the files
+        digests = self._file_digests or [None] * len(self._manifest)
+        object_keys = self._object_keys or [None] * len(self._manifest)
+        return [(transfer_id, index, rel_path, path_keys[index], size, digests[index], mtime, object_keys[index])
+                for index, (rel_path, size, mtime, _) in enumerate(self._manifest)]
+
+    @staticmethod
+    def save_transfers(shares: list) -> None:
+        # every record in one transaction on one connection; the transfers are inserted one
+        # at a time since their files and queued mail need the new id, the files of every
+        # share then go in as a single bulk insert
+        queued = [(share, share._queued_mail()) for share in shares]
         connection = get_db_connection()
         with connection as db:
-            db.insert_data("transfers", self.as_dict())
+            file_rows, replica_rows = [], []
+            for share, message in queued:
+                # the stages timed so far, the database write itself isn't included
+                share.share_metrics = share._metrics.to_json()
+                transfer_id = db.insert_data("transfers", share.as_dict())
+                share._save_payloads(db)
+                file_rows.extend(share._file_rows(transfer_id))
+                replica_rows.extend(share._replica_rows(transfer_id))
+                if message is not None:
+                    from mailer.outbox import queue_message
+                    queue_message(db, transfer_id, message)
+                    logger.info(f"Mail to {share.recipient_email} queued, run python -m mailer.outbox to send it")
+            db.insert_transfer_files(file_rows)
+            db.insert_transfer_replicas(replica_rows)
 
     def _cleanup(self) -> None:
-        if self.zipped_here:
+        if self.zipped_here and not self._keep_archive:
+            if self.resume:
+                with UploadStateStore() as store:
+                    store.forget_archive(self.target_file)
             try:
                 os.remove(self.target_file)
             except FileNotFoundError:
@@ -93,11 +484,61 @@ class NiftyCore:
                 logger.error(f"Could not delete {self.target_file} - {e}")
 
     def as_dict(self) -> dict:
-        return self.__dict__
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+    def _prepare(self) -> None:
+        self._scan()
+        if self.incremental:
+            self._plan_file_set()
+            return
+        if not self.archive and os.path.isdir(self.file_path):
+            self._list_file_set()
+            return
+        self._reused_upload = self._find_existing_upload()
+        if not self._reused_upload:
+            self._package()
+
+    def _transfer(self) -> None:
+        if self._file_set is not None:
+            self._upload_file_set()
+        elif not self._reused_upload:
+            self._upload()
+
+    def stages(self) -> list:
+        if self.async_mail:
+            # the message is queued alongside the transfer record and sent by the outbox worker
+            return [
+                ('package', self._prepare),
+                ('upload', self._transfer),
+                ('db', self._save_to_db),
+            ]
+        return [
+            ('package', self._prepare),
+            ('upload', self._transfer),
+            ('mail', self._send_mail),
+            ('db', self._save_to_db),
+        ]
+
+    def run_stage(self, stage: str, run) -> None:
+        with self._metrics.stage(stage):
+            run()
+
+    def _export_metrics(self, ok: bool) -> None:
+        logger.info(f"Stages: {self._metrics.describe()}")
+        exporter.export(self._metrics, {
+            'file_basename': self.file_basename,
+            'recipient_email': self.recipient_email,
+            'cloud_provider': self.cloud_provider,
+        }, ok)
 
     def share(self) -> None:
-        self._package()
-        self._upload()
-        self._send_mail()
-        self._save_to_db()
-        self._cleanup()
+        ok = False
+        try:
+            for stage, run in self.stages():
+                self.run_stage(stage, run)
+            ok = True
+        finally:
+            if not ok:
+                self._abandon()
+            self.run_stage('cleanup', self._cleanup)
+            self._export_metrics(ok)
@@ -1,18 +1,97 @@
-import os
+import atexit
+import importlib
 import sqlite3
-import mysql.connector
+import threading
 
+from database.transfer_query import (TRANSFER_COLUMNS, TRANSFER_INDEXES, TransferFilter, TransferPage,
+                                     build_transfer_query, with_cursor_columns)
 from settings import DatabaseConfig
+from zipper.content_hash import path_key
+
+# dedup index tables, the definitions are valid for both sqlite and mysql
+PAYLOADS_COLS = "digest CHAR(64) NOT NULL, " \
+                "provider VARCHAR(50) NOT NULL, " \
+                "object_key VARCHAR(500) NOT NULL, " \
+                "file_size_bytes BIGINT, " \
+                "date_added DATETIME DEFAULT CURRENT_TIMESTAMP, " \
+                "PRIMARY KEY (digest, provider)"
+
+FILE_HASHES_COLS = "path_key CHAR(64) PRIMARY KEY, " \
+                "file_path TEXT, " \
+                "file_size_bytes BIGINT, " \
+                "mtime DOUBLE, " \
+                "digest CHAR(64)"
+
+# one row per file of a transfer, path_key is content_hash.path_key of the file's absolute path;
+# object_key is only set when the file was uploaded as an object of its own, see integrations.file_set
+TRANSFER_FILES_COLS = "transfer_id BIGINT NOT NULL, " \
+                "file_index INT NOT NULL, " \
+                "file_path TEXT, " \
+                "path_key CHAR(64), " \
+                "file_size_bytes BIGINT, " \
+                "digest CHAR(64), " \
+                "mtime DOUBLE, " \
+                "object_key VARCHAR(500), " \
+                "PRIMARY KEY (transfer_id, file_index)"
+
+# reverse lookups, which transfers contained a given file or given content, and which
+# transfers still link to an object
+TRANSFER_FILES_INDEXES = {
+    'idx_transfer_files_path': 'path_key',
+    'idx_transfer_files_digest': 'digest',
+    'idx_transfer_files_object': 'object_key',
+}
+
+# copies of a fanned out transfer besides the one its row links to, so they're swept with it
+TRANSFER_REPLICAS_COLS = "transfer_id BIGINT NOT NULL, " \
+                "provider VARCHAR(50) NOT NULL, " \
+                "object_key VARCHAR(500), " \
+                "download_link TEXT, " \
+                "PRIMARY KEY (transfer_id, provider)"
+
+TRANSFER_REPLICAS_INDEXES = {
+    'idx_transfer_replicas_object': 'provider, object_key',
+}
+
+# rendered messages waiting for the outbox worker, valid for both sqlite and mysql
+OUTBOX_COLS = "message_id CHAR(32) PRIMARY KEY, " \
+                "transfer_id BIGINT, " \
+                "recipient_email VARCHAR(100), " \
+                "message MEDIUMTEXT, " \
+                "status VARCHAR(20) DEFAULT 'pending', " \
+                "attempts INT DEFAULT 0, " \
+                "next_attempt_at DOUBLE, " \
+                "last_error TEXT, " \
+                "date_added DATETIME DEFAULT CURRENT_TIMESTAMP"
+
+# keeps IN (...) lists well under the sqlite variable limit
+LOOKUP_BATCH_SIZE = 500
+
+# rows per executemany call, bounds the size of mysql's rewritten multi-row INSERT
+INSERT_BATCH_SIZE = 5000
 
 class DatabaseFactory:
+
+    # db_type -> "module:class"; a backend's driver is only imported once it's connected to
+    backends = {
+        'sqlite': 'database.database:SQLiteDatabase',
+        'mysql': 'database.database:MySQLDatabase',
+    }
+
+    @staticmethod
+    def register(db_type: str, target) -> None:
+        # target is a Database subclass, or "module:class" to keep it unimported until used
+        DatabaseFactory.backends[db_type] = target
+
     @staticmethod
     def create_database(db_type: str, **kwargs):
-        if db_type == "mysql":
-            return MySQLDatabase(**kwargs)
-        elif db_type == "sqlite":
-            return SQLiteDatabase(**kwargs)
-        else:
+        target = DatabaseFactory.backends.get(db_type)
+        if target is None:
             raise ValueError("Invalid database type")
+        if isinstance(target, str):
+            module_name, _, class_name = target.partition(':')
+            target = getattr(importlib.import_module(module_name), class_name)
+        return target(**kwargs)
 
 
 class Database:
@@ -24,34 +103,399 @@ class Database:
 
         cursor.close()
 
-    def insert_data(self, table_name: str, params: dict) -> None:
+    def add_column(self, table_name: str, column_name: str, column_definition: str) -> None:
+        # brings tables created by older versions up to date, a no-op once the column exists
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT * FROM {table_name} LIMIT 0")
+        columns = {description[0] for description in cursor.description}
+        cursor.fetchall()
+        if column_name not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
+        cursor.close()
+
+    def create_index(self, table_name: str, index_name: str, columns: str) -> None:
+        if self._index_exists(table_name, index_name):
+            return
+        cursor = self.connection.cursor()
+        cursor.execute(f"CREATE INDEX {index_name} ON {table_name} ({columns})")
+        cursor.close()
 
+    @staticmethod
+    def _row_params(table_name: str, params: dict) -> dict:
         params['table_name'] = table_name
-        params['files_list'] = ", ".join(params['files_list'])
+        # the files are stored a row each in transfer_files, see insert_transfer_files
+        params['files_list'] = None
+        return params
+
+    def insert_data(self, table_name: str, params: dict) -> int:
+
+        cursor = self.connection.cursor()
+        cursor.execute(self.insert_query, self._row_params(table_name, params))
+        row_id = cursor.lastrowid
+
+        cursor.close()
+
+        return row_id
+
+    def insert_transfer_files(self, rows: list) -> None:
+        # rows are (transfer_id, file_index, file_path, path_key, file_size_bytes, digest, mtime, object_key)
+        if not rows:
+            return
+        cursor = self.connection.cursor()
+        markers = ", ".join([self.placeholder] * 8)
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            cursor.executemany(f"INSERT INTO transfer_files "
+                               f"(transfer_id, file_index, file_path, path_key, file_size_bytes, digest, mtime, object_key) "
+                               f"VALUES ({markers})",
+                               rows[start:start + INSERT_BATCH_SIZE])
+        cursor.close()
+
+    def insert_transfer_replicas(self, rows: list) -> None:
+        # rows are (transfer_id, provider, object_key, download_link)
+        if not rows:
+            return
+        cursor = self.connection.cursor()
+        cursor.executemany(f"INSERT INTO transfer_replicas (transfer_id, provider, object_key, download_link) "
+                           f"VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder})",
+                           rows)
+        cursor.close()
+
+    def transfer_replicas(self, transfer_id: int) -> list:
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT provider, object_key, download_link FROM transfer_replicas "
+                       f"WHERE transfer_id = {self.placeholder} ORDER BY provider", (transfer_id,))
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+
+    def transfer_files(self, transfer_id: int) -> list:
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT file_path, file_size_bytes, digest FROM transfer_files "
+                       f"WHERE transfer_id = {self.placeholder} ORDER BY file_index", (transfer_id,))
+        results = cursor.fetchall()
+        cursor.close()
+        return results
+
+    def last_file_set(self, provider: str, prefix: str, now) -> list:
+        # the files of the newest live share uploaded file by file under prefix, as
+        # (file_path, path_key, file_size_bytes, mtime, digest, object_key); an expired share's
+        # objects may be swept at any moment, so they're never built on
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT id FROM transfers WHERE cloud_provider = {self.placeholder} "
+                       f"AND object_key >= {self.placeholder} AND object_key < {self.placeholder} "
+                       f"AND expiry_date >= {self.placeholder} AND purged_at IS NULL ORDER BY id DESC LIMIT 1",
+                       (provider, f"{prefix}/", f"{prefix}0", now))
+        row = cursor.fetchone()
+        results = []
+        if row:
+            cursor.execute(f"SELECT file_path, path_key, file_size_bytes, mtime, digest, object_key FROM transfer_files "
+                           f"WHERE transfer_id = {self.placeholder} AND object_key IS NOT NULL ORDER BY file_index",
+                           (row[0],))
+            results = cursor.fetchall()
+        cursor.close()
+        return results
+
+    def find_payload(self, digest: str, provider: str) -> tuple | None:
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT object_key, file_size_bytes FROM payloads "
+                       f"WHERE digest = {self.placeholder} AND provider = {self.placeholder}", (digest, provider))
+        result = cursor.fetchone()
+        cursor.close()
+        return result
+
+    def forget_payload_key(self, provider: str, object_key: str) -> None:
+        cursor = self.connection.cursor()
+        cursor.execute(f"DELETE FROM payloads WHERE provider = {self.placeholder} AND object_key = {self.placeholder}",
+                       (provider, object_key))
+        cursor.close()
+
+    def forget_payload_keys(self, provider: str, object_keys: list) -> None:
+        cursor = self.connection.cursor()
+        cursor.executemany(f"DELETE FROM payloads WHERE provider = {self.placeholder} AND object_key = {self.placeholder}",
+                           [(provider, object_key) for object_key in object_keys])
+        cursor.close()
+
+    def save_payload(self, digest: str, provider: str, object_key: str, file_size_bytes: int) -> None:
+        # the key may have been overwritten by a different payload of the same name
+        self.forget_payload_key(provider, object_key)
+        cursor = self.connection.cursor()
+        cursor.execute(f"REPLACE INTO payloads (digest, provider, object_key, file_size_bytes) "
+                       f"VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder})",
+                       (digest, provider, object_key, file_size_bytes))
+        cursor.close()
+
+    def get_file_hashes(self, path_keys: list) -> dict:
+        cursor = self.connection.cursor()
+        results = {}
+        for start in range(0, len(path_keys), LOOKUP_BATCH_SIZE):
+            batch = path_keys[start:start + LOOKUP_BATCH_SIZE]
+            markers = ", ".join([self.placeholder] * len(batch))
+            cursor.execute(f"SELECT path_key, file_size_bytes, mtime, digest FROM file_hashes "
+                           f"WHERE path_key IN ({markers})", batch)
+            for path_key, size, mtime, digest in cursor.fetchall():
+                results[path_key] = (size, mtime, digest)
+        cursor.close()
+        return results
+
+    def save_file_hashes(self, rows: list) -> None:
+        if not rows:
+            return
+        cursor = self.connection.cursor()
+        cursor.executemany(f"REPLACE INTO file_hashes (path_key, file_path, file_size_bytes, mtime, digest) "
+                           f"VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, "
+                           f"{self.placeholder}, {self.placeholder})", rows)
+        cursor.close()
+
+    def enqueue_mail(self, message_id: str, transfer_id: int, recipient_email: str, message: str,
+                     next_attempt_at: float) -> None:
+        cursor = self.connection.cursor()
+        cursor.execute(f"INSERT INTO outbox (message_id, transfer_id, recipient_email, message, next_attempt_at) "
+                       f"VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, "
+                       f"{self.placeholder})", (message_id, transfer_id, recipient_email, message, next_attempt_at))
+        cursor.close()
+
+    def due_mail(self, now: float, limit: int) -> list:
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT message_id, transfer_id, recipient_email, message, attempts, next_attempt_at FROM outbox "
+                       f"WHERE status = 'pending' AND next_attempt_at <= {self.placeholder} "
+                       f"ORDER BY next_attempt_at LIMIT {int(limit)}", (now,))
+        results = cursor.fetchall()
+        cursor.close()
+        return results
 
+    def claim_mail(self, message_id: str, next_attempt_at: float, lease_until: float) -> bool:
+        # only succeeds for one worker, the others see next_attempt_at has moved on; if the
+        # worker dies the message becomes due again when the lease runs out
         cursor = self.connection.cursor()
-        cursor.execute(self.insert_query, params)
+        cursor.execute(f"UPDATE outbox SET next_attempt_at = {self.placeholder} "
+                       f"WHERE message_id = {self.placeholder} AND status = 'pending' "
+                       f"AND next_attempt_at = {self.placeholder}", (lease_until, message_id, next_attempt_at))
+        claimed = cursor.rowcount == 1
+        cursor.close()
+        return claimed
 
+    def mark_mail_sent(self, message_id: str, transfer_id: int) -> None:
+        cursor = self.connection.cursor()
+        cursor.execute(f"DELETE FROM outbox WHERE message_id = {self.placeholder}", (message_id,))
+        cursor.execute(f"UPDATE transfers SET mail_status = 'sent' WHERE id = {self.placeholder}", (transfer_id,))
         cursor.close()
 
-    def select_data(self, table_name: str, condition: str=None, columns: str="*") -> list:
+    def retry_mail(self, message_id: str, attempts: int, next_attempt_at: float, error: str) -> None:
+        cursor = self.connection.cursor()
+        cursor.execute(f"UPDATE outbox SET attempts = {self.placeholder}, next_attempt_at = {self.placeholder}, "
+                       f"last_error = {self.placeholder} WHERE message_id = {self.placeholder}",
+                       (attempts, next_attempt_at, error, message_id))
+        cursor.close()
+
+    def fail_mail(self, message_id: str, transfer_id: int, attempts: int, error: str) -> None:
+        cursor = self.connection.cursor()
+        cursor.execute(f"UPDATE outbox SET status = 'failed', attempts = {self.placeholder}, last_error = {self.placeholder} "
+                       f"WHERE message_id = {self.placeholder}", (attempts, error, message_id))
+        cursor.execute(f"UPDATE transfers SET mail_status = 'failed' WHERE id = {self.placeholder}", (transfer_id,))
+        cursor.close()
+
+    def select_data(self, table_name: str, condition: str=None, columns: str="*", params: tuple=()) -> list:
         cursor = self.connection.cursor()
 
         select_query = f"SELECT {columns} FROM {table_name}"
         if condition:
             select_query += f" WHERE {condition}"
 
-        cursor.execute(select_query)
+        cursor.execute(select_query, params)
         results = cursor.fetchall()
 
         cursor.close()
 
         return results
 
+    def find_transfers(self, filters: TransferFilter=None, limit: int=100, after: tuple=None, order_by: str='id',
+                       descending: bool=True, columns: str=TRANSFER_COLUMNS) -> TransferPage:
+        query, params = build_transfer_query(filters, self.placeholder, with_cursor_columns(columns, order_by),
+                                             order_by, descending, after, limit + 1)
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        names = [description[0] for description in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        cursor.close()
+
+        # the extra row only says whether there's another page
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1][order_by], rows[-1]['id'])
+        return TransferPage(rows, next_cursor)
+
+    def transfers_containing(self, file_path: str=None, digest: str=None, limit: int=100,
+                             columns: str=TRANSFER_COLUMNS) -> list:
+        # index seeks on transfer_files, by the file's location or by its content
+        if (file_path is None) == (digest is None):
+            raise ValueError("Pass either a file_path or a digest")
+        column, value = ('path_key', path_key(file_path)) if file_path is not None else ('digest', digest)
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT {columns} FROM transfers WHERE id IN "
+                       f"(SELECT transfer_id FROM transfer_files WHERE {column} = {self.placeholder}) "
+                       f"ORDER BY id DESC LIMIT {int(limit)}", (value,))
+        names = [description[0] for description in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        cursor.close()
+        return rows
+
+    def expired_objects(self, now) -> list:
+        # walks idx_transfers_expiry; rows saved before object keys were recorded can't be swept
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT id, cloud_provider, object_key FROM transfers "
+                       f"WHERE expiry_date < {self.placeholder} AND purged_at IS NULL AND object_key IS NOT NULL "
+                       f"ORDER BY expiry_date", (now,))
+        results = cursor.fetchall()
+        # and the other copies of fanned out transfers
+        cursor.execute(f"SELECT transfers.id, transfer_replicas.provider, transfer_replicas.object_key "
+                       f"FROM transfers JOIN transfer_replicas ON transfer_replicas.transfer_id = transfers.id "
+                       f"WHERE transfers.expiry_date < {self.placeholder} AND transfers.purged_at IS NULL",
+                       (now,))
+        results += cursor.fetchall()
+        # and the objects of shares uploaded file by file
+        cursor.execute(f"SELECT DISTINCT transfers.id, transfers.cloud_provider, transfer_files.object_key "
+                       f"FROM transfers JOIN transfer_files ON transfer_files.transfer_id = transfers.id "
+                       f"WHERE transfers.expiry_date < {self.placeholder} AND transfers.purged_at IS NULL "
+                       f"AND transfer_files.object_key IS NOT NULL", (now,))
+        results += cursor.fetchall()
+        cursor.close()
+        return results
+
+    def live_object_keys(self, provider: str, object_keys: list, now) -> set:
+        # the keys still linked from a share that hasn't expired, dedup lets several shares
+        # point at one object and a re-upload of the same name reuses its key
+        cursor = self.connection.cursor()
+        live = set()
+        for start in range(0, len(object_keys), LOOKUP_BATCH_SIZE):
+            batch = object_keys[start:start + LOOKUP_BATCH_SIZE]
+            markers = ", ".join([self.placeholder] * len(batch))
+            cursor.execute(f"SELECT DISTINCT object_key FROM transfers "
+                           f"WHERE expiry_date >= {self.placeholder} AND purged_at IS NULL "
+                           f"AND cloud_provider = {self.placeholder} AND object_key IN ({markers})",
+                           [now, provider, *batch])
+            live.update(row[0] for row in cursor.fetchall())
+            cursor.execute(f"SELECT DISTINCT transfer_replicas.object_key FROM transfer_replicas "
+                           f"JOIN transfers ON transfers.id = transfer_replicas.transfer_id "
+                           f"WHERE transfers.expiry_date >= {self.placeholder} AND transfers.purged_at IS NULL "
+                           f"AND transfer_replicas.provider = {self.placeholder} "
+                           f"AND transfer_replicas.object_key IN ({markers})",
+                           [now, provider, *batch])
+            live.update(row[0] for row in cursor.fetchall())
+            # an unchanged file is uploaded once and linked from every later share of its folder
+            cursor.execute(f"SELECT DISTINCT transfer_files.object_key FROM transfer_files "
+                           f"JOIN transfers ON transfers.id = transfer_files.transfer_id "
+                           f"WHERE transfers.expiry_date >= {self.placeholder} AND transfers.purged_at IS NULL "
+                           f"AND transfers.cloud_provider = {self.placeholder} "
+                           f"AND transfer_files.object_key IN ({markers})",
+                           [now, provider, *batch])
+            live.update(row[0] for row in cursor.fetchall())
+        cursor.close()
+        return live
+
+    def mark_purged(self, transfer_ids: list, purged_at) -> None:
+        cursor = self.connection.cursor()
+        for start in range(0, len(transfer_ids), LOOKUP_BATCH_SIZE):
+            batch = transfer_ids[start:start + LOOKUP_BATCH_SIZE]
+            markers = ", ".join([self.placeholder] * len(batch))
+            cursor.execute(f"UPDATE transfers SET purged_at = {self.placeholder} WHERE id IN ({markers})",
+                           [purged_at, *batch])
+        cursor.close()
+
+    def iter_transfers(self, filters: TransferFilter=None, order_by: str='id', descending: bool=False,
+                       columns: str=TRANSFER_COLUMNS, batch_size: int=1000):
+        # rows are fetched batch_size at a time as the caller iterates, so memory stays flat
+        # however many match; consume it inside the connection context
+        query, params = build_transfer_query(filters, self.placeholder, columns, order_by, descending)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, params)
+            names = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(names, row))
+        finally:
+            cursor.close()
+
+# columns added to transfers after its first release, for databases created before them
+TRANSFER_MIGRATIONS = (
+    ("mail_status", "VARCHAR(20)"),
+    ("cloud_provider", "VARCHAR(50)"),
+    ("object_key", "VARCHAR(500)"),
+    ("purged_at", "DATETIME"),
+    ("share_metrics", "TEXT"),
+)
+
+# and to transfer_files
+TRANSFER_FILES_MIGRATIONS = (
+    ("mtime", "DOUBLE"),
+    ("object_key", "VARCHAR(500)"),
+)
+
+
+# connections are kept for the life of the process, keyed by database, and every
+# Database object opened against the same database shares them
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _SQLiteHandle:
+
+    def __init__(self, db_file: str) -> None:
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        # WAL lets the outbox worker and other processes read while a share writes, and
+        # with it NORMAL sync is still safe against corruption while skipping most fsyncs
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # one thread at a time per transaction, sqlite connections can't interleave them
+        self.lock = threading.RLock()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class _MySQLPool:
+
+    def __init__(self, size: int, **kwargs) -> None:
+        # the connector takes a noticeable time to import, sqlite users never need it
+        from mysql.connector import pooling
+
+        self.pool = pooling.MySQLConnectionPool(pool_name=f"nifty_{len(_pools)}", pool_size=size, **kwargs)
+        # the pool raises when it runs dry, this makes callers wait for a connection instead
+        self.slots = threading.BoundedSemaphore(size)
+
+
+def _shared(key: tuple, create):
+    with _pools_lock:
+        shared = _pools.get(key)
+        if shared is None:
+            shared = create()
+            _pools[key] = shared
+    return shared
+
+
+@atexit.register
+def close_connections() -> None:
+    with _pools_lock:
+        shared = list(_pools.values())
+        _pools.clear()
+    for handle in shared:
+        if isinstance(handle, _SQLiteHandle):
+            handle.close()
+
+
 class SQLiteDatabase(Database):
+    placeholder = "?"
+
     def __init__(self, db_file: str) -> None:
-        self.db_file = DatabaseConfig.SQLITE_DB_FILENAME
+        self.db_file = db_file or DatabaseConfig.SQLITE_DB_FILENAME
+        self.pool_key = ('sqlite', self.db_file)
         self.connection = None
+        self._handle = None
 
         self.insert_query = """
         INSERT INTO transfers
@@ -64,6 +508,10 @@ class SQLiteDatabase(Database):
             expiry_date,
             file_size_bytes,
             files_list,
+            mail_status,
+            cloud_provider,
+            object_key,
+            share_metrics,
             date_added
         )
         VALUES
@@ -76,27 +524,51 @@ class SQLiteDatabase(Database):
             :expiry_date_dt,
             :file_size_bytes,
             :files_list,
+            :mail_status,
+            :cloud_provider,
+            :object_key,
+            :share_metrics,
             :local_datetime
         );
         """
 
+    def _index_exists(self, table_name: str, index_name: str) -> bool:
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name = ?",
+                       (table_name, index_name))
+        exists = cursor.fetchone() is not None
+        cursor.close()
+        return exists
+
     def __enter__(self) -> None:
-        self.connection = sqlite3.connect(self.db_file)
+        self._handle = _shared(self.pool_key, lambda: _SQLiteHandle(self.db_file))
+        self._handle.lock.acquire()
+        self.connection = self._handle.connection
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        if self.connection:
-            self.connection.commit()
-            self.connection.close()
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection = None
+            self._handle.lock.release()
     
 
 class MySQLDatabase(Database):
-    def __init__(self, host: str, user: str, password: str, database: str) -> None:
+    placeholder = "%s"
+
+    def __init__(self, host: str, user: str, password: str, database: str, pool_size: int = 5) -> None:
         self.host = host
         self.user = user
         self.password = password
         self.database = database
+        self.pool_size = pool_size
+        self.pool_key = ('mysql', host, user, database)
         self.connection = None
+        self._pool = None
         self.insert_query = """
             INSERT INTO transfers
             (
@@ -107,7 +579,11 @@ class MySQLDatabase(Database):
                 recipient_email,
                 expiry_date,
                 file_size_bytes,
-                files_list
+                files_list,
+                mail_status,
+                cloud_provider,
+                object_key,
+                share_metrics
             )
             VALUES
             (
@@ -118,23 +594,87 @@ class MySQLDatabase(Database):
                 %(recipient_email)s,
                 %(expiry_date_dt)s,
                 %(file_size_bytes)s,
-                %(files_list)s
+                %(files_list)s,
+                %(mail_status)s,
+                %(cloud_provider)s,
+                %(object_key)s,
+                %(share_metrics)s
             );
             """
 
+    def _index_exists(self, table_name: str, index_name: str) -> bool:
+        # mysql has no CREATE INDEX IF NOT EXISTS
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT 1 FROM information_schema.statistics "
+                       "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+                       (table_name, index_name))
+        exists = cursor.fetchone() is not None
+        cursor.close()
+        return exists
+
     def __enter__(self) -> None:
-        self.connection = mysql.connector.connect(
+        self._pool = _shared(self.pool_key, lambda: _MySQLPool(
+            self.pool_size,
             host=self.host,
             user=self.user,
             password=self.password,
             database=self.database
-        )
+        ))
+        self._pool.slots.acquire()
+        try:
+            self.connection = self._pool.pool.get_connection()
+        except Exception:
+            self._pool.slots.release()
+            raise
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        if self.connection:
-            self.connection.commit()
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            # returns it to the pool rather than disconnecting
             self.connection.close()
+            self.connection = None
+            self._pool.slots.release()
+
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def create_schema(db: Database, transfers_cols: str) -> None:
+    # safe to repeat, databases created by older versions get the newer tables and columns
+    db.create_table("transfers", transfers_cols)
+    db.create_table("payloads", PAYLOADS_COLS)
+    db.create_table("file_hashes", FILE_HASHES_COLS)
+    db.create_table("outbox", OUTBOX_COLS)
+    db.create_table("transfer_files", TRANSFER_FILES_COLS)
+    db.create_table("transfer_replicas", TRANSFER_REPLICAS_COLS)
+    for column_name, column_definition in TRANSFER_MIGRATIONS:
+        db.add_column("transfers", column_name, column_definition)
+    for column_name, column_definition in TRANSFER_FILES_MIGRATIONS:
+        db.add_column("transfer_files", column_name, column_definition)
+    for index_name, columns in TRANSFER_INDEXES.items():
+        db.create_index("transfers", index_name, columns)
+    for index_name, columns in TRANSFER_FILES_INDEXES.items():
+        db.create_index("transfer_files", index_name, columns)
+    for index_name, columns in TRANSFER_REPLICAS_INDEXES.items():
+        db.create_index("transfer_replicas", index_name, columns)
+
+
+def _ensure_schema(db: Database, transfers_cols: str) -> None:
+    # once per database per process rather than on every connection
+    if db.pool_key in _schema_ready:
+        return
+    with _schema_lock:
+        if db.pool_key in _schema_ready:
+            return
+        with db:
+            create_schema(db, transfers_cols)
+        _schema_ready.add(db.pool_key)
 
 
 def get_db_connection():
@@ -147,26 +687,18 @@ def get_db_connection():
             host=db_config.MYSQL_DB_HOST,
             user=db_config.MYSQL_DB_USERNAME,
             password=db_config.MYSQL_DB_PASSWORD,
-            database=db_config.MYSQL_DB_NAME)
+            database=db_config.MYSQL_DB_NAME,
+            pool_size=getattr(db_config, 'MYSQL_POOL_SIZE', 5))
 
-        with mysql_db as db:
-            db.create_table("transfers", db_config.MYSQL_COLS)
+        _ensure_schema(mysql_db, db_config.MYSQL_COLS)
 
         return mysql_db
 
     elif db_config.DB_TYPE == "sqlite":
-        db_file=db_config.SQLITE_DB_FILENAME
-        if not os.path.exists(db_file):
-
-            sqlite_db = DatabaseFactory.create_database(
-                db_type="sqlite",
-                db_file=db_config.SQLITE_DB_FILENAME)
+        sqlite_db = DatabaseFactory.create_database(
+            db_type="sqlite",
+            db_file=db_config.SQLITE_DB_FILENAME)
 
-            with sqlite_db as db:
-                db.create_table("transfers", db_config.SQLITE_COLS)
+        _ensure_schema(sqlite_db, db_config.SQLITE_COLS)
 
-        else:
-            sqlite_db = DatabaseFactory.create_database(
-                db_type="sqlite",
-                db_file=db_config.SQLITE_DB_FILENAME)
-        return sqlite_db
\ No newline at end of file
+        return sqlite_db
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+# everything but files_list, which can be large for folders
+TRANSFER_COLUMNS = "id, sender_name, file_basename, sender_address, download_link, recipient_email, " \
+                   "expiry_date, file_size_bytes, mail_status, cloud_provider, object_key, purged_at, date_added"
+
+# the orders pages can be read in, each backed by one of TRANSFER_INDEXES
+SORT_COLUMNS = ('id', 'date_added', 'expiry_date')
+
+# valid for both sqlite and mysql; id is included so keyset pages within one value are index ordered too
+TRANSFER_INDEXES = {
+    'idx_transfers_recipient': 'recipient_email, id',
+    'idx_transfers_expiry': 'expiry_date, id',
+    'idx_transfers_added': 'date_added, id',
+    # not a sort order, backs the object lookups of the sweeper and of incremental shares
+    'idx_transfers_object': 'cloud_provider, object_key',
+}
+
+
+class TransferFilter:
+
+    def __init__(self, recipient_email: str = None, file_basename: str = None,
+                 expires_before: datetime = None, expires_after: datetime = None,
+                 added_before: datetime = None, added_after: datetime = None) -> None:
+        self.recipient_email = recipient_email
+        self.file_basename = file_basename
+        self.expires_before = expires_before
+        self.expires_after = expires_after
+        self.added_before = added_before
+        self.added_after = added_after
+
+    def clauses(self, placeholder: str) -> tuple[list, list]:
+        conditions = (
+            ('recipient_email', '=', self.recipient_email),
+            ('file_basename', '=', self.file_basename),
+            ('expiry_date', '<', self.expires_before),
+            ('expiry_date', '>=', self.expires_after),
+            ('date_added', '<', self.added_before),
+            ('date_added', '>=', self.added_after),
+        )
+        clauses, params = [], []
+        for column, operator, value in conditions:
+            if value is not None:
+                clauses.append(f"{column} {operator} {placeholder}")
+                params.append(value)
+        return clauses, params
+
+
+class TransferPage:
+
+    def __init__(self, rows: list, next_cursor: tuple | None) -> None:
+        self.rows = rows
+        # pass back as after= for the following page, None on the last one
+        self.next_cursor = next_cursor
+
+
+def with_cursor_columns(columns: str, order_by: str) -> str:
+    # a page's cursor is read off its last row, so the sort column and id are selected
+    # even when the caller's columns leave them out
+    selected = [column.strip() for column in columns.split(',')]
+    if '*' in selected:
+        return columns
+    return ", ".join(selected + [column for column in dict.fromkeys((order_by, 'id')) if column not in selected])
+
+
+def build_transfer_query(filters: TransferFilter, placeholder: str, columns: str = TRANSFER_COLUMNS,
+                         order_by: str = 'id', descending: bool = True, after: tuple = None,
+                         limit: int = None) -> tuple[str, list]:
+    if order_by not in SORT_COLUMNS:
+        raise ValueError(f"Can't order transfers by {order_by}")
+
+    clauses, params = (filters or TransferFilter()).clauses(placeholder)
+
+    # keyset pagination, seeks straight to the previous page's last row instead of
+    # counting past it with OFFSET
+    if after is not None:
+        sort_value, last_id = after
+        operator = '<' if descending else '>'
+        if order_by == 'id':
+            clauses.append(f"id {operator} {placeholder}")
+            params.append(last_id)
+        else:
+            clauses.append(f"({order_by} {operator} {placeholder} OR "
+                           f"({order_by} = {placeholder} AND id {operator} {placeholder}))")
+            params.extend([sort_value, sort_value, last_id])
+
+    query = f"SELECT {columns} FROM transfers"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    direction = 'DESC' if descending else 'ASC'
+    query += f" ORDER BY {order_by} {direction}" + (f", id {direction}" if order_by != 'id' else "")
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    return query, params
@@ -0,0 +1,29 @@
+class AzureFileUploader:
+
+    def upload_file(self, file_path: str, resume: bool=False) -> int:
+        # Upload file to Azure
+        pass
+
+    def upload_fileobj(self, file_obj, key_path: str, size_hint: int=0) -> int:
+        # Stream file object to Azure
+        pass
+
+    def upload_object(self, file_path: str, key_path: str, content_type: str=None, callback=None) -> int:
+        # Upload one file of a file by file share to Azure
+        pass
+
+    def upload_bytes(self, data: bytes, key_path: str, content_type: str=None) -> int:
+        # Upload an index page to Azure
+        pass
+
+    def get_shareable_link(self, key_path: str, disposition: str='attachment') -> str:
+        # Get shareable link from Azure
+        pass
+
+    def get_shareable_links(self, key_paths: list, dispositions: list) -> list:
+        # Get a shareable link per blob from Azure
+        return []
+
+    def delete_objects(self, key_paths: list) -> list:
+        # Delete blobs from Azure
+        return []
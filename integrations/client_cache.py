@@ -0,0 +1,63 @@
+import threading
+
+from settings import AwsConfig, GoogleConfig
+
+# one client per provider, credentials and region for the life of the process, so batch
+# and long running use keeps its connection pools and TLS sessions between shares
+_clients = {}
+_lock = threading.RLock()
+
+
+def _cached(key: tuple, create):
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = create()
+                _clients[key] = client
+    return client
+
+
+def get_s3_client(access_key: str, secret_access_key: str, region: str, endpoint_url: str):
+
+    def create():
+        # the SDKs are imported on first use, each costs a few hundred milliseconds to load
+        import boto3
+        from botocore.config import Config
+
+        session = boto3.session.Session(
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_access_key,
+            region_name=region
+        )
+        # several transfers can share the client, each with its own worker threads
+        config = Config(max_pool_connections=getattr(AwsConfig, 'AWS_MAX_POOL_CONNECTIONS', 50))
+        return session.client('s3', endpoint_url=endpoint_url, config=config)
+
+    return _cached(('s3', access_key, secret_access_key, region, endpoint_url), create)
+
+
+def create_gcs_client(credentials_path: str):
+    # uncached, for work that can't share a client such as concurrent batch requests
+    from google.cloud import storage
+
+    endpoint_url = getattr(GoogleConfig, 'GGL_ENDPOINT_URL', None)
+    client_options = {'api_endpoint': endpoint_url} if endpoint_url else None
+    return storage.Client.from_service_account_json(credentials_path, client_options=client_options)
+
+
+def get_gcs_client(credentials_path: str):
+    return _cached(('gcs', credentials_path, getattr(GoogleConfig, 'GGL_ENDPOINT_URL', None)),
+                   lambda: create_gcs_client(credentials_path))
+
+
+def get_gcs_bucket(credentials_path: str, bucket_name: str):
+    # Client.bucket builds the handle locally, get_bucket would cost a metadata round-trip
+    return _cached(('gcs-bucket', credentials_path, bucket_name),
+                   lambda: get_gcs_client(credentials_path).bucket(bucket_name))
+
+
+def clear() -> None:
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,185 @@
+import io
+import fnmatch
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from integrations.file_upload import FileUploaderClass
+from metrics.memory import buffer_budget
+from settings import MailerConfig
+
+logger = logging.getLogger(__name__)
+
+# read from the payload once per chunk and handed to every upload, so with the default
+# depth each target holds at most 16 MiB that the slowest upload hasn't taken yet
+FANOUT_CHUNK_SIZE = 1024 * 1024
+FANOUT_QUEUE_DEPTH = 16
+
+
+class TeeBranch(io.RawIOBase):
+
+    # one upload's view of the payload, a non-seekable stream of the chunks the fan-out reads
+
+    def __init__(self, depth: int) -> None:
+        self._queue = queue.Queue(maxsize=depth)
+        self._current = b""
+        self._offset = 0
+        self._position = 0
+        self._finished = False
+        self._error = None
+        self._aborted = threading.Event()
+
+    def put(self, chunk: bytes | None) -> bool:
+        # False once the upload has stopped reading, so a failed target doesn't hold up the others
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.5)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def finish(self, error: BaseException = None) -> None:
+        self._error = error
+        self.put(None)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            if self._offset >= len(self._current):
+                if self._finished:
+                    break
+                chunk = self._queue.get()
+                if chunk is None:
+                    self._finished = True
+                    if self._error:
+                        raise IOError(f"Reading the payload failed: {self._error}") from self._error
+                    break
+                self._current = chunk
+                self._offset = 0
+            size = min(len(view) - filled, len(self._current) - self._offset)
+            view[filled:filled + size] = self._current[self._offset:self._offset + size]
+            self._offset += size
+            filled += size
+        self._position += filled
+        return filled
+
+    def close(self) -> None:
+        self._aborted.set()
+        super().close()
+
+
+class ReplicaUpload:
+
+    def __init__(self, target: str, key_path: str) -> None:
+        self.target = target
+        self.key_path = key_path
+        self.ok = False
+        self.error = None
+        self.bytes = 0
+        self.seconds = 0.0
+        self.download_link = None
+
+    @property
+    def bytes_per_second(self) -> float | None:
+        if not self.seconds:
+            return None
+        return self.bytes / self.seconds
+
+    def describe(self) -> str:
+        if not self.ok:
+            return f"{self.target} failed: {self.error}"
+        rate = f"{self.bytes_per_second / 1024 / 1024:.1f} MB/s" if self.bytes_per_second else "-"
+        return f"{self.target} {self.bytes / 1024 / 1024:.1f} MB in {self.seconds:.2f}s, {rate}"
+
+
+class FanOutUploader:
+
+    # uploads one payload to several providers or regions at once, reading it a single time
+
+    def __init__(self, targets: list, chunk_size: int = FANOUT_CHUNK_SIZE, depth: int = None) -> None:
+        self.targets = targets
+        self.chunk_size = chunk_size
+        # under a memory ceiling the queues of all the targets share the fan-out's budget
+        self.depth = depth or max(1, buffer_budget('fanout', FANOUT_QUEUE_DEPTH * chunk_size * len(targets))
+                                  // (chunk_size * max(1, len(targets))))
+        factory = FileUploaderClass()
+        self.uploaders = {target: factory.create_file_uploader(target) for target in targets}
+
+    def _upload(self, result: ReplicaUpload, branch: TeeBranch, size_hint: int) -> None:
+        uploader = self.uploaders[result.target]
+        start = time.perf_counter()
+        try:
+            status = uploader.upload_fileobj(branch, result.key_path, size_hint=size_hint)
+            if status != 200:
+                result.error = f"upload returned {status}"
+        except Exception as e:
+            status = None
+            result.error = str(e)
+        finally:
+            # stops the tee waiting on this target if the upload ended early
+            branch.close()
+        result.seconds = time.perf_counter() - start
+        result.bytes = branch.tell()
+        if status == 200:
+            result.download_link = uploader.get_shareable_link(result.key_path)
+            result.ok = result.download_link is not None
+            if not result.ok:
+                result.error = "no shareable link"
+
+    def upload(self, source, file_name: str, size_hint: int = 0) -> list:
+        results = [ReplicaUpload(target, f"{self.uploaders[target].root_folder}/{file_name}")
+                   for target in self.targets]
+        branches = [TeeBranch(self.depth) for _ in self.targets]
+
+        with ThreadPoolExecutor(max_workers=len(self.targets), thread_name_prefix="fanout") as pool:
+            futures = [pool.submit(self._upload, result, branch, size_hint)
+                       for result, branch in zip(results, branches)]
+            error = None
+            try:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    # the same bytes object goes to every branch, nothing is copied per target
+                    delivered = [branch.put(chunk) for branch in branches]
+                    if not any(delivered):
+                        break
+            except BaseException as e:
+                error = e
+            finally:
+                for branch in branches:
+                    branch.finish(error)
+            for future in futures:
+                future.result()
+
+        for result in results:
+            if result.ok:
+                logger.info(f"Replica {result.describe()}")
+            else:
+                logger.error(f"Replica {result.describe()}")
+        return results
+
+
+def choose_replica(recipient_email: str, targets: list, rules: list = None) -> str | None:
+    # rules are (recipient pattern, target) pairs, e.g. ("*.co.za", "AWS:af-south-1"), and the
+    # first that matches a target in targets wins; without a match it's the first target
+    if rules is None:
+        rules = getattr(MailerConfig, 'MAIL_REPLICA_RULES', [])
+    recipient_email = (recipient_email or '').lower()
+    for pattern, target in rules:
+        if target in targets and fnmatch.fnmatch(recipient_email, pattern.lower()):
+            return target
+    return targets[0] if targets else None
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from integrations.progress import ProgressTracker, format_bytes
+from zipper.content_hash import path_key
+from zipper.manifest import Manifest
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# files uploaded at the same time, each one is a request of its own
+UPLOAD_WORKERS = 8
+
+# small files are handed to the workers in batches of up to this many files or bytes, each
+# sent back to back on one pooled connection; larger files are a batch of their own
+BATCH_FILES = 64
+BATCH_BYTES = 8 * 1024 * 1024
+
+# the recipient's page listing every file of the share, in page_templates/
+INDEX_TEMPLATE = 'file_set_index.html'
+
+
+def file_set_prefix(root_folder: str, file_path: str) -> str:
+    # one prefix per shared path, so each share of a folder finds the objects of the last one
+    return f"{root_folder}/{os.path.basename(os.path.abspath(file_path))}-{path_key(file_path)[:12]}"
+
+
+def share_prefix(root_folder: str, file_path: str) -> str:
+    # a prefix of its own for every share uploaded without an archive
+    return f"{root_folder}/{os.path.basename(os.path.abspath(file_path))}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}"
+
+
+def object_key_for_path(prefix: str, rel_path: str) -> str:
+    return f"{prefix}/files/{rel_path}"
+
+
+def object_key_for(prefix: str, digest: str) -> str:
+    # named by content, so an unchanged or renamed file keeps its object and a changed one
+    # never overwrites the object an older share still links to
+    return f"{prefix}/objects/{digest}"
+
+
+def attachment_disposition(file_name: str) -> str:
+    # the file's own name when it's downloaded, rather than its digest
+    fallback = file_name.encode('ascii', 'replace').decode('ascii').replace('"', "'").replace('\\', '_')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(file_name, safe='')}"
+
+
+class FileSetDelta:
+
+    def __init__(self) -> None:
+        self.new_files = 0
+        self.changed_files = 0
+        self.unchanged_files = 0
+        self.removed_files = 0
+        self.upload_bytes = 0
+        self.reused_bytes = 0
+
+    def describe(self) -> str:
+        return (f"{self.new_files} new, {self.changed_files} changed, {self.unchanged_files} unchanged and "
+                f"{self.removed_files} removed files, {format_bytes(self.upload_bytes)} to upload and "
+                f"{format_bytes(self.reused_bytes)} already uploaded")
+
+
+def plan_file_set(manifest: Manifest, digests: list, prefix: str, previous: list) -> tuple:
+    # previous is Database.last_file_set, the files of the last share under prefix; returns the
+    # object key of every file in manifest order, the indexes of the files to upload and the delta
+    uploaded = {row[4]: row[5] for row in previous}
+    before = {row[0]: row[4] for row in previous}
+    delta = FileSetDelta()
+    object_keys, uploads, queued = [], [], set()
+    for index, (rel_path, size, _, _) in enumerate(manifest):
+        digest = digests[index]
+        if rel_path not in before:
+            delta.new_files += 1
+        elif before[rel_path] != digest:
+            delta.changed_files += 1
+        else:
+            delta.unchanged_files += 1
+
+        object_key = uploaded.get(digest) or object_key_for(prefix, digest)
+        object_keys.append(object_key)
+        # copies of one file in the tree are uploaded once
+        if digest in uploaded or object_key in queued:
+            delta.reused_bytes += size
+        else:
+            queued.add(object_key)
+            uploads.append(index)
+            delta.upload_bytes += size
+    delta.removed_files = len(before.keys() - set(manifest.paths))
+    return object_keys, uploads, delta
+
+
+def plan_batches(manifest: Manifest, indexes: list, max_files: int = BATCH_FILES,
+                 max_bytes: int = BATCH_BYTES) -> list:
+    batches, batch, batch_bytes = [], [], 0
+    for index in indexes:
+        size = manifest.sizes[index]
+        if size >= max_bytes:
+            batches.append([index])
+            continue
+        if batch and (len(batch) == max_files or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(index)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class FileSetUploader:
+
+    # a share as one object per file under a prefix, with an index page linking every file
+
+    def __init__(self, uploader, workers: int = UPLOAD_WORKERS) -> None:
+        self.uploader = uploader
+        self.workers = workers
+        # every object put so far, as each one finishes, so a share that fails can take them back
+        self.uploaded = []
+
+    def _upload_batch(self, manifest: Manifest, batch: list, object_keys: list, progress) -> list:
+        # the files of the batch that failed
+        failed = []
+        for index in batch:
+            if self.uploader.upload_object(manifest.full_path(index), object_keys[index], callback=progress) == 200:
+                self.uploaded.append(object_keys[index])
+            else:
+                failed.append(index)
+        return failed
+
+    def upload(self, manifest: Manifest, indexes: list, object_keys: list, label: str) -> int:
+        # every worker adds to the one progress line, the tracker keeps a counter per thread
+        total = sum(manifest.sizes[index] for index in indexes)
+        batches = plan_batches(manifest, indexes)
+        with ProgressTracker(label, total) as progress:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="file-set") as pool:
+                failures = pool.map(lambda batch: self._upload_batch(manifest, batch, object_keys, progress), batches)
+                failed = [manifest.paths[index] for batch_failures in failures for index in batch_failures]
+        if failed:
+            raise RuntimeError(f"Upload of {len(failed)} of {len(indexes)} files failed, e.g. {failed[0]}")
+        return total
+
+    def publish_index(self, prefix: str, manifest: Manifest, object_keys: list, **context) -> tuple:
+        # each share gets its own page, older ones keep listing the files they were sent
+        from mailer.email_formatter import get_environment
+
+        links = self.uploader.get_shareable_links(
+            object_keys, [attachment_disposition(os.path.basename(rel_path)) for rel_path in manifest.paths])
+        files = [{'path': rel_path, 'size': format_bytes(size), 'link': link}
+                 for (rel_path, size, _, _), link in zip(manifest, links)]
+        files.sort(key=lambda file: file['path'])
+        page = get_environment('page_templates').get_template(INDEX_TEMPLATE).render(
+            files=files, total_size=format_bytes(manifest.total_size), **context)
+
+        index_key = f"{prefix}/index-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.html"
+        if self.uploader.upload_bytes(page.encode('utf-8'), index_key, 'text/html; charset=utf-8') != 200:
+            raise RuntimeError(f"Upload of {index_key} failed")
+        self.uploaded.append(index_key)
+        return index_key, self.uploader.get_shareable_link(index_key, disposition='inline')
@@ -0,0 +1,168 @@
+import os
+import datetime
+import logging
+
+from integrations.client_cache import create_gcs_client, get_gcs_bucket
+from integrations.file_upload import ProgressPercentage
+from integrations.resumable import GCS_CHUNK_SIZE, collect_stale_gcs_sessions, gcs_resumable_upload
+from settings import GoogleConfig
+
+logger = logging.getLogger(__name__)
+
+# chunk size for streamed Google resumable uploads, must be a multiple of 256 KiB
+STREAM_CHUNK_SIZE = 1024 * 1024 * 8
+
+
+class GoogleCloudFileUploader:
+
+    # most calls the JSON API accepts in one batch request
+    DELETE_BATCH_SIZE = 100
+
+    def __init__(self, location: str=None):
+        self.bucket_name = GoogleConfig.GGL_BUCKET_NAME
+        self.credentials_path = GoogleConfig.GGL_CREDENTIALS_PATH
+        self.root_folder = GoogleConfig.DEFAULT_ROOT_FOLDER
+
+        if location:
+            # a replica in another location ("Google:europe-west1") uploads to that location's bucket
+            buckets = getattr(GoogleConfig, 'GGL_REGION_BUCKETS', {})
+            if location not in buckets:
+                raise ValueError(f"No bucket configured for Google location {location}, see GoogleConfig.GGL_REGION_BUCKETS")
+            self.bucket_name = buckets[location]
+
+    def warm_up(self) -> None:
+        # builds the shared client ahead of the first upload, e.g. when the daemon starts
+        get_gcs_bucket(self.credentials_path, self.bucket_name)
+
+    def upload_file(self, file_path: str, key_path: str, resume: bool=False) -> int:
+
+        logger.info(f"Uploading {file_path} to Google Cloud Storage")
+
+        if not os.access(file_path, os.F_OK):
+            raise FileNotFoundError(f"File {file_path} not found")
+
+        try:
+            bucket = get_gcs_bucket(self.credentials_path, self.bucket_name)
+            blob = bucket.blob(key_path)
+            try:
+                collect_stale_gcs_sessions()
+                if os.path.getsize(file_path) > GCS_CHUNK_SIZE:
+                    # the session uri is saved so a failed upload can be resumed
+                    with ProgressPercentage(file_path) as progress:
+                        gcs_resumable_upload(bucket, file_path, key_path, resume, progress,
+                                             predefined_acl="publicRead")
+                else:
+                    blob.upload_from_filename(file_path, predefined_acl="publicRead")
+            except FileNotFoundError as e:
+                logger.critical(f"File Not Found: {e}")
+                return 500
+            except Exception as e:
+                logger.critical(f"Upload Error: {e}")
+                return 500
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {e}")
+            return 500
+
+    def upload_fileobj(self, file_obj, key_path: str, size_hint: int=0) -> int:
+
+        logger.info(f"Streaming {key_path} to Google Cloud Storage")
+
+        try:
+            bucket = get_gcs_bucket(self.credentials_path, self.bucket_name)
+            # setting a chunk size forces a resumable upload, which is sent chunk by
+            # chunk as the stream produces it instead of being read fully into memory
+            blob = bucket.blob(key_path, chunk_size=STREAM_CHUNK_SIZE)
+            blob.upload_from_file(file_obj, predefined_acl="publicRead")
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {e}")
+            return 500
+            
+
+    def upload_object(self, file_path: str, key_path: str, content_type: str=None, callback=None) -> int:
+        # one file of a share uploaded file by file, with no resume session or progress line of its own
+        try:
+            bucket = get_gcs_bucket(self.credentials_path, self.bucket_name)
+            bucket.blob(key_path).upload_from_filename(file_path, content_type=content_type,
+                                                       predefined_acl="publicRead")
+            if callback:
+                callback(os.path.getsize(file_path))
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {key_path}: {e}")
+            return 500
+
+    def upload_bytes(self, data: bytes, key_path: str, content_type: str=None) -> int:
+        try:
+            bucket = get_gcs_bucket(self.credentials_path, self.bucket_name)
+            bucket.blob(key_path).upload_from_string(data, content_type=content_type or 'application/octet-stream',
+                                                     predefined_acl="publicRead")
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {key_path}: {e}")
+            return 500
+
+    def get_shareable_link(self, key_path: str, disposition: str='attachment') -> str | None:
+
+        logger.info(f"Retrieving Google Storage Shareable Link")
+        
+        try:
+            bucket = get_gcs_bucket(self.credentials_path, self.bucket_name)
+            blob = bucket.blob(key_path)
+
+            download_url = blob.generate_signed_url(
+                version="v4",
+                expiration=datetime.timedelta(days=7),
+                method="GET",
+                response_disposition=disposition
+            )
+
+            return download_url
+        except Exception as e:
+            logger.critical(f"Get Shareable Link Error: {e}")
+            return None
+
+    def get_shareable_links(self, key_paths: list, dispositions: list) -> list:
+        # signed locally with the service account key, a link per file of a share costs no requests
+        bucket = get_gcs_bucket(self.credentials_path, self.bucket_name)
+        return [bucket.blob(key_path).generate_signed_url(
+            version="v4",
+            expiration=datetime.timedelta(days=7),
+            method="GET",
+            response_disposition=disposition
+        ) for key_path, disposition in zip(key_paths, dispositions)]
+
+    def delete_objects(self, key_paths: list) -> list:
+
+        # a client collects one batch at a time, so concurrent callers each need their own
+        client = create_gcs_client(self.credentials_path)
+        bucket = client.bucket(self.bucket_name)
+
+        from google.api_core.exceptions import GoogleAPICallError, NotFound
+
+        deleted = []
+        for start in range(0, len(key_paths), self.DELETE_BATCH_SIZE):
+            batch_keys = key_paths[start:start + self.DELETE_BATCH_SIZE]
+            # every delete goes out in one multipart request, which raises if any of them failed
+            try:
+                with client.batch():
+                    for key_path in batch_keys:
+                        bucket.delete_blob(key_path)
+                deleted.extend(batch_keys)
+                continue
+            except GoogleAPICallError as e:
+                logger.info(f"Batch delete of {len(batch_keys)} objects failed, deleting them one by one: {e}")
+
+            # the batch doesn't say which ones failed, those it did delete are simply not found now
+            for key_path in batch_keys:
+                try:
+                    bucket.delete_blob(key_path)
+                except NotFound:
+                    pass
+                except GoogleAPICallError as e:
+                    logger.error(f"Could not delete {key_path}: {e}")
+                    continue
+                deleted.append(key_path)
+
+        return deleted
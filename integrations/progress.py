@@ -0,0 +1,132 @@
+import json
+import sys
+import threading
+import time
+
+MODES = ('text', 'json', 'none')
+
+# process-wide, set once from the command line
+_mode = 'text'
+
+
+def set_mode(mode: str) -> None:
+    global _mode
+    if mode not in MODES:
+        raise ValueError(f"Invalid progress mode {mode}")
+    _mode = mode
+
+
+def format_bytes(amount: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if amount < 1024:
+            return f"{amount:.1f} {unit}"
+        amount /= 1024
+    return f"{amount:.1f} TB"
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressTracker:
+
+    # transfer threads only bump a counter of their own, without a lock or any I/O;
+    # a separate renderer thread sums the counters a few times a second
+
+    def __init__(self, label: str, total: int = None, interval: float = 0.5, mode: str = None, output=None) -> None:
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.mode = mode or _mode
+        # json events go to stderr, apart from the logs on stdout, so a job runner can read them as they are
+        self.output = output or (sys.stderr if self.mode == 'json' else sys.stdout)
+        self._counters = []
+        self._local = threading.local()
+        self._register_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._renderer = None
+        self._started_at = None
+        self._last_bytes = 0
+        self._last_time = None
+        self._rate = 0.0
+        self._width = 0
+
+    def __call__(self, bytes_amount: int) -> None:
+        counter = getattr(self._local, 'counter', None)
+        if counter is None:
+            counter = [0]
+            self._local.counter = counter
+            with self._register_lock:
+                self._counters.append(counter)
+        counter[0] += bytes_amount
+
+    @property
+    def transferred(self) -> int:
+        return sum(counter[0] for counter in list(self._counters))
+
+    def start(self) -> "ProgressTracker":
+        self._started_at = self._last_time = time.monotonic()
+        if self.mode != 'none':
+            self._renderer = threading.Thread(target=self._render_loop, name="progress", daemon=True)
+            self._renderer.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._renderer:
+            self._renderer.join()
+            self._render(final=True)
+
+    def __enter__(self) -> "ProgressTracker":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+    def _render_loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._render()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        transferred = self.transferred
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            instant = (transferred - self._last_bytes) / elapsed
+            # smoothed so the ETA doesn't jump around with every part that completes
+            self._rate = instant if not self._rate else 0.3 * instant + 0.7 * self._rate
+        self._last_bytes, self._last_time = transferred, now
+
+        eta = None
+        if self.total and self._rate > 0:
+            eta = max(0.0, (self.total - transferred) / self._rate)
+        return {
+            'label': self.label,
+            'bytes': transferred,
+            'total': self.total,
+            'percent': round(transferred / self.total * 100, 2) if self.total else None,
+            'bytes_per_second': round(self._rate),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'elapsed_seconds': round(now - self._started_at, 1),
+        }
+
+    def _render(self, final: bool = False) -> None:
+        state = self.snapshot()
+        if final and state['elapsed_seconds']:
+            # the average over the whole transfer rather than the recent rate
+            state['bytes_per_second'] = round(state['bytes'] / state['elapsed_seconds'])
+        if self.mode == 'json':
+            state['event'] = 'done' if final else 'progress'
+            self.output.write(json.dumps(state) + "\n")
+        else:
+            line = f"\r{self.label}  {format_bytes(state['bytes'])}"
+            if self.total:
+                line += f" / {format_bytes(self.total)}  ({state['percent']:.2f}%)"
+            line += f"  {format_bytes(state['bytes_per_second'])}/s"
+            if state['eta_seconds'] is not None and not final:
+                line += f"  ETA {_format_seconds(state['eta_seconds'])}"
+            # pad over whatever was left of a longer previous line
+            self._width = max(self._width, len(line))
+            self.output.write(line.ljust(self._width) + ("\n" if final else ""))
+        self.output.flush()
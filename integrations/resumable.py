@@ -0,0 +1,200 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from integrations.upload_state import UploadStateStore
+from settings import DatabaseConfig
+
+logger = logging.getLogger(__name__)
+
+# GCS resumable sessions expire after a week, S3 keeps parts (and bills for them) until aborted
+SESSION_MAX_AGE_SECONDS = getattr(DatabaseConfig, 'UPLOAD_SESSION_MAX_AGE_DAYS', 6) * 24 * 60 * 60
+
+# must be a multiple of 256 KiB
+GCS_CHUNK_SIZE = 1024 * 1024 * 8
+
+
+def s3_resumable_upload(s3_client, bucket_name: str, region: str, file_path: str, key_path: str, part_size: int,
+                        concurrency: int, resume: bool, callback=None) -> None:
+    # imported here so the Google path doesn't load s3transfer, nor the S3 path requests
+    from s3transfer.utils import ReadFileChunk
+
+    with UploadStateStore() as store:
+        session_key = store.session_key('AWS', bucket_name, key_path)
+        stat = os.stat(file_path)
+
+        session = store.find(session_key)
+        if session and not (resume and session.matches(stat.st_size, stat.st_mtime)):
+            logger.info(f"Discarding the previous upload session for {key_path}")
+            _abort_s3(s3_client, bucket_name, session.key_path, session.upload_id)
+            store.delete(session_key)
+            session = None
+
+        done = {}
+        if session:
+            try:
+                done = _list_s3_parts(s3_client, bucket_name, key_path, session.upload_id)
+            except s3_client.exceptions.NoSuchUpload:
+                logger.info(f"Upload session for {key_path} no longer exists, starting over")
+                store.delete(session_key)
+                session = None
+            except Exception as e:
+                # e.g. no s3:ListMultipartUploadParts permission, trust the local checkpoint
+                logger.warning(f"Could not list uploaded parts, using the local checkpoint: {e}")
+                done = store.parts(session_key)
+
+        if session:
+            part_size = session.part_size
+            logger.info(f"Resuming {key_path} with {len(done)} parts already uploaded")
+        else:
+            upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=key_path)['UploadId']
+            session = store.create(session_key, 'AWS', file_path, key_path, stat.st_size, stat.st_mtime, upload_id,
+                                   part_size, bucket_name, region)
+
+        part_count = max(1, -(-stat.st_size // part_size))
+        if callback and done:
+            callback(sum(min(part_size, stat.st_size - (number - 1) * part_size) for number in done))
+
+        def upload_part(part_number: int) -> None:
+            offset = (part_number - 1) * part_size
+            length = min(part_size, stat.st_size - offset)
+            # reads the part from disk as it's sent rather than holding it in memory
+            with ReadFileChunk.from_filename(file_path, offset, length) as body:
+                response = s3_client.upload_part(Bucket=bucket_name, Key=key_path, UploadId=session.upload_id,
+                                                 PartNumber=part_number, Body=body)
+            store.add_part(session_key, part_number, response['ETag'])
+            done[part_number] = response['ETag']
+            if callback:
+                callback(length)
+
+        remaining = [number for number in range(1, part_count + 1) if number not in done]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # list() surfaces the first failed part, the ones that finished stay recorded
+            list(pool.map(upload_part, remaining))
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key_path, UploadId=session.upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': done[number]} for number in sorted(done)]}
+        )
+        store.delete(session_key)
+
+
+def _list_s3_parts(s3_client, bucket_name: str, key_path: str, upload_id: str) -> dict:
+    parts = {}
+    paginator = s3_client.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket_name, Key=key_path, UploadId=upload_id):
+        for part in page.get('Parts', []):
+            parts[part['PartNumber']] = part['ETag']
+    return parts
+
+
+def _abort_s3(s3_client, bucket_name: str, key_path: str, upload_id: str) -> bool:
+    # True once the parts are gone, either aborted now or already by S3
+    try:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key_path, UploadId=upload_id)
+    except s3_client.exceptions.NoSuchUpload:
+        return True
+    except Exception as e:
+        logger.warning(f"Could not abort upload of {key_path}: {e}")
+        return False
+    return True
+
+
+def collect_stale_s3_sessions(client_for, region: str) -> None:
+    # client_for(region) gives a client for the region a session was started in, which may be a replica's
+    with UploadStateStore() as store:
+        for session in store.stale('AWS', SESSION_MAX_AGE_SECONDS):
+            # sessions recorded without a bucket still name it in their key, "AWS:bucket:key"
+            bucket_name = session.bucket or session.session_key.split(':')[1]
+            try:
+                s3_client = client_for(session.region or region)
+            except Exception as e:
+                logger.warning(f"Could not reach the bucket of stale upload session for {session.key_path}: {e}")
+                continue
+            logger.info(f"Aborting stale upload session for {session.key_path}")
+            # kept when the abort fails so a later pass retries it, instead of leaving billed parts behind
+            if _abort_s3(s3_client, bucket_name, session.key_path, session.upload_id):
+                store.delete(session.session_key)
+
+
+def _gcs_committed_bytes(session_uri: str, file_size: int) -> int | None:
+    # an empty PUT asks the session how much it has persisted, None means it's gone
+    import requests
+
+    response = requests.put(session_uri, headers={'Content-Range': f"bytes */{file_size}"}, timeout=60)
+    if response.status_code in (200, 201):
+        return file_size
+    if response.status_code == 308:
+        committed = response.headers.get('Range')
+        return int(committed.split('-')[1]) + 1 if committed else 0
+    return None
+
+
+def gcs_resumable_upload(bucket, file_path: str, key_path: str, resume: bool, callback=None,
+                         predefined_acl: str = None) -> None:
+    import requests
+
+    with UploadStateStore() as store:
+        session_key = store.session_key('Google', bucket.name, key_path)
+        stat = os.stat(file_path)
+
+        session = store.find(session_key)
+        offset = None
+        if session and resume and session.matches(stat.st_size, stat.st_mtime):
+            offset = _gcs_committed_bytes(session.upload_id, stat.st_size)
+            if offset is None:
+                logger.info(f"Upload session for {key_path} has expired, starting over")
+            else:
+                logger.info(f"Resuming {key_path} from byte {offset}")
+        elif session:
+            logger.info(f"Discarding the previous upload session for {key_path}")
+            _cancel_gcs(session.upload_id)
+
+        if offset is None:
+            session_uri = bucket.blob(key_path).create_resumable_upload_session(
+                size=stat.st_size, predefined_acl=predefined_acl)
+            session = store.create(session_key, 'Google', file_path, key_path, stat.st_size, stat.st_mtime,
+                                   session_uri, GCS_CHUNK_SIZE, bucket.name)
+            offset = 0
+
+        if callback and offset:
+            callback(offset)
+
+        with requests.Session() as http, open(file_path, 'rb') as file:
+            while offset < stat.st_size:
+                file.seek(offset)
+                chunk = file.read(GCS_CHUNK_SIZE)
+                end = offset + len(chunk) - 1
+                response = http.put(session.upload_id, data=chunk, timeout=300,
+                                    headers={'Content-Range': f"bytes {offset}-{end}/{stat.st_size}"})
+                if response.status_code in (200, 201):
+                    committed = stat.st_size
+                elif response.status_code == 308:
+                    # the server may persist less than was sent, continue from what it acknowledged
+                    committed_range = response.headers.get('Range')
+                    committed = int(committed_range.split('-')[1]) + 1 if committed_range else 0
+                else:
+                    response.raise_for_status()
+                    raise IOError(f"Unexpected response {response.status_code} uploading {key_path}")
+                if callback:
+                    callback(committed - offset)
+                offset = committed
+
+        store.delete(session_key)
+
+
+def _cancel_gcs(session_uri: str) -> None:
+    import requests
+
+    try:
+        requests.delete(session_uri, timeout=60)
+    except Exception as e:
+        logger.warning(f"Could not cancel upload session: {e}")
+
+
+def collect_stale_gcs_sessions() -> None:
+    with UploadStateStore() as store:
+        for session in store.stale('Google', SESSION_MAX_AGE_SECONDS):
+            logger.info(f"Cancelling stale upload session for {session.key_path}")
+            _cancel_gcs(session.upload_id)
+            store.delete(session.session_key)
@@ -0,0 +1,192 @@
+import os
+import time
+import logging
+
+from integrations.client_cache import get_s3_client
+from integrations.file_upload import ProgressPercentage
+from integrations.resumable import collect_stale_s3_sessions, s3_resumable_upload
+from integrations.transfer_tuning import s3_transfer_config, throughput
+from settings import AwsConfig
+
+logger = logging.getLogger(__name__)
+
+
+class S3FileUploader:
+
+    # most keys a single DeleteObjects request accepts
+    DELETE_BATCH_SIZE = 1000
+
+    def __init__(self, region: str=None):
+        self.access_key = AwsConfig.AWS_ACCESS_KEY
+        self.secret_access_key = AwsConfig.AWS_SECRET_ACCESS_KEY
+        self.bucket_name = AwsConfig.AWS_BUCKET_NAME
+        self.region = AwsConfig.AWS_DEFAULT_REGION
+        self.endpoint_url = AwsConfig.AWS_ENDPOINT_URL
+        self.root_folder = AwsConfig.DEFAULT_ROOT_FOLDER
+
+        if region and region != self.region:
+            # a replica in another region ("AWS:eu-west-1") uploads to that region's bucket
+            buckets = getattr(AwsConfig, 'AWS_REGION_BUCKETS', {})
+            if region not in buckets:
+                raise ValueError(f"No bucket configured for AWS region {region}, see AwsConfig.AWS_REGION_BUCKETS")
+            self.bucket_name = buckets[region]
+            self.region = region
+            self.endpoint_url = getattr(AwsConfig, 'AWS_REGION_ENDPOINTS', {}).get(region)
+
+    def _client(self, region: str):
+        return get_s3_client(self.access_key, self.secret_access_key, region, self.endpoint_url)
+
+    def _region_client(self, region: str):
+        # a stale upload session may belong to a replica's region, reached through its own endpoint
+        if region == self.region:
+            return self._client(region)
+        return type(self)(region)._client(region)
+
+    def warm_up(self) -> None:
+        # builds the shared client ahead of the first upload, e.g. when the daemon starts
+        self._client(self.region)
+
+    def upload_file(self, file_path: str, key_path: str, region: str=None, resume: bool=False) -> int:
+
+        logger.info(f"Uploading {file_path} to AWS S3 Storage")
+
+        if not os.access(file_path, os.F_OK):
+            raise FileNotFoundError(f"File {file_path} not found")
+
+        if not region:
+            region = self.region
+
+        s3_client = self._client(region)
+
+        file_size = os.path.getsize(file_path)
+        config = s3_transfer_config(file_size)
+
+        try:
+            collect_stale_s3_sessions(self._region_client, self.region)
+            start = time.perf_counter()
+            with ProgressPercentage(file_path, file_size) as progress:
+                if file_size >= config.multipart_threshold:
+                    # multipart uploads checkpoint every part so a failed upload can be resumed
+                    s3_resumable_upload(s3_client, self.bucket_name, region, file_path, key_path,
+                                        config.multipart_chunksize, config.max_concurrency, resume, progress)
+                else:
+                    s3_client.upload_file(file_path, self.bucket_name, key_path, \
+                        Config=config, Callback=progress)
+            throughput.record(file_size, time.perf_counter() - start)
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {e}")
+            return 500
+
+    def upload_fileobj(self, file_obj, key_path: str, region: str=None, size_hint: int=0) -> int:
+
+        logger.info(f"Streaming {key_path} to AWS S3 Storage")
+
+        if not region:
+            region = self.region
+
+        s3_client = self._client(region)
+
+        # non-seekable streams are read into memory one part at a time and s3transfer keeps
+        # at most max_in_memory_upload_chunks of them, 10 unless a memory ceiling is set
+        config = s3_transfer_config(size_hint, streaming=True)
+
+        try:
+            # the archive size isn't known up front, so this reports throughput without an ETA
+            with ProgressPercentage(key_path) as progress:
+                s3_client.upload_fileobj(file_obj, self.bucket_name, key_path, \
+                    Config=config, Callback=progress)
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {e}")
+            return 500
+
+    def upload_object(self, file_path: str, key_path: str, content_type: str=None, callback=None) -> int:
+        # one file of a share uploaded file by file, with no resume session or progress line of its own
+        s3_client = self._client(self.region)
+        extra_args = {'ContentType': content_type} if content_type else {}
+
+        try:
+            file_size = os.path.getsize(file_path)
+            config = s3_transfer_config(file_size)
+            if file_size < config.multipart_threshold:
+                # a single PUT on the calling thread, upload_file would start a transfer
+                # manager and its worker threads for every small file
+                with open(file_path, 'rb') as body:
+                    s3_client.put_object(Bucket=self.bucket_name, Key=key_path, Body=body, **extra_args)
+                if callback:
+                    callback(file_size)
+            else:
+                s3_client.upload_file(file_path, self.bucket_name, key_path, ExtraArgs=extra_args or None,
+                                      Config=config, Callback=callback)
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {key_path}: {e}")
+            return 500
+
+    def upload_bytes(self, data: bytes, key_path: str, content_type: str=None) -> int:
+        s3_client = self._client(self.region)
+        extra_args = {'ContentType': content_type} if content_type else {}
+
+        try:
+            s3_client.put_object(Bucket=self.bucket_name, Key=key_path, Body=data, **extra_args)
+            return 200
+        except Exception as e:
+            logger.critical(f"Upload Error: {key_path}: {e}")
+            return 500
+
+    def get_shareable_link(self, key_path: str, region: str=None, disposition: str='attachment') -> str:
+
+        logger.info(f"Retrieving AWS S3 Shareable Link")
+
+        if not region:
+            region = self.region
+
+        try:
+            s3_client = self._client(region)
+        except Exception as e:
+            logger.critical(f"s3 Connection Error: {e}")
+
+        result = s3_client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket_name,
+                'Key': key_path,
+                'ResponseContentDisposition': disposition
+            },
+            ExpiresIn=604800
+        )
+
+        return result
+
+    def get_shareable_links(self, key_paths: list, dispositions: list) -> list:
+        # presigning is local, so a link per file of a share costs no requests
+        s3_client = self._client(self.region)
+        return [s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': key_path, 'ResponseContentDisposition': disposition},
+            ExpiresIn=604800
+        ) for key_path, disposition in zip(key_paths, dispositions)]
+
+    def delete_objects(self, key_paths: list, region: str=None) -> list:
+
+        if not region:
+            region = self.region
+
+        s3_client = self._client(region)
+
+        deleted = []
+        for start in range(0, len(key_paths), self.DELETE_BATCH_SIZE):
+            batch = key_paths[start:start + self.DELETE_BATCH_SIZE]
+            # quiet mode only reports the keys that failed, a missing key counts as deleted
+            response = s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key_path} for key_path in batch], 'Quiet': True}
+            )
+            failed = set()
+            for error in response.get('Errors', []):
+                failed.add(error['Key'])
+                logger.error(f"Could not delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+            deleted.extend(key_path for key_path in batch if key_path not in failed)
+
+        return deleted
@@ -0,0 +1,81 @@
+import math
+import threading
+
+from boto3.s3.transfer import TransferConfig
+
+from metrics.memory import buffer_budget
+from settings import AwsConfig
+
+MiB = 1024 * 1024
+
+S3_MAX_PARTS = 10000
+S3_MIN_PART_SIZE = 5 * MiB
+S3_MAX_PART_SIZE = 5 * 1024 * MiB
+
+# long enough per part that request overhead is a small fraction of the transfer,
+# short enough that a retried part doesn't cost much
+TARGET_PART_SECONDS = 4.0
+
+
+class ThroughputTracker:
+
+    # exponentially weighted so one slow or fast upload doesn't swing the part size
+
+    def __init__(self, weight: float = 0.3) -> None:
+        self.weight = weight
+        self.bytes_per_second = None
+        self._lock = threading.Lock()
+
+    def record(self, size: int, seconds: float) -> None:
+        if size <= 0 or seconds <= 0:
+            return
+        measured = size / seconds
+        with self._lock:
+            if self.bytes_per_second is None:
+                self.bytes_per_second = measured
+            else:
+                self.bytes_per_second = self.weight * measured + (1 - self.weight) * self.bytes_per_second
+
+
+throughput = ThroughputTracker()
+
+
+def choose_part_size(file_size: int, concurrency: int, bytes_per_second: float = None,
+                     min_part_size: int = None, max_part_size: int = S3_MAX_PART_SIZE) -> int:
+    min_part_size = max(S3_MIN_PART_SIZE, min_part_size or getattr(AwsConfig, 'AWS_MIN_PART_SIZE', 8 * MiB))
+
+    # never more than S3's part limit
+    part_size = max(min_part_size, math.ceil(file_size / S3_MAX_PARTS))
+
+    if bytes_per_second:
+        per_connection = bytes_per_second / concurrency
+        # bigger parts on fast links, but keep enough parts to use every connection
+        target = min(per_connection * TARGET_PART_SECONDS, file_size / concurrency)
+        part_size = max(part_size, int(target))
+
+    part_size = min(part_size, max_part_size)
+    return math.ceil(part_size / MiB) * MiB
+
+
+def s3_transfer_config(file_size: int, streaming: bool = False) -> TransferConfig:
+    concurrency = getattr(AwsConfig, 'AWS_MAX_CONCURRENCY', 10)
+    # s3transfer's default, parts of a non-seekable stream read ahead into memory
+    memory_parts = 10
+    if streaming:
+        # streamed parts are held in memory, so only grow them as far as the part limit
+        # requires, with some headroom since the archive size is only an estimate
+        part_size = choose_part_size(int(file_size * 1.1), concurrency)
+        # under a memory ceiling fewer parts are buffered, and never fewer than are uploading
+        memory_parts = max(1, min(memory_parts, buffer_budget('s3_parts', memory_parts * part_size) // part_size))
+        concurrency = min(concurrency, memory_parts)
+    else:
+        part_size = choose_part_size(file_size, concurrency, throughput.bytes_per_second)
+    config = TransferConfig(
+        multipart_threshold=part_size,
+        max_concurrency=concurrency,
+        multipart_chunksize=part_size,
+        use_threads=True
+    )
+    # s3transfer reads it off the config, boto3's constructor just doesn't take it
+    config.max_in_memory_upload_chunks = memory_parts
+    return config
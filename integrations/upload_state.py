@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+
+from settings import DatabaseConfig
+
+STATE_COLS = "session_key TEXT PRIMARY KEY, " \
+            "provider VARCHAR(50), " \
+            "file_path TEXT, " \
+            "key_path TEXT, " \
+            "file_size INT, " \
+            "file_mtime REAL, " \
+            "upload_id TEXT, " \
+            "part_size INT, " \
+            "created_at REAL, " \
+            "bucket TEXT, " \
+            "region TEXT"
+
+SESSION_SELECT = "SELECT session_key, provider, file_path, key_path, file_size, file_mtime, upload_id, part_size, " \
+                 "created_at, bucket, region FROM upload_sessions"
+
+PART_COLS = "session_key TEXT, " \
+            "part_number INT, " \
+            "etag TEXT, " \
+            "PRIMARY KEY (session_key, part_number)"
+
+ARCHIVE_COLS = "archive_path TEXT PRIMARY KEY, " \
+              "manifest_digest TEXT, " \
+              "archive_size INT, " \
+              "created_at REAL"
+
+UNSAVED_COLS = "unsaved_id INTEGER PRIMARY KEY AUTOINCREMENT, " \
+              "record TEXT, " \
+              "created_at REAL"
+
+
+class UploadSession:
+
+    def __init__(self, session_key: str, provider: str, file_path: str, key_path: str, file_size: int,
+                 file_mtime: float, upload_id: str, part_size: int, created_at: float, bucket: str = None,
+                 region: str = None) -> None:
+        self.session_key = session_key
+        self.provider = provider
+        self.file_path = file_path
+        self.key_path = key_path
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.created_at = created_at
+        self.bucket = bucket
+        self.region = region
+
+    def matches(self, file_size: int, file_mtime: float) -> bool:
+        return self.file_size == file_size and self.file_mtime == file_mtime
+
+
+class UploadStateStore:
+
+    # always a local sqlite file, even when transfers are kept in mysql, since the
+    # sessions belong to the files on this machine
+
+    def __init__(self, db_file: str = None) -> None:
+        self.db_file = db_file or getattr(DatabaseConfig, 'UPLOAD_STATE_FILENAME', 'nifty_uploads.db')
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS upload_sessions ({STATE_COLS})")
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS upload_parts ({PART_COLS})")
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS kept_archives ({ARCHIVE_COLS})")
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS unsaved_transfers ({UNSAVED_COLS})")
+            # state files written before sessions kept their bucket and region
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(upload_sessions)")}
+            for column in ('bucket', 'region'):
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE upload_sessions ADD COLUMN {column} TEXT")
+
+    @staticmethod
+    def session_key(provider: str, bucket: str, key_path: str) -> str:
+        return f"{provider}:{bucket}:{key_path}"
+
+    def find(self, session_key: str) -> UploadSession | None:
+        with self._lock:
+            row = self.connection.execute(f"{SESSION_SELECT} WHERE session_key = ?", (session_key,)).fetchone()
+        return UploadSession(*row) if row else None
+
+    def create(self, session_key: str, provider: str, file_path: str, key_path: str, file_size: int,
+               file_mtime: float, upload_id: str, part_size: int, bucket: str = None,
+               region: str = None) -> UploadSession:
+        session = UploadSession(session_key, provider, file_path, key_path, file_size, file_mtime,
+                                upload_id, part_size, time.time(), bucket, region)
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM upload_parts WHERE session_key = ?", (session_key,))
+            self.connection.execute("REPLACE INTO upload_sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (session.session_key, provider, file_path, key_path, file_size, file_mtime,
+                                     upload_id, part_size, session.created_at, bucket, region))
+        return session
+
+    def add_part(self, session_key: str, part_number: int, etag: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("REPLACE INTO upload_parts VALUES (?, ?, ?)", (session_key, part_number, etag))
+
+    def parts(self, session_key: str) -> dict:
+        with self._lock:
+            rows = self.connection.execute("SELECT part_number, etag FROM upload_parts WHERE session_key = ?",
+                                           (session_key,)).fetchall()
+        return dict(rows)
+
+    def delete(self, session_key: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM upload_parts WHERE session_key = ?", (session_key,))
+            self.connection.execute("DELETE FROM upload_sessions WHERE session_key = ?", (session_key,))
+
+    def stale(self, provider: str, max_age_seconds: float) -> list:
+        with self._lock:
+            rows = self.connection.execute(
+                f"{SESSION_SELECT} WHERE provider = ? AND created_at < ?",
+                (provider, time.time() - max_age_seconds)).fetchall()
+        return [UploadSession(*row) for row in rows]
+
+    def keep_archive(self, archive_path: str, manifest_digest: str, archive_size: int) -> None:
+        # only recorded once the archive was written in full, so a later --resume can trust it
+        with self._lock, self.connection:
+            self.connection.execute("REPLACE INTO kept_archives VALUES (?, ?, ?, ?)",
+                                    (os.path.abspath(archive_path), manifest_digest, archive_size, time.time()))
+
+    def kept_archive(self, archive_path: str) -> tuple | None:
+        # (manifest_digest, archive_size) of the archive kept at archive_path
+        with self._lock:
+            return self.connection.execute(
+                "SELECT manifest_digest, archive_size FROM kept_archives WHERE archive_path = ?",
+                (os.path.abspath(archive_path),)).fetchone()
+
+    def forget_archive(self, archive_path: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM kept_archives WHERE archive_path = ?", (os.path.abspath(archive_path),))
+
+    def add_unsaved(self, record: str) -> None:
+        # a transfer whose mail went out but whose database write failed, saved again later
+        with self._lock, self.connection:
+            self.connection.execute("INSERT INTO unsaved_transfers (record, created_at) VALUES (?, ?)",
+                                    (record, time.time()))
+
+    def unsaved(self) -> list:
+        with self._lock:
+            return self.connection.execute(
+                "SELECT unsaved_id, record FROM unsaved_transfers ORDER BY unsaved_id").fetchall()
+
+    def delete_unsaved(self, unsaved_id: int) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM unsaved_transfers WHERE unsaved_id = ?", (unsaved_id,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "UploadStateStore":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
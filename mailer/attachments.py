@@ -0,0 +1,105 @@
+import base64
+import copy
+import io
+import re
+import smtplib
+import uuid
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.utils import getaddresses
+
+# a multiple of 57, so every block encodes to whole 76 character base64 lines
+ATTACHMENT_BLOCK_SIZE = 57 * 1024 * 16
+
+CRLF = b"\r\n"
+
+
+class FileAttachment(MIMEBase):
+
+    # an attachment that stays on disk until the message is sent, it's then read and
+    # base64 encoded a block at a time as it goes out over the connection
+
+    def __init__(self, file_path: str) -> None:
+        super().__init__('application', 'octet-stream')
+        self.file_path = file_path
+        # stands in for the encoded file in the flattened message
+        self.marker = f"nifty-attachment-{uuid.uuid4().hex}"
+        self.set_payload(self.marker)
+        self['Content-Transfer-Encoding'] = 'base64'
+        self.add_header('Content-Disposition', f'attachment; filename= {file_path}')
+
+    def encoded_blocks(self, block_size: int = ATTACHMENT_BLOCK_SIZE):
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        first = True
+        with open(self.file_path, 'rb', buffering=0) as file:
+            while True:
+                read = file.readinto(buffer)
+                if not read:
+                    break
+                encoded = base64.encodebytes(view[:read]).rstrip(b"\n").replace(b"\n", CRLF)
+                yield encoded if first else CRLF + encoded
+                first = False
+
+
+def file_attachments(message) -> list:
+    return [part for part in message.walk() if isinstance(part, FileAttachment)]
+
+
+def _quote_periods(data: bytes) -> bytes:
+    return re.sub(rb'(?m)^\.', b'..', data)
+
+
+def iter_message(message):
+    # the flattened message with every file attachment encoded in place of its marker
+    message = copy.copy(message)
+    # never sent on, as smtplib.send_message does
+    del message['Bcc']
+    del message['Resent-Bcc']
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=message.policy.clone(linesep="\r\n")).flatten(message, linesep="\r\n")
+    flat = buffer.getvalue()
+    buffer.close()
+
+    for part in file_attachments(message):
+        before, _, flat = flat.partition(part.marker.encode('ascii'))
+        yield _quote_periods(before)
+        # base64 lines never start with a period, so the blocks go out as they are
+        yield from part.encoded_blocks()
+    yield _quote_periods(flat)
+
+
+def send_streamed(smtp: smtplib.SMTP, message) -> None:
+    # smtplib.send_message flattens the whole message into memory first, this does the
+    # same MAIL, RCPT and DATA exchange but writes the message out as it's encoded
+    sender = getaddresses([message['Sender'] or message['From']])[0][1]
+    recipients = [address for _, address in getaddresses(message.get_all('To', []) + message.get_all('Cc', [])
+                                                          + message.get_all('Bcc', []))]
+
+    smtp.ehlo_or_helo_if_needed()
+    code, response = smtp.mail(sender)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, response, sender)
+    refused = {}
+    for recipient in recipients:
+        code, response = smtp.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+    if len(refused) == len(recipients):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, response = smtp.docmd('data')
+    if code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+    last = b""
+    for chunk in iter_message(message):
+        if chunk:
+            smtp.send(chunk)
+            last = chunk
+    smtp.send((b"" if last.endswith(CRLF) else CRLF) + b"." + CRLF)
+    code, response = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
@@ -1,10 +1,43 @@
-from jinja2 import Environment, FileSystemLoader
+import os
+import threading
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from settings import MailerConfig
+
+# one environment per template directory for the life of the process, so each template is
+# parsed once; the bytecode cache on disk lets the next run skip compiling it as well
+_environments = {}
+_lock = threading.Lock()
+
+
+def get_environment(template_dir: str) -> Environment:
+    key = os.path.abspath(template_dir)
+    with _lock:
+        env = _environments.get(key)
+        if env is None:
+            cache_dir = getattr(MailerConfig, 'MAIL_TEMPLATE_CACHE_DIR', '.jinja_cache')
+            os.makedirs(cache_dir, exist_ok=True)
+            env = Environment(
+                loader=FileSystemLoader(template_dir),
+                bytecode_cache=FileSystemBytecodeCache(cache_dir),
+                # compiled templates are only replaced when the file's mtime changes
+                auto_reload=True
+            )
+            _environments[key] = env
+    return env
+
 
 class EmailTemplateRenderer:
     def __init__(self, template_dir: str) -> None:
-        self.env = Environment(loader=FileSystemLoader(template_dir))
+        self.env = get_environment(template_dir)
 
     def render_template(self, template_name: str, **kwargs: dict) -> str:
         template = self.env.get_template(template_name)
         rendered_content = template.render(**kwargs)
         return rendered_content
+
+    def render_many(self, template_name: str, contexts: list[dict], **shared: dict) -> list[str]:
+        # one template lookup for the whole batch, each context is merged over the shared values
+        template = self.env.get_template(template_name)
+        return [template.render({**shared, **context}) for context in contexts]
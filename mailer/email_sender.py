@@ -3,9 +3,9 @@ import logging
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
 
+from mailer.attachments import FileAttachment
+from mailer.smtp_pool import SmtpConnectionPool, get_smtp_pool
 from settings import MailerConfig
 
 logger = logging.getLogger(__name__)
@@ -19,8 +19,8 @@ class EmailSender:
         self.smtp_server = MailerConfig.MAIL_SMTP_SERVER
         self.port = MailerConfig.MAIL_SMTP_PORT
 
-    def send_email(self, recipient_email: str, subject: str, content: str, 
-                   attachments: list[str]=None) -> None:
+    def build_message(self, recipient_email: str, subject: str, content: str,
+                      attachments: list[str]=None) -> MIMEMultipart:
 
         message = MIMEMultipart('alternative')
         message['From'] = self.sender_email
@@ -30,32 +30,42 @@ class EmailSender:
         message.attach(MIMEText(content, 'html'))
 
         if attachments:
+            # read from disk as the message is sent, see mailer.attachments
             for attachment in attachments:
-                part = MIMEBase('application', 'octet-stream')
-                with open(attachment, 'rb') as file:
-                    part.set_payload(file.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename= {attachment}')
-                message.attach(part)
-
-        with smtplib.SMTP(self.smtp_server, self.port) as server:
-            server.ehlo()
-            server.starttls()
-            try:
-                server.login(self.host_access_key, self.sender_password)
-            except smtplib.SMTPAuthenticationError as e:
-                logger.critical(f"Authentication error, please check your credentials: {e}")
-                return
-            except Exception as e:
-                logger.critical(f"Authentication error: {e}")
-                return
-            
-            try:
-                server.send_message(message)
-            except Exception as e:
-                logger.critical(f"Error sending email: {e}")
-                return
+                message.attach(FileAttachment(attachment))
+
+        return message
+
+    def _pool(self) -> SmtpConnectionPool:
+        return get_smtp_pool(self.smtp_server, self.port, self.host_access_key, self.sender_password)
+
+    def send_email(self, recipient_email: str, subject: str, content: str, 
+                   attachments: list[str]=None) -> bool:
+
+        message = self.build_message(recipient_email, subject, content, attachments)
+
+        try:
+            self._pool().send(message)
+        except smtplib.SMTPAuthenticationError as e:
+            logger.critical(f"Authentication error, please check your credentials: {e}")
+            return False
+        except Exception as e:
+            logger.critical(f"Error sending email: {e}")
+            return False
+        return True
+
+    def send_many(self, messages: list[MIMEMultipart], on_sent=None) -> list:
+        # one session for the batch, replaced if it drops; returns (message, error) for each one
+        # the server didn't accept, on_sent(message) is called for each one it did
+
+        failures = self._pool().send_many(messages, on_sent)
 
+        for message, error in failures:
+            if isinstance(error, smtplib.SMTPAuthenticationError):
+                logger.critical(f"Authentication error, please check your credentials: {error}")
+                break
+            logger.critical(f"Error sending email to {message['To']}: {error}")
+        return failures
 
 if __name__ == '__main__':
     # Example usage:
@@ -0,0 +1,93 @@
+import argparse
+import random
+import time
+import uuid
+from email import message_from_string
+
+import logging_config
+import logging
+
+from database.database import get_db_connection
+from mailer.attachments import file_attachments
+from mailer.email_sender import EmailSender
+from settings import MailerConfig
+
+logger = logging.getLogger(__name__)
+
+
+def queue_message(db, transfer_id: int, message) -> str:
+    # called inside the transaction that saves the transfer, so either both are stored or neither
+    if file_attachments(message):
+        raise ValueError("Messages with file attachments can't be queued, send them with EmailSender instead")
+    message_id = uuid.uuid4().hex
+    db.enqueue_mail(message_id, transfer_id, message['To'], message.as_string(), time.time())
+    return message_id
+
+
+class OutboxWorker:
+
+    def __init__(self, batch_size: int = 50, lease_seconds: float = 300) -> None:
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = getattr(MailerConfig, 'MAIL_OUTBOX_MAX_ATTEMPTS', 8)
+        self.base_delay = getattr(MailerConfig, 'MAIL_OUTBOX_RETRY_SECONDS', 30)
+        self.max_delay = 60 * 60
+
+    def _backoff(self, attempts: int) -> float:
+        # doubles with every attempt, jittered so a recovered server isn't hit all at once
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def run_once(self) -> int:
+        now = time.time()
+        connection = get_db_connection()
+        with connection as db:
+            due = db.due_mail(now, self.batch_size)
+            claimed = [row for row in due if db.claim_mail(row[0], row[5], now + self.lease_seconds)]
+        if not claimed:
+            return 0
+
+        messages = [message_from_string(row[3]) for row in claimed]
+        rows = {id(message): row for row, message in zip(claimed, messages)}
+
+        def sent(message) -> None:
+            # recorded as soon as the server accepts it, so a later failure in the batch
+            # or a crash can't send it twice
+            message_id, transfer_id, recipient_email = rows[id(message)][:3]
+            with connection as db:
+                db.mark_mail_sent(message_id, transfer_id)
+            logger.info(f"Sent queued mail to {recipient_email}")
+
+        # one SMTP session for the whole batch, only what the server didn't accept is retried
+        failures = EmailSender().send_many(messages, sent)
+
+        with connection as db:
+            for message, error in failures:
+                message_id, transfer_id, recipient_email, _, attempts, _ = rows[id(message)]
+                if attempts + 1 >= self.max_attempts:
+                    db.fail_mail(message_id, transfer_id, attempts + 1, str(error))
+                    logger.error(f"Giving up on mail to {recipient_email} after {attempts + 1} attempts: {error}")
+                else:
+                    retry_in = self._backoff(attempts + 1)
+                    db.retry_mail(message_id, attempts + 1, time.time() + retry_in, str(error))
+                    logger.warning(f"Mail to {recipient_email} failed, retrying in {retry_in:.0f}s: {error}")
+        return len(claimed)
+
+    def run(self, poll_interval: float = 10, once: bool = False) -> None:
+        while True:
+            if self.run_once():
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Send the mail queued by shares made with --async-mail.')
+    parser.add_argument('--once', action='store_true', help='Send everything that is due and exit, e.g. from cron')
+    parser.add_argument('--interval', type=float, default=10, help='Seconds between checks for new mail (default: 10)')
+    parser.add_argument('--batch-size', type=int, default=50, help='Messages sent per SMTP session (default: 50)')
+    args = parser.parse_args()
+
+    OutboxWorker(batch_size=args.batch_size).run(poll_interval=args.interval, once=args.once)
@@ -0,0 +1,197 @@
+import atexit
+import logging
+import smtplib
+import threading
+import time
+
+from mailer.attachments import file_attachments, send_streamed
+from settings import MailerConfig
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+
+    # spaces sends evenly, SES for example rejects anything over the account's per-second quota
+
+    def __init__(self, per_second: float) -> None:
+        self.interval = 1 / per_second if per_second else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _Connection:
+
+    def __init__(self, smtp: smtplib.SMTP) -> None:
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SmtpConnectionPool:
+
+    # keeps logged-in sessions between messages so only the first send pays for the
+    # connect, EHLO, STARTTLS and AUTH round-trips
+
+    def __init__(self, host: str, port: int, username: str, password: str, size: int = 4,
+                 max_messages: int = 100, noop_after: float = 30, per_second: float = 10) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages = max_messages
+        self.noop_after = noop_after
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._limiter = RateLimiter(per_second)
+
+    def _connect(self) -> _Connection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=60)
+        try:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.ehlo()
+            smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        return _Connection(smtp)
+
+    def _discard(self, connection: _Connection) -> None:
+        try:
+            connection.smtp.quit()
+        except Exception:
+            connection.smtp.close()
+
+    def _checkout(self) -> _Connection:
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                return self._connect()
+            if time.monotonic() - connection.last_used < self.noop_after:
+                return connection
+            # servers drop idle sessions after a minute or so, check before trusting it
+            try:
+                if connection.smtp.noop()[0] == 250:
+                    return connection
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._discard(connection)
+
+    def _checkin(self, connection: _Connection) -> None:
+        if connection.sent >= self.max_messages:
+            self._discard(connection)
+            return
+        connection.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(connection)
+
+    def _deliver(self, connection: _Connection, message) -> None:
+        # file attachments are encoded while they're sent instead of in memory beforehand
+        if file_attachments(message):
+            send_streamed(connection.smtp, message)
+        else:
+            connection.smtp.send_message(message)
+
+    def _ready(self, connection: _Connection | None) -> _Connection:
+        if connection is None:
+            return self._checkout()
+        if connection.sent >= self.max_messages:
+            self._discard(connection)
+            return self._connect()
+        return connection
+
+    def send_many(self, messages: list, on_sent=None) -> list:
+        # returns (message, error) for every message the server didn't accept, those it did
+        # are never reported, and on_sent(message) is called as each one is accepted
+        failures = []
+        with self._slots:
+            connection = None
+            try:
+                for position, message in enumerate(messages):
+                    try:
+                        connection = self._ready(connection)
+                        self._limiter.wait()
+                        try:
+                            self._deliver(connection, message)
+                        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                            # dropped mid-batch, send the rest on a fresh session
+                            self._discard(connection)
+                            connection = None
+                            connection = self._connect()
+                            self._deliver(connection, message)
+                        connection.sent += 1
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                        # rejected by the server, the session itself is still usable
+                        failures.append((message, e))
+                        continue
+                    except Exception as e:
+                        # no session could be had, so none of the remaining messages can go out now
+                        if connection is not None:
+                            self._discard(connection)
+                            connection = None
+                        failures.extend((pending, e) for pending in messages[position:])
+                        break
+                    if on_sent:
+                        on_sent(message)
+            finally:
+                if connection is not None:
+                    self._checkin(connection)
+        return failures
+
+    def send(self, message) -> None:
+        failures = self.send_many([message])
+        if failures:
+            raise failures[0][1]
+
+    def warm_up(self) -> None:
+        # logs a session in ahead of the first message, e.g. when the daemon starts
+        with self._slots:
+            self._checkin(self._checkout())
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(host: str, port: int, username: str, password: str) -> SmtpConnectionPool:
+    key = (host, port, username, password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SmtpConnectionPool(
+                host, port, username, password,
+                size=getattr(MailerConfig, 'MAIL_POOL_SIZE', 4),
+                max_messages=getattr(MailerConfig, 'MAIL_MAX_MESSAGES_PER_CONNECTION', 100),
+                noop_after=getattr(MailerConfig, 'MAIL_NOOP_AFTER_SECONDS', 30),
+                per_second=getattr(MailerConfig, 'MAIL_MAX_PER_SECOND', 10),
+            )
+            _pools[key] = pool
+    return pool
+
+
+@atexit.register
+def close_all() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
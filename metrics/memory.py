@@ -0,0 +1,118 @@
+import logging
+import sys
+import threading
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+# fraction of the ceiling each buffer that grows with the input may hold, the rest is left
+# for the interpreter, the SDKs and the bounded copy buffers that don't scale
+BUFFER_SHARES = {
+    'zip_stream': 0.125,
+    'zip_workers': 0.25,
+    's3_parts': 0.25,
+    'fanout': 0.125,
+}
+
+# threads a share may run at once: the zip stream, progress and process pool threads and the
+# widest of its upload pools, AwsConfig.AWS_MAX_CONCURRENCY parts or the file set's uploads
+SHARE_THREADS = 16
+
+# a compression worker's chunk in and out, with room for its allocator
+WORKER_RESERVE = 16 * MiB
+
+_limit_mb = None
+
+
+def set_limit(megabytes: int | None) -> None:
+    # --memory-limit-mb, takes precedence over PackagingConfig.MEMORY_LIMIT_MB
+    global _limit_mb
+    _limit_mb = megabytes
+
+
+def limit_bytes() -> int | None:
+    megabytes = _limit_mb
+    if megabytes is None:
+        megabytes = getattr(getattr(settings, 'PackagingConfig', None), 'MEMORY_LIMIT_MB', None)
+    return int(megabytes * MiB) if megabytes else None
+
+
+def buffer_budget(name: str, default: int) -> int:
+    # without a ceiling every buffer keeps its default size
+    limit = limit_bytes()
+    if not limit:
+        return default
+    return min(default, int(limit * BUFFER_SHARES[name]))
+
+
+def _thread_reserve(resource) -> int:
+    # a thread's whole stack counts as soon as it starts, plus the start of its malloc arena
+    stack = threading.stack_size()
+    if not stack:
+        soft, _ = resource.getrlimit(resource.RLIMIT_STACK)
+        stack = soft if soft != resource.RLIM_INFINITY else 8 * MiB
+    return stack + MiB
+
+
+def enforce_limit(shares: int = 1) -> bool:
+    # an address-space cap rather than an RSS one: RLIMIT_DATA counts memory that's reserved
+    # but never touched, so it's set above the ceiling by what the threads of shares shares
+    # running at once reserve, and by what a forked compression worker needs on top of the
+    # parent's mappings it starts with. going over raises MemoryError in the share instead
+    # of the container's OOM killer ending the whole process
+    limit = limit_bytes()
+    if not limit:
+        return False
+    try:
+        import resource
+    except ImportError:
+        logger.warning("Memory limits aren't supported on this platform, only the buffers are sized to it")
+        return False
+    limit += shares * SHARE_THREADS * _thread_reserve(resource) + WORKER_RESERVE
+    _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY and hard < limit:
+        limit = hard
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+    return True
+
+
+def _status_bytes(field: str) -> int | None:
+    try:
+        with open('/proc/self/status', encoding='ascii') as file:
+            for line in file:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss() -> int | None:
+    return _status_bytes('VmRSS')
+
+
+def reset_peak_rss() -> bool:
+    # Linux only, ru_maxrss can't be reset and a subprocess inherits its parent's through fork
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss(children: bool = False) -> int | None:
+    if not children:
+        peak = _status_bytes('VmHWM')
+        if peak is not None:
+            return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
@@ -0,0 +1,223 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageRecord:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.wall_seconds = 0.0
+        # cpu of the thread running the stage, compression workers in other processes aren't included
+        self.cpu_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.ok = True
+
+    def as_dict(self) -> dict:
+        return {
+            'wall_seconds': round(self.wall_seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ok': self.ok,
+        }
+
+
+class ShareMetrics:
+
+    def __init__(self, profile_stages: tuple = (), profile_dir: str = '.') -> None:
+        self.stages = {}
+        # per target figures of a fanned out upload, already part of the upload stage's time
+        self.targets = {}
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir
+
+    def record(self, name: str) -> StageRecord:
+        if name not in self.stages:
+            self.stages[name] = StageRecord(name)
+        return self.stages[name]
+
+    def target(self, name: str) -> StageRecord:
+        if name not in self.targets:
+            self.targets[name] = StageRecord(name)
+        return self.targets[name]
+
+    def add_bytes(self, name: str, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        record = self.record(name)
+        record.bytes_in += bytes_in or 0
+        record.bytes_out += bytes_out or 0
+
+    @contextmanager
+    def stage(self, name: str):
+        record = self.record(name)
+        profiler = None
+        if name in self.profile_stages or 'all' in self.profile_stages:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        except BaseException:
+            record.ok = False
+            raise
+        finally:
+            record.wall_seconds += time.perf_counter() - wall
+            record.cpu_seconds += time.thread_time() - cpu
+            if profiler:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(
+                    self.profile_dir, f"nifty_{name}_{os.getpid()}_{threading.get_ident()}_{int(time.time())}.prof"))
+
+    @property
+    def compression_ratio(self) -> float | None:
+        package = self.stages.get('package')
+        if not package or not package.bytes_in or not package.bytes_out:
+            return None
+        return round(package.bytes_out / package.bytes_in, 4)
+
+    @property
+    def upload_bytes_per_second(self) -> float | None:
+        upload = self.stages.get('upload')
+        if not upload or not upload.bytes_out or not upload.wall_seconds:
+            return None
+        return round(upload.bytes_out / upload.wall_seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            'stages': {name: record.as_dict() for name, record in self.stages.items()},
+            'targets': {name: record.as_dict() for name, record in self.targets.items()},
+            'total_seconds': round(sum(record.wall_seconds for record in self.stages.values()), 4),
+            'compression_ratio': self.compression_ratio,
+            'upload_bytes_per_second': self.upload_bytes_per_second,
+        }
+
+    def describe(self) -> str:
+        parts = [f"{name} {record.wall_seconds:.2f}s" for name, record in self.stages.items()]
+        if self.compression_ratio is not None:
+            parts.append(f"compression ratio {self.compression_ratio:.2f}")
+        if self.upload_bytes_per_second is not None:
+            parts.append(f"upload {self.upload_bytes_per_second / 1024 / 1024:.1f} MB/s")
+        for name, record in self.targets.items():
+            if record.bytes_out and record.wall_seconds:
+                parts.append(f"{name} {record.bytes_out / record.wall_seconds / 1024 / 1024:.1f} MB/s")
+        return ", ".join(parts)
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), separators=(',', ':'))
+
+
+class MetricsExporter:
+
+    # process-wide totals for the prometheus text file, plus one JSON line per share
+
+    def __init__(self) -> None:
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self.profile_stages = ()
+        self.profile_dir = '.'
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._target_totals = {}
+        self._shares = {'ok': 0, 'failed': 0}
+        self._last = None
+
+    def configure(self, jsonl_path: str = None, prometheus_path: str = None, profile_stages: tuple = (),
+                  profile_dir: str = '.') -> None:
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.profile_stages = tuple(profile_stages or ())
+        self.profile_dir = profile_dir
+
+    def new_share(self) -> ShareMetrics:
+        return ShareMetrics(self.profile_stages, self.profile_dir)
+
+    def export(self, metrics: ShareMetrics, labels: dict, ok: bool) -> None:
+        if not self.jsonl_path and not self.prometheus_path:
+            return
+        with self._lock:
+            self._shares['ok' if ok else 'failed'] += 1
+            for name, record in metrics.stages.items():
+                totals = self._totals.setdefault(name, [0.0, 0.0, 0, 0])
+                totals[0] += record.wall_seconds
+                totals[1] += record.cpu_seconds
+                totals[2] += record.bytes_in
+                totals[3] += record.bytes_out
+            for name, record in metrics.targets.items():
+                totals = self._target_totals.setdefault(name, [0.0, 0, 0])
+                totals[0] += record.wall_seconds
+                totals[1] += record.bytes_out
+                totals[2] += 0 if record.ok else 1
+            self._last = metrics
+
+            if self.jsonl_path:
+                line = {'time': time.time(), 'ok': ok, **labels, **metrics.as_dict()}
+                with open(self.jsonl_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(line) + "\n")
+            if self.prometheus_path:
+                self._write_prometheus()
+
+    def _write_prometheus(self) -> None:
+        lines = [
+            "# HELP nifty_shares_total Shares finished by this process.",
+            "# TYPE nifty_shares_total counter",
+        ]
+        lines += [f'nifty_shares_total{{status="{status}"}} {count}' for status, count in self._shares.items()]
+        for metric, index, help_text in (
+            ('nifty_stage_seconds_total', 0, 'Wall time spent in each share stage.'),
+            ('nifty_stage_cpu_seconds_total', 1, 'CPU time of the thread running each share stage.'),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{stage="{name}"}} {totals[index]:.6f}' for name, totals in self._totals.items()]
+        lines += ["# HELP nifty_stage_bytes_total Bytes read and written by each share stage.",
+                  "# TYPE nifty_stage_bytes_total counter"]
+        for name, totals in self._totals.items():
+            lines.append(f'nifty_stage_bytes_total{{stage="{name}",direction="in"}} {totals[2]}')
+            lines.append(f'nifty_stage_bytes_total{{stage="{name}",direction="out"}} {totals[3]}')
+        if self._target_totals:
+            # fanned out uploads, one series per target rather than per stage
+            lines += ["# HELP nifty_target_upload_seconds_total Wall time of the upload to each fan-out target.",
+                      "# TYPE nifty_target_upload_seconds_total counter"]
+            lines += [f'nifty_target_upload_seconds_total{{target="{name}"}} {totals[0]:.6f}'
+                      for name, totals in self._target_totals.items()]
+            for metric, index, help_text in (
+                ('nifty_target_upload_bytes_total', 1, 'Bytes uploaded to each fan-out target.'),
+                ('nifty_target_upload_failures_total', 2, 'Uploads that failed on each fan-out target.'),
+            ):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                lines += [f'{metric}{{target="{name}"}} {totals[index]}' for name, totals in self._target_totals.items()]
+        for metric, value, help_text in (
+            ('nifty_last_compression_ratio', self._last.compression_ratio, 'Archive size over content size of the last share.'),
+            ('nifty_last_upload_bytes_per_second', self._last.upload_bytes_per_second, 'Upload throughput of the last share.'),
+        ):
+            if value is not None:
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+
+        # written aside and renamed, so a collector never reads a half written file
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
+
+
+exporter = MetricsExporter()
+
+STAGE_NAMES = ('package', 'upload', 'mail', 'db', 'cleanup', 'all')
+
+
+def add_metrics_arguments(parser) -> None:
+    parser.add_argument('--metrics-jsonl', type=str, default=None, help='Append per-stage timings of every share to this JSON lines file')
+    parser.add_argument('--metrics-prom', type=str, default=None, help='Keep a Prometheus text file of stage totals at this path, e.g. for the node exporter')
+    parser.add_argument('--profile', action='append', choices=STAGE_NAMES, default=[], help='Write a cProfile .prof file for this stage (repeatable)')
+    parser.add_argument('--profile-dir', type=str, default='.', help='Directory for --profile output (default: .)')
+
+
+def configure_from_args(args) -> None:
+    # takes its options off args, so the rest can be passed on as they are
+    exporter.configure(args.metrics_jsonl, args.metrics_prom, args.profile, args.profile_dir)
+    for name in ('metrics_jsonl', 'metrics_prom', 'profile', 'profile_dir'):
+        delattr(args, name)
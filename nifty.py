@@ -1,10 +1,15 @@
 import argparse
+import sys
 from datetime import datetime, timedelta
 
 import logging_config
 import logging
 
 from core import NiftyCore
+from integrations import progress
+from metrics import memory
+from metrics.share_metrics import add_metrics_arguments, configure_from_args
+from scheduler.daemon_client import DEFAULT_SOCKET_PATH, DEFAULT_TOKEN_PATH
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +21,50 @@ if __name__ == '__main__':
     parser.add_argument('recipient', type=str, help='Email address of the recipient')
     parser.add_argument('-p', '--provider', type=str, default='Google', help='Cloud provider (default: Google)')
     parser.add_argument('-t', '--template', type=str, default='mailer.html', help='Email template filename (default: mailer.html)')
+    parser.add_argument('-s', '--stream', action='store_true', help='Zip folders straight into the upload without writing a temporary archive')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false', help='Always upload, even if identical content was shared before')
+    parser.add_argument('-r', '--resume', action='store_true', help='Continue an interrupted upload of the same file')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Processes used to compress folders (default: 1)')
+    parser.add_argument('--replicate-to', dest='replicas', action='append', default=None, metavar='TARGET', help='Also upload to this provider or provider:region at the same time, e.g. AWS:eu-west-1 (repeatable)')
+    parser.add_argument('-i', '--incremental', action='store_true', help='Upload only the files that changed since this path was last shared, as separate objects listed on an index page')
+    parser.add_argument('--no-archive', dest='archive', action='store_false', help='Upload the files of a folder as separate objects listed on an index page instead of zipping them')
+    parser.add_argument('--async-mail', action='store_true', help='Queue the email for the outbox worker instead of sending it before returning')
+    parser.add_argument('--progress', choices=progress.MODES, default='text', help='Upload progress as text, JSON lines on stderr or not at all (default: text)')
+    parser.add_argument('--daemon', type=str, nargs='?', default=None, const=DEFAULT_SOCKET_PATH, metavar='ADDRESS', help=f'Hand the share to a running nifty_daemon.py at this socket path or http://host:port and wait for it (default address: {DEFAULT_SOCKET_PATH})')
+    parser.add_argument('--daemon-token-file', type=str, default=DEFAULT_TOKEN_PATH, help=f'Token the daemon wrote when it started (default: {DEFAULT_TOKEN_PATH})')
+    parser.add_argument('--priority', type=int, default=0, help='With --daemon, jobs with a higher priority start first (default: 0)')
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help='Memory ceiling the buffers are sized to fit, enforced as an address-space cap with room for thread stacks on top (default: PackagingConfig.MEMORY_LIMIT_MB)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
+    configure_from_args(args)
+
+    progress.set_mode(args.progress)
+    del args.progress
+
+    memory.set_limit(args.memory_limit_mb)
+    memory.enforce_limit()
+    del args.memory_limit_mb
+
+    daemon, priority, token_file = args.daemon, args.priority, args.daemon_token_file
+    del args.daemon, args.priority, args.daemon_token_file
+    if daemon:
+        # the daemon runs the share with its warm clients, this only waits for the outcome
+        from scheduler.daemon_client import DaemonClient, DaemonError
+
+        client = DaemonClient(daemon, token_file=token_file)
+        try:
+            job = client.submit(vars(args), priority)
+            logger.info(f"Job {job['id']} queued on the daemon")
+            job = client.wait(job['id'])
+        except (DaemonError, OSError) as e:
+            logger.error(f"The daemon at {daemon} did not take the share: {e}")
+            sys.exit(1)
+        if job['status'] != 'ok':
+            logger.error(f"Job {job['id']} {job['status']} during {job['stage']}: {job['error']}")
+            sys.exit(1)
+        logger.info(f"Shared {job['options']['file_path']} with {job['options']['recipient']}: {job['download_link']}")
+        sys.exit(0)
+
     nifty = NiftyCore(**vars(args))
     nifty.share()
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+
+import logging_config
+import logging
+
+from integrations import progress
+from metrics import memory
+from metrics.share_metrics import add_metrics_arguments, configure_from_args
+from scheduler.batch_scheduler import StageScheduler, read_jobs, summarize
+
+logger = logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Share many files with many recipients in one run.')
+    parser.add_argument('manifest', type=str, help='CSV or JSON lines file with a file_path and recipient per job')
+    parser.add_argument('-p', '--provider', type=str, default='Google', help='Default cloud provider (default: Google)')
+    parser.add_argument('-t', '--template', type=str, default='mailer.html', help='Default email template filename (default: mailer.html)')
+    parser.add_argument('--package-workers', type=int, default=2, help='Jobs zipping at the same time (default: 2)')
+    parser.add_argument('--upload-workers', type=int, default=4, help='Jobs uploading at the same time (default: 4)')
+    parser.add_argument('--mail-workers', type=int, default=2, help='Jobs sending mail at the same time (default: 2)')
+    parser.add_argument('--db-workers', type=int, default=1, help='Jobs writing to the database at the same time (default: 1)')
+    parser.add_argument('--db-batch-size', type=int, default=50, help='Finished jobs saved to the database per transaction (default: 50)')
+    parser.add_argument('--replicate-to', dest='replicas', action='append', default=None, metavar='TARGET', help='Default extra provider or provider:region every job is uploaded to at the same time (repeatable)')
+    parser.add_argument('--async-mail', action='store_true', help='Queue every email for the outbox worker instead of sending them during the run')
+    parser.add_argument('--progress', choices=progress.MODES, default='none', help='Upload progress as text, JSON lines on stderr or not at all (default: none)')
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help='Memory ceiling for the whole run, the buffers are sized to fit and it\'s enforced as an address-space cap with room for each running job\'s thread stacks on top (default: PackagingConfig.MEMORY_LIMIT_MB)')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    configure_from_args(args)
+
+    # text progress lines from concurrent uploads would overwrite each other
+    progress.set_mode(args.progress)
+
+    memory.set_limit(args.memory_limit_mb)
+    # the jobs zipping or uploading are the ones running threads of their own
+    memory.enforce_limit(shares=args.package_workers + args.upload_workers)
+
+    jobs = read_jobs(args.manifest, defaults={'provider': args.provider, 'template': args.template,
+                                                'async_mail': args.async_mail, 'replicas': args.replicas})
+    scheduler = StageScheduler({
+        'package': args.package_workers,
+        'upload': args.upload_workers,
+        'mail': args.mail_workers,
+        'db': args.db_workers,
+    }, db_batch_size=args.db_batch_size)
+    jobs = scheduler.run(jobs)
+
+    if all(job.status == 'ok' for job in jobs):
+        logger.info(f"Batch finished{os.linesep}{summarize(jobs)}")
+        sys.exit(0)
+    logger.error(f"Batch finished with failures{os.linesep}{summarize(jobs)}")
+    sys.exit(1)
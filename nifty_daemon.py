@@ -0,0 +1,78 @@
+import argparse
+import os
+import signal
+import threading
+
+import logging_config
+import logging
+
+from integrations import progress
+from metrics import memory
+from metrics.share_metrics import add_metrics_arguments, configure_from_args
+from scheduler.daemon_client import DEFAULT_SOCKET_PATH, DEFAULT_TOKEN_PATH
+from scheduler.share_daemon import ShareDaemon, create_server, write_token
+
+logger = logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run shares submitted over a local API, keeping clients and connections warm between them.')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH, help=f'Listen on this Unix socket, only your user can connect (default: {DEFAULT_SOCKET_PATH})')
+    parser.add_argument('--http', action='store_true', help='Listen on --host and --port over HTTP instead of the socket')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on with --http (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on with --http (default: 8765)')
+    parser.add_argument('--token-file', type=str, default=DEFAULT_TOKEN_PATH, help=f'Where the token clients must send is written, readable by your user only (default: {DEFAULT_TOKEN_PATH})')
+    parser.add_argument('--allow-root', dest='allowed_roots', action='append', default=None, metavar='DIR', help='Only share files under this directory (repeatable, default: anything your user can read)')
+    parser.add_argument('-p', '--provider', type=str, default='Google', help='Cloud provider of jobs that don\'t set one (default: Google)')
+    parser.add_argument('-t', '--template', type=str, default='mailer.html', help='Email template of jobs that don\'t set one (default: mailer.html)')
+    parser.add_argument('--warm', nargs='*', default=None, metavar='PROVIDER', help='Providers whose clients are built at startup (default: --provider)')
+    parser.add_argument('--max-jobs', type=int, default=None, help='Jobs running at once, the rest wait by priority (default: package + upload workers)')
+    parser.add_argument('--package-workers', type=int, default=2, help='Jobs zipping at the same time (default: 2)')
+    parser.add_argument('--upload-workers', type=int, default=4, help='Jobs uploading at the same time (default: 4)')
+    parser.add_argument('--mail-workers', type=int, default=2, help='Jobs sending mail at the same time (default: 2)')
+    parser.add_argument('--db-workers', type=int, default=1, help='Jobs writing to the database at the same time (default: 1)')
+    parser.add_argument('--keep-finished', type=int, default=1000, help='Finished jobs whose status can still be queried (default: 1000)')
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help='Memory ceiling for the whole daemon, enforced as an address-space cap with room for each running job\'s thread stacks on top (default: PackagingConfig.MEMORY_LIMIT_MB)')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    configure_from_args(args)
+    # several jobs upload at once, their text progress lines would overwrite each other
+    progress.set_mode('none')
+
+    memory.set_limit(args.memory_limit_mb)
+
+    socket_path = None if args.http else args.socket
+    if socket_path is None and args.host not in ('127.0.0.1', 'localhost', '::1'):
+        logger.warning(f"The job API is plain HTTP on {args.host}, its token can be read off the network")
+
+    daemon = ShareDaemon({
+        'package': args.package_workers,
+        'upload': args.upload_workers,
+        'mail': args.mail_workers,
+        'db': args.db_workers,
+    }, max_jobs=args.max_jobs, keep_finished=args.keep_finished,
+        defaults={'provider': args.provider, 'template': args.template}, allowed_roots=args.allowed_roots)
+    memory.enforce_limit(shares=daemon.max_jobs)
+    daemon.warm_up(args.warm if args.warm is not None else [args.provider])
+    daemon.start()
+
+    server = create_server(daemon, write_token(args.token_file), socket_path, args.host, args.port)
+
+    def shut_down(signum, frame) -> None:
+        # serve_forever has to be stopped from another thread
+        logger.info("Stopping, queued and running jobs are finished first")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shut_down)
+    signal.signal(signal.SIGINT, shut_down)
+
+    logger.info(f"Listening on {socket_path or f'http://{args.host}:{args.port}'}, token in {args.token_file}")
+    server.serve_forever()
+    server.server_close()
+    if socket_path:
+        os.remove(socket_path)
+    os.remove(args.token_file)
+    daemon.stop()
+    logger.info("All jobs finished")
@@ -0,0 +1,26 @@
+import argparse
+import sys
+from datetime import datetime
+
+import logging_config
+import logging
+
+from scheduler.expiry_sweeper import ExpirySweeper
+
+logger = logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Delete the uploaded objects of expired shares.')
+    parser.add_argument('--before', type=datetime.fromisoformat, default=None, help='Sweep shares that expired before this ISO date (default: now)')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Delete requests sent at the same time (default: 4)')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only list the objects that would be deleted')
+    args = parser.parse_args()
+
+    result = ExpirySweeper(workers=args.workers, dry_run=args.dry_run).sweep(args.before)
+
+    if result.failed_objects:
+        logger.error(f"Sweep finished with failures: {result.describe()}")
+        sys.exit(1)
+    logger.info(f"Sweep finished: {result.describe()}")
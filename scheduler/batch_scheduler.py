@@ -0,0 +1,164 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core import NiftyCore
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STAGE_LIMITS = {
+    'package': 2,
+    'upload': 4,
+    'mail': 2,
+    'db': 1,
+}
+
+BOOLEAN_OPTIONS = ('stream', 'dedup', 'resume', 'async_mail', 'incremental', 'archive')
+INTEGER_OPTIONS = ('workers',)
+# lists given as "AWS:eu-west-1;Google" in a CSV cell, or as a JSON array
+LIST_OPTIONS = ('replicas',)
+
+
+class ShareJob:
+
+    def __init__(self, index: int, options: dict) -> None:
+        self.index = index
+        self.options = options
+        self.status = 'pending'
+        self.stage = None
+        self.error = None
+        self.seconds = 0.0
+        self.download_link = None
+        self.metrics = None
+
+
+def _coerce(options: dict) -> dict:
+    options = {key: value for key, value in options.items() if value not in (None, '')}
+    for key in BOOLEAN_OPTIONS:
+        if isinstance(options.get(key), str):
+            options[key] = options[key].strip().lower() in ('1', 'true', 'yes', 'y')
+    for key in INTEGER_OPTIONS:
+        if key in options:
+            options[key] = int(options[key])
+    for key in LIST_OPTIONS:
+        if isinstance(options.get(key), str):
+            options[key] = [item.strip() for item in options[key].split(';') if item.strip()]
+    return options
+
+
+def read_jobs(manifest_path: str, defaults: dict = None) -> list:
+    defaults = defaults or {}
+    with open(manifest_path, newline='', encoding='utf-8') as file:
+        if manifest_path.lower().endswith(('.jsonl', '.json')):
+            rows = [json.loads(line) for line in file if line.strip()]
+        else:
+            rows = list(csv.DictReader(file))
+
+    jobs = []
+    for index, row in enumerate(rows, start=1):
+        options = {**defaults, **_coerce(row)}
+        if not options.get('file_path') or not options.get('recipient'):
+            raise ValueError(f"Job {index} in {manifest_path} needs a file_path and a recipient")
+        jobs.append(ShareJob(index, options))
+    return jobs
+
+
+class StageScheduler:
+
+    def __init__(self, stage_limits: dict = None, db_batch_size: int = 50) -> None:
+        self.stage_limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+        self._semaphores = {stage: threading.BoundedSemaphore(limit) for stage, limit in self.stage_limits.items()}
+        self.db_batch_size = db_batch_size
+        self._unsaved = []
+        self._unsaved_lock = threading.Lock()
+
+    def _defer_save(self, job: ShareJob, nifty: NiftyCore) -> None:
+        with self._unsaved_lock:
+            self._unsaved.append((job, nifty))
+            if len(self._unsaved) < self.db_batch_size:
+                return
+            batch, self._unsaved = self._unsaved, []
+        self._save(batch)
+
+    def _save(self, batch: list) -> None:
+        # finished jobs are written together, one commit instead of one per job
+        with self._semaphores['db']:
+            try:
+                NiftyCore.save_transfers([nifty for _, nifty in batch])
+                for job, _ in batch:
+                    job.status = 'ok'
+            except Exception as e:
+                logger.error(f"Saving {len(batch)} jobs failed: {e}")
+                for job, _ in batch:
+                    job.status = 'failed'
+                    job.error = str(e)
+        for job, nifty in batch:
+            self._finish(job, nifty, job.status == 'ok')
+
+    def _finish(self, job: ShareJob, nifty: NiftyCore, ok: bool) -> None:
+        if not ok:
+            nifty._abandon()
+        nifty._export_metrics(ok)
+        job.metrics = nifty._metrics.as_dict()
+
+    def _run_job(self, job: ShareJob) -> ShareJob:
+        start = time.perf_counter()
+        # every job zips into its own directory so two jobs for the same folder can't collide
+        work_dir = tempfile.mkdtemp(prefix=f"nifty_job_{job.index}_", dir='.')
+        nifty = None
+        ok = False
+        deferred = False
+        try:
+            nifty = NiftyCore(**job.options, work_dir=work_dir)
+            for stage, run in nifty.stages():
+                job.stage = stage
+                if stage == 'db' and self.db_batch_size > 1:
+                    deferred = True
+                    continue
+                with self._semaphores[stage]:
+                    nifty.run_stage(stage, run)
+            ok = True
+            job.download_link = nifty.download_link
+            if not deferred:
+                job.status = 'ok'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"Job {job.index} failed during {job.stage}: {e}")
+        finally:
+            if nifty:
+                nifty.run_stage('cleanup', nifty._cleanup)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            job.seconds = time.perf_counter() - start
+        if ok and deferred:
+            # its metrics are exported once the batch it's saved with has been written
+            self._defer_save(job, nifty)
+        elif nifty:
+            self._finish(job, nifty, ok)
+        return job
+
+    def run(self, jobs: list) -> list:
+        # enough threads for every stage to be saturated at once, the semaphores do the limiting
+        with ThreadPoolExecutor(max_workers=sum(self.stage_limits.values())) as pool:
+            jobs = list(pool.map(self._run_job, jobs))
+        if self._unsaved:
+            batch, self._unsaved = self._unsaved, []
+            self._save(batch)
+        return jobs
+
+
+def summarize(jobs: list) -> str:
+    lines = [f"{'job':>4}  {'status':<7} {'seconds':>8}  {'recipient':<30} file / error"]
+    for job in jobs:
+        detail = job.options['file_path'] if job.status == 'ok' else f"{job.options['file_path']} ({job.stage}: {job.error})"
+        lines.append(f"{job.index:>4}  {job.status:<7} {job.seconds:>8.2f}  {job.options['recipient']:<30} {detail}")
+    failed = sum(1 for job in jobs if job.status != 'ok')
+    lines.append(f"{len(jobs) - failed} succeeded, {failed} failed")
+    return os.linesep.join(lines)
@@ -0,0 +1,101 @@
+import http.client
+import json
+import os
+import socket
+import time
+from urllib.parse import urlparse
+
+# where the daemon listens and keeps its token unless told otherwise, a directory only this user can open
+DAEMON_DIR = os.path.join(os.path.expanduser('~'), '.nifty')
+DEFAULT_SOCKET_PATH = os.path.join(DAEMON_DIR, 'daemon.sock')
+DEFAULT_TOKEN_PATH = os.path.join(DAEMON_DIR, 'daemon.token')
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonError(Exception):
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class DaemonClient:
+
+    # address is the daemon's Unix socket path, or http://host:port; every request carries the
+    # token the daemon wrote to token_file when it started
+
+    def __init__(self, address: str = DEFAULT_SOCKET_PATH, timeout: float = 30,
+                 token_file: str = DEFAULT_TOKEN_PATH) -> None:
+        self.address = address
+        self.timeout = timeout
+        self.token_file = token_file
+        self._token = None
+
+    def _authorization(self) -> str:
+        if self._token is None:
+            try:
+                with open(self.token_file, encoding='ascii') as file:
+                    self._token = file.read().strip()
+            except OSError as e:
+                raise DaemonError(401, f"Can't read the daemon's token from {self.token_file}: {e}")
+        return f"Bearer {self._token}"
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith('http://'):
+            url = urlparse(self.address)
+            return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+        return _UnixHTTPConnection(self.address, self.timeout)
+
+    def _request(self, method: str, path: str, body: dict = None) -> dict:
+        connection = self._connection()
+        try:
+            payload = json.dumps(body).encode('utf-8') if body is not None else None
+            headers = {'Authorization': self._authorization()}
+            if payload:
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            result = json.loads(response.read() or b'{}')
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise DaemonError(response.status, result.get('error', response.reason))
+        return result
+
+    def submit(self, options: dict, priority: int = 0) -> dict:
+        # the daemon may run from another directory, so paths are sent absolute
+        options = {**options, 'file_path': os.path.abspath(options['file_path']), 'priority': priority}
+        return self._request('POST', '/jobs', options)
+
+    def job(self, job_id: int) -> dict:
+        return self._request('GET', f"/jobs/{job_id}")
+
+    def jobs(self, status: str = None) -> list:
+        return self._request('GET', f"/jobs?status={status}" if status else '/jobs')['jobs']
+
+    def cancel(self, job_id: int) -> dict:
+        return self._request('DELETE', f"/jobs/{job_id}")
+
+    def status(self) -> dict:
+        return self._request('GET', '/status')
+
+    def wait(self, job_id: int, poll_seconds: float = 0.2, timeout: float = None) -> dict:
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            job = self.job(job_id)
+            if job['status'] in ('ok', 'failed', 'cancelled'):
+                return job
+            if deadline and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} is still {job['status']}")
+            time.sleep(poll_seconds)
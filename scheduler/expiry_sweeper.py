@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database.database import get_db_connection
+from integrations.file_upload import FileUploaderClass
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SweepResult:
+
+    def __init__(self) -> None:
+        self.expired_transfers = 0
+        self.deleted_objects = 0
+        self.failed_objects = 0
+        # expired, but the object is still linked from a newer share
+        self.kept_objects = 0
+        # held back by a share whose database write failed, saved before the sweep
+        self.saved_transfers = 0
+
+    def describe(self) -> str:
+        described = (f"{self.expired_transfers} expired transfers, {self.deleted_objects} objects deleted, "
+                     f"{self.kept_objects} still in use, {self.failed_objects} failed")
+        if self.saved_transfers:
+            described += f", {self.saved_transfers} held back transfers saved"
+        return described
+
+
+class ExpirySweeper:
+
+    def __init__(self, workers: int = 4, dry_run: bool = False, uploaders: dict = None) -> None:
+        self.workers = workers
+        self.dry_run = dry_run
+        # provider -> uploader, anything with delete_objects(keys) -> deleted keys will do
+        self.uploaders = uploaders or {}
+
+    def _uploader(self, provider: str):
+        if provider not in self.uploaders:
+            self.uploaders[provider] = FileUploaderClass().create_file_uploader(provider)
+        return self.uploaders[provider]
+
+    def _delete(self, doomed: dict) -> dict:
+        # every batch of every provider is its own request, run side by side
+        deleted = {provider: [] for provider in doomed}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            for provider, object_keys in doomed.items():
+                uploader = self._uploader(provider)
+                batch_size = getattr(uploader, 'DELETE_BATCH_SIZE', 1000)
+                for start in range(0, len(object_keys), batch_size):
+                    batch = object_keys[start:start + batch_size]
+                    futures.append((provider, batch, pool.submit(uploader.delete_objects, batch)))
+            for provider, batch, future in futures:
+                try:
+                    deleted[provider].extend(future.result() or [])
+                except Exception as e:
+                    logger.error(f"Deleting {len(batch)} {provider} objects failed: {e}")
+        return deleted
+
+    def sweep(self, now: datetime = None) -> SweepResult:
+        now = now or datetime.now()
+        result = SweepResult()
+        if not self.dry_run:
+            # shares whose mail went out but whose record couldn't be written, so they expire too
+            from core import NiftyCore
+            result.saved_transfers = NiftyCore.save_unsaved()
+
+        connection = get_db_connection()
+        with connection as db:
+            expired = db.expired_objects(now)
+            transfers = {}
+            for transfer_id, provider, object_key in expired:
+                transfers.setdefault((provider, object_key), []).append(transfer_id)
+            doomed, kept = {}, []
+            for provider in {provider for provider, _ in transfers}:
+                object_keys = [object_key for key_provider, object_key in transfers if key_provider == provider]
+                live = db.live_object_keys(provider, object_keys, now)
+                doomed[provider] = [object_key for object_key in object_keys if object_key not in live]
+                kept.extend((provider, object_key) for object_key in live)
+
+        result.expired_transfers = len({transfer_id for transfer_id, _, _ in expired})
+        result.kept_objects = len(kept)
+        if self.dry_run:
+            for provider, object_keys in doomed.items():
+                for object_key in object_keys:
+                    logger.info(f"Would delete {provider} {object_key}")
+            result.deleted_objects = sum(len(object_keys) for object_keys in doomed.values())
+            return result
+
+        deleted = self._delete(doomed)
+        result.deleted_objects = sum(len(object_keys) for object_keys in deleted.values())
+        result.failed_objects = sum(len(object_keys) for object_keys in doomed.values()) - result.deleted_objects
+
+        # shares whose object is still in use are done with too, the newer share will purge it;
+        # a fanned out share is only done once every one of its copies is
+        done = set(kept) | {(provider, object_key) for provider, object_keys in deleted.items()
+                            for object_key in object_keys}
+        unfinished = {transfer_id for key, transfer_ids in transfers.items() if key not in done
+                      for transfer_id in transfer_ids}
+        purged = sorted({transfer_id for transfer_id, _, _ in expired} - unfinished)
+        with connection as db:
+            db.mark_purged(purged, now)
+            for provider, object_keys in deleted.items():
+                # so the dedup check can't hand out a link to a deleted object
+                db.forget_payload_keys(provider, object_keys)
+        return result
@@ -0,0 +1,343 @@
+import heapq
+import hmac
+import itertools
+import json
+import os
+import re
+import secrets
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from scheduler.batch_scheduler import DEFAULT_STAGE_LIMITS, ShareJob, StageScheduler, _coerce
+from scheduler.daemon_client import DEFAULT_SOCKET_PATH
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# what a job may set, the same options nifty.py takes; the daemon picks the work directory
+JOB_OPTIONS = ('file_path', 'recipient', 'provider', 'template', 'stream', 'workers', 'dedup',
+               'resume', 'async_mail', 'replicas', 'incremental', 'archive')
+
+
+class DaemonJob(ShareJob):
+
+    def __init__(self, index: int, options: dict, priority: int = 0) -> None:
+        super().__init__(index, options)
+        self.status = 'queued'
+        self.priority = priority
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def as_dict(self) -> dict:
+        return {
+            'id': self.index,
+            'status': self.status,
+            'stage': self.stage,
+            'priority': self.priority,
+            'options': self.options,
+            'error': self.error,
+            'download_link': self.download_link,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'seconds': round(self.seconds, 4),
+            'metrics': self.metrics,
+        }
+
+
+class JobQueue:
+
+    # the highest priority first, and first in first out within a priority
+
+    def __init__(self, keep_finished: int = 1000) -> None:
+        self._heap = []
+        self._jobs = {}
+        self._finished = deque()
+        self._keep_finished = keep_finished
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, options: dict, priority: int = 0) -> DaemonJob:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The daemon is shutting down and takes no new jobs")
+            job = DaemonJob(next(self._ids), options, priority)
+            self._jobs[job.index] = job
+            heapq.heappush(self._heap, (-priority, job.index))
+            self._condition.notify()
+        return job
+
+    def get(self) -> DaemonJob | None:
+        # blocks until a job is due, None once the queue is closed and empty
+        with self._condition:
+            while True:
+                while self._heap:
+                    _, index = heapq.heappop(self._heap)
+                    job = self._jobs.get(index)
+                    # cancelled jobs stay in the heap until they come up
+                    if job is not None and job.status == 'queued':
+                        job.status = 'running'
+                        job.started_at = time.time()
+                        return job
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def finish(self, job: DaemonJob) -> None:
+        with self._condition:
+            job.finished_at = time.time()
+            self._finished.append(job.index)
+            # only the most recent finished jobs are kept, the transfers table has the rest
+            while len(self._finished) > self._keep_finished:
+                self._jobs.pop(self._finished.popleft(), None)
+
+    def cancel(self, index: int) -> DaemonJob | None:
+        with self._condition:
+            job = self._jobs.get(index)
+            if job is None or job.status != 'queued':
+                return job
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            self._finished.append(job.index)
+            return job
+
+    def job(self, index: int) -> DaemonJob | None:
+        return self._jobs.get(index)
+
+    def jobs(self, status: str = None) -> list:
+        with self._condition:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if status is None or job.status == status]
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class ShareDaemon:
+
+    # runs share jobs as they're submitted in a process that stays up, so the SDKs, clients,
+    # template environment and database and SMTP pools are set up once rather than per share
+
+    def __init__(self, stage_limits: dict = None, max_jobs: int = None, keep_finished: int = 1000,
+                 defaults: dict = None, allowed_roots: list = None) -> None:
+        # options of jobs that don't set them, e.g. the provider
+        self.defaults = defaults or {}
+        # when set, only files and folders under these directories can be shared
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots or []]
+        self.stage_limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+        # every finished job is saved straight away, nothing waits for a batch to fill
+        self.scheduler = StageScheduler(self.stage_limits, db_batch_size=1)
+        # jobs beyond this wait in the queue, where priority decides which starts next
+        self.max_jobs = max_jobs or self.stage_limits['package'] + self.stage_limits['upload']
+        self.queue = JobQueue(keep_finished)
+        self.started_at = time.time()
+        self._threads = []
+
+    def warm_up(self, providers: list) -> None:
+        # the first job then runs as fast as the rest, failures are only logged
+        from database.database import get_db_connection
+        from integrations.file_upload import FileUploaderClass
+        from mailer.email_formatter import get_environment
+        from mailer.email_sender import EmailSender
+
+        steps = [(f"{provider} client", lambda provider=provider: getattr(
+            FileUploaderClass().create_file_uploader(provider), 'warm_up', lambda: None)()) for provider in providers]
+        steps += [
+            ('database', lambda: get_db_connection()),
+            ('email templates', lambda: get_environment('mail_templates')),
+            ('SMTP session', lambda: EmailSender()._pool().warm_up()),
+        ]
+        for name, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+                logger.info(f"Warmed up the {name} in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                logger.warning(f"Could not warm up the {name}: {e}")
+
+    def submit(self, options: dict, priority: int = 0) -> DaemonJob:
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown job options: {', '.join(sorted(unknown))}")
+        options = {**self.defaults, **_coerce(options)}
+        if not options.get('file_path') or not options.get('recipient'):
+            raise ValueError("A job needs a file_path and a recipient")
+        if not os.path.exists(options['file_path']):
+            raise ValueError(f"{options['file_path']} does not exist")
+        if self.allowed_roots and not self._allowed(options['file_path']):
+            raise ValueError(f"{options['file_path']} is outside the folders this daemon shares from")
+        job = self.queue.put(options, priority)
+        logger.info(f"Job {job.index} queued with priority {priority}: {options['file_path']} for {options['recipient']}")
+        return job
+
+    def _allowed(self, file_path: str) -> bool:
+        # symlinks are resolved first, so a link inside a root can't point outside it
+        real_path = os.path.realpath(file_path)
+        return any(os.path.commonpath([real_path, root]) == root for root in self.allowed_roots)
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self.scheduler._run_job(job)
+            finally:
+                self.queue.finish(job)
+            logger.info(f"Job {job.index} {job.status} in {job.seconds:.2f}s")
+
+    def start(self) -> 'ShareDaemon':
+        for number in range(self.max_jobs):
+            thread = threading.Thread(target=self._work, name=f"share-job-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = None) -> None:
+        # takes no new jobs, then lets the queued and running ones finish
+        self.queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def status(self) -> dict:
+        counts = {}
+        for job in self.queue.jobs():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            'jobs': counts,
+            'max_jobs': self.max_jobs,
+            'stage_limits': self.stage_limits,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+        }
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+
+    # POST /jobs, GET /jobs[?status=], GET /jobs/<id>, DELETE /jobs/<id> to cancel, GET /status;
+    # every request needs the daemon's token, see write_token
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'NiftyDaemon'
+
+    def log_message(self, format, *args) -> None:
+        logger.debug(format % args)
+
+    def _reply(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _refused(self) -> bool:
+        # a browser adds an Origin to requests a web page makes, no local client does
+        if self.headers.get('Origin') is not None:
+            self.close_connection = True
+            self._reply(403, {'error': "Cross-origin requests are not accepted"})
+            return True
+        expected = f"Bearer {self.server.token}".encode('utf-8')
+        if not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), expected):
+            self.close_connection = True
+            self._reply(401, {'error': "Missing or wrong token"})
+            return True
+        return False
+
+    def _job_id(self) -> int | None:
+        match = re.fullmatch(r'/jobs/(\d+)', urlparse(self.path).path)
+        return int(match.group(1)) if match else None
+
+    def do_GET(self) -> None:
+        if self._refused():
+            return
+        url = urlparse(self.path)
+        daemon = self.server.share_daemon
+        if url.path == '/status':
+            return self._reply(200, daemon.status())
+        if url.path == '/jobs':
+            status = parse_qs(url.query).get('status', [None])[0]
+            return self._reply(200, {'jobs': [job.as_dict() for job in daemon.queue.jobs(status)]})
+        index = self._job_id()
+        job = daemon.queue.job(index) if index is not None else None
+        if job is None:
+            return self._reply(404, {'error': f"No job at {url.path}"})
+        self._reply(200, job.as_dict())
+
+    def do_POST(self) -> None:
+        if self._refused():
+            return
+        if urlparse(self.path).path != '/jobs':
+            self.close_connection = True
+            return self._reply(404, {'error': f"No route for {self.path}"})
+        # forms and text/plain are what a page can post without a preflight
+        if self.headers.get_content_type() != 'application/json':
+            self.close_connection = True
+            return self._reply(415, {'error': "Jobs must be posted as application/json"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            priority = int(body.pop('priority', 0))
+            job = self.server.share_daemon.submit(body, priority)
+        except (ValueError, TypeError, AttributeError) as e:
+            return self._reply(400, {'error': str(e)})
+        except RuntimeError as e:
+            return self._reply(503, {'error': str(e)})
+        self._reply(201, job.as_dict())
+
+    def do_DELETE(self) -> None:
+        if self._refused():
+            return
+        index = self._job_id()
+        job = self.server.share_daemon.queue.cancel(index) if index is not None else None
+        if job is None:
+            return self._reply(404, {'error': f"No job at {self.path}"})
+        if job.status != 'cancelled':
+            return self._reply(409, {'error': f"Job {index} is {job.status}, only queued jobs can be cancelled"})
+        self._reply(200, job.as_dict())
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def get_request(self) -> tuple:
+        # http.server expects a (host, port) client address
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+
+def write_token(token_path: str) -> str:
+    # a fresh token every start, readable by this user only; clients send it as a bearer token
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(token_path) or '.', mode=0o700, exist_ok=True)
+    if os.path.exists(token_path):
+        os.remove(token_path)
+    descriptor = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'w', encoding='ascii') as file:
+        file.write(token)
+    return token
+
+
+def create_server(daemon: ShareDaemon, token: str, socket_path: str = DEFAULT_SOCKET_PATH,
+                  host: str = '127.0.0.1', port: int = 8765):
+    # a Unix socket only this user can open, or with socket_path=None plain HTTP on the loopback
+    if socket_path:
+        os.makedirs(os.path.dirname(socket_path) or '.', mode=0o700, exist_ok=True)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, DaemonRequestHandler)
+        os.chmod(socket_path, 0o600)
+    else:
+        server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        server.daemon_threads = True
+    server.share_daemon = daemon
+    server.token = token
+    return server
@@ -16,6 +16,18 @@ class AwsConfig:
     # for Wasabi (AWS Backed) you NEED to provide an endpoint url
     # AWS_ENDPOINT_URL = "https://s3.us-east-1.wasabisys.com"
 
+    # connections kept open by the shared S3 client, raise it if you run many uploads at once
+    AWS_MAX_POOL_CONNECTIONS = 50
+
+    # parallel part uploads per file, part sizes are picked from the file size and the
+    # throughput measured on earlier uploads, but are never smaller than AWS_MIN_PART_SIZE
+    AWS_MAX_CONCURRENCY = 10
+    AWS_MIN_PART_SIZE = 1024 * 1024 * 8
+
+    # buckets for --replicate-to AWS:<region>, and endpoints where a region needs one
+    # AWS_REGION_BUCKETS = {"eu-west-1": "nifty-storage-eu"}
+    # AWS_REGION_ENDPOINTS = {"eu-west-1": "https://s3.eu-west-1.amazonaws.com"}
+
 
 class GoogleConfig:
 
@@ -24,6 +36,12 @@ class GoogleConfig:
     GGL_BUCKET_NAME = 'nifty-storage'
     GGL_CREDENTIALS_PATH = 'google.json'
 
+    # only for a storage emulator, e.g. fake-gcs-server, leave unset for Google itself
+    # GGL_ENDPOINT_URL = "http://127.0.0.1:4443"
+
+    # buckets for --replicate-to Google:<location>
+    # GGL_REGION_BUCKETS = {"europe-west3": "nifty-storage-eu"}
+
 
 class MailerConfig:
 
@@ -51,11 +69,30 @@ class MailerConfig:
     MAIL_HOST_SENDER_NAME = "The mame you want to show on the email"
     MAIL_HOST_SENDER_ADDRESS = "youremail@example.com"
 
+    # logged-in sessions are kept open and reused between messages
+    MAIL_POOL_SIZE = 4
+    MAIL_MAX_MESSAGES_PER_CONNECTION = 100
+    MAIL_NOOP_AFTER_SECONDS = 30
+    # stay under your provider's sending rate, e.g. the SES per-second quota
+    MAIL_MAX_PER_SECOND = 10
+    # compiled email templates, reused across runs
+    MAIL_TEMPLATE_CACHE_DIR = ".jinja_cache"
+    # with --replicate-to, the first (recipient pattern, target) that matches picks the
+    # link that's mailed, recipients matching none get the --provider link
+    # MAIL_REPLICA_RULES = [
+    #     ("*.co.za", "AWS:af-south-1"),
+    #     ("*@example.de", "Google:europe-west3"),
+    # ]
+
 class DatabaseConfig:
 
     DB_TYPE = "sqlite"
     SQLITE_DB_FILENAME = "nifty.db"
 
+    # checkpoints for resumable uploads, always a local sqlite file
+    UPLOAD_STATE_FILENAME = "nifty_uploads.db"
+    UPLOAD_SESSION_MAX_AGE_DAYS = 6
+
     SQLITE_COLS = "id INTEGER PRIMARY KEY AUTOINCREMENT, " \
                 "sender_name VARCHAR(100), " \
                 "file_basename VARCHAR(100), " \
@@ -65,6 +102,11 @@ class DatabaseConfig:
                 "expiry_date DATETIME, " \
                 "file_size_bytes INT, " \
                 "files_list TEXT, " \
+                "mail_status VARCHAR(20), " \
+                "cloud_provider VARCHAR(50), " \
+                "object_key VARCHAR(500), " \
+                "purged_at DATETIME, " \
+                "share_metrics TEXT, " \
                 "date_added DATETIME DEFAULT CURRENT_TIMESTAMP"
 
     # DB_TYPE = "mysql"
@@ -73,6 +115,7 @@ class DatabaseConfig:
     # MYSQL_DB_USERNAME = "your_username"
     # MYSQL_DB_PASSWORD = "your_password"
     # MYSQL_DB_NAME = "nifty"
+    # MYSQL_POOL_SIZE = 5
     # MYSQL_COLS = "id INT PRIMARY KEY AUTO_INCREMENT, " \
     #             "sender_name VARCHAR(100), " \
     #             "file_basename VARCHAR(100), " \
@@ -82,4 +125,19 @@ class DatabaseConfig:
     #             "expiry_date DATETIME, " \
     #             "file_size_bytes INT, " \
     #             "files_list TEXT, " \
-    #             "date_added DATETIME DEFAULT CURRENT_TIMESTAMP"
\ No newline at end of file
+    #             "mail_status VARCHAR(20), " \
+    #             "cloud_provider VARCHAR(50), " \
+    #             "object_key VARCHAR(500), " \
+    #             "purged_at DATETIME, " \
+    #             "share_metrics TEXT, " \
+    #             "date_added DATETIME DEFAULT CURRENT_TIMESTAMP"
+
+
+class PackagingConfig:
+
+    # memory ceiling for a share in MB, or for a whole nifty_batch run. The zip, upload and
+    # fan-out buffers are sized to fit in it. It's enforced as an address-space cap set higher by
+    # every running share's thread stacks (about 160 MB each), and going over that fails the share
+    # with a MemoryError rather than leaving it to the OOM killer. Leave 300 MB or so for Python
+    # and the SDKs, e.g. 512; None for no ceiling
+    MEMORY_LIMIT_MB = None
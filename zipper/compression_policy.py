@@ -0,0 +1,114 @@
+import math
+import os
+import threading
+import zipfile
+
+# formats that are already compressed, deflating them burns CPU for well under 1% saving
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.avi', '.avif', '.br', '.bz2', '.cab', '.deb', '.docx', '.dmg',
+    '.epub', '.flac', '.gif', '.gz', '.heic', '.iso', '.jar', '.jpeg', '.jpg', '.lz', '.lz4',
+    '.lzma', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4', '.mpeg', '.mpg', '.odt', '.ogg',
+    '.opus', '.png', '.pptx', '.rar', '.rpm', '.tbz2', '.tgz', '.txz', '.webm', '.webp',
+    '.whl', '.wma', '.wmv', '.xlsx', '.xz', '.zip', '.zst',
+}
+
+SAMPLE_SIZE = 1024 * 64
+
+# bits of entropy per byte in the sample, above STORE_ENTROPY the data is treated as
+# random, between FAST_ENTROPY and STORE_ENTROPY a cheap level gets nearly the same ratio
+STORE_ENTROPY = 7.5
+FAST_ENTROPY = 6.0
+
+# used to estimate the time saved when nothing was deflated in the share to measure against
+DEFAULT_DEFLATE_BYTES_PER_SECOND = 1024 * 1024 * 40
+
+
+def sample_entropy(sample: bytes) -> float:
+    if not sample:
+        return 0.0
+    total = len(sample)
+    entropy = 0.0
+    for byte in range(256):
+        count = sample.count(byte)
+        if count:
+            probability = count / total
+            entropy -= probability * math.log2(probability)
+    return entropy
+
+
+class CompressionPolicy:
+
+    def __init__(self, default_level: int = 6, fast_level: int = 1, sample_size: int = SAMPLE_SIZE) -> None:
+        self.default_level = default_level
+        self.fast_level = fast_level
+        self.sample_size = sample_size
+
+    def choose(self, file_path: str, size: int) -> tuple:
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in INCOMPRESSIBLE_EXTENSIONS:
+            return zipfile.ZIP_STORED, None
+
+        # not worth a read for tiny files, the header dominates either way
+        if size < 4096:
+            return zipfile.ZIP_DEFLATED, self.default_level
+
+        try:
+            with open(file_path, 'rb') as file:
+                sample = file.read(self.sample_size)
+        except OSError:
+            return zipfile.ZIP_DEFLATED, self.default_level
+
+        entropy = sample_entropy(sample)
+        if entropy >= STORE_ENTROPY:
+            return zipfile.ZIP_STORED, None
+        if entropy >= FAST_ENTROPY:
+            return zipfile.ZIP_DEFLATED, self.fast_level
+        return zipfile.ZIP_DEFLATED, self.default_level
+
+
+class CompressionReport:
+
+    def __init__(self) -> None:
+        self.files_stored = 0
+        self.files_deflated = 0
+        self.bytes_stored = 0
+        self.bytes_deflated_in = 0
+        self.bytes_deflated_out = 0
+        self.deflate_seconds = 0.0
+        self.stored_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, compress_type: int, bytes_in: int, bytes_out: int, seconds: float) -> None:
+        with self._lock:
+            if compress_type == zipfile.ZIP_STORED:
+                self.files_stored += 1
+                self.bytes_stored += bytes_in
+                self.stored_seconds += seconds
+            else:
+                self.files_deflated += 1
+                self.bytes_deflated_in += bytes_in
+                self.bytes_deflated_out += bytes_out
+                self.deflate_seconds += seconds
+
+    def summary(self) -> dict:
+        if self.deflate_seconds and self.bytes_deflated_in:
+            deflate_rate = self.bytes_deflated_in / self.deflate_seconds
+        else:
+            deflate_rate = DEFAULT_DEFLATE_BYTES_PER_SECOND
+
+        return {
+            'files_stored': self.files_stored,
+            'files_deflated': self.files_deflated,
+            'bytes_in': self.bytes_stored + self.bytes_deflated_in,
+            'bytes_out': self.bytes_stored + self.bytes_deflated_out,
+            'bytes_saved': self.bytes_deflated_in - self.bytes_deflated_out,
+            'seconds': round(self.deflate_seconds + self.stored_seconds, 3),
+            # what deflating the stored entries would have cost at this share's deflate rate
+            'estimated_seconds_saved': round(max(0.0, self.bytes_stored / deflate_rate - self.stored_seconds), 3),
+        }
+
+    def describe(self) -> str:
+        summary = self.summary()
+        return (f"{summary['files_deflated']} deflated, {summary['files_stored']} stored; "
+                f"saved {summary['bytes_saved']} bytes in {summary['seconds']}s, "
+                f"skipped ~{summary['estimated_seconds_saved']}s deflating {self.bytes_stored} bytes of incompressible data")
@@ -0,0 +1,65 @@
+import hashlib
+import os
+
+from zipper.manifest import Manifest
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    buffer = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+def path_key(file_path: str) -> str:
+    return hashlib.sha256(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+
+
+def manifest_path_keys(manifest: Manifest) -> list:
+    return [path_key(manifest.full_path(index)) for index in range(len(manifest))]
+
+
+def manifest_digest(manifest: Manifest) -> str:
+    # what the tree looked like when it was listed, without reading any file
+    digest = hashlib.sha256(f"{os.path.abspath(manifest.root)}\n".encode('utf-8'))
+    for rel_path, size, mtime, mode in sorted(manifest):
+        digest.update(f"{rel_path}\0{size}\0{mtime!r}\0{mode}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def payload_digest(manifest: Manifest, path_keys: list, cached: dict, is_folder: bool) -> tuple:
+    # cached maps path_key -> (size, mtime, digest); files whose size and mtime still
+    # match are not read again, everything else is hashed and returned for storage.
+    # the per-file digests are returned too, in manifest order
+    fresh = []
+    entries = []
+    digests = []
+    for index, (rel_path, size, mtime, mode) in enumerate(manifest):
+        file_path = manifest.full_path(index)
+        key = path_keys[index]
+        known = cached.get(key)
+        if known and known[0] == size and known[1] == mtime:
+            digest = known[2]
+        else:
+            digest = hash_file(file_path)
+            fresh.append((key, os.path.abspath(file_path), size, mtime, digest))
+        entries.append((rel_path, size, digest))
+        digests.append(digest)
+
+    payload = hashlib.sha256()
+    # the name and layout are part of what the recipient downloads: a folder's archive is named
+    # after it, a single file is uploaded under its own basename
+    kind = "folder" if is_folder else "file"
+    name = os.path.basename(os.path.normpath(manifest.root)) if is_folder else manifest.paths[0]
+    payload.update(f"{kind}\0{name}\n".encode('utf-8'))
+    for rel_path, size, digest in sorted(entries):
+        payload.update(f"{rel_path}\0{size}\0{digest}\n".encode('utf-8'))
+    return payload.hexdigest(), fresh, digests
@@ -1,23 +1,181 @@
 import zipfile
 import os
+import io
+import queue
+import threading
+import time
+
+from metrics.memory import MiB, buffer_budget
+from zipper.compression_policy import CompressionPolicy, CompressionReport
+from zipper.manifest import Manifest, build_manifest
+from zipper.parallel_zipper import CHUNK_SIZE, ParallelZipWriter
+
+# every entry is copied through one reused buffer of this size, whatever the file's size
+COPY_BUFFER_SIZE = MiB
+
 
 class FileZipper:
 
+    def __init__(self, workers: int = 1, policy: CompressionPolicy = None) -> None:
+        self.workers = workers
+        self.policy = policy or CompressionPolicy()
+        self.report = CompressionReport()
+        self.archive_size = 0
+
     def list_files(self, path: str) -> list:
-        files_list = []
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, path)
-                files_list.append(rel_path.replace("\\", "/"))
-        return files_list
-
-    def create_zip(self, path: str, zip_path: str) -> str:
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            base_dir = os.path.basename(path)
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(file_path, path)
-                    zip_file.write(file_path, os.path.join(base_dir, rel_path))
+        return build_manifest(path).paths
+
+    def create_zip(self, path: str, zip_path: str, manifest: Manifest = None) -> str:
+        manifest = manifest or build_manifest(path)
+        with open(zip_path, 'wb') as file:
+            self._write_archive(manifest, file)
+            self.archive_size = file.tell()
         return zip_path
+
+    def stream_zip(self, path: str, manifest: Manifest = None, buffer_size: int = None,
+                   chunk_size: int = MiB) -> "ZipStream":
+        manifest = manifest or build_manifest(path)
+        buffer_size = buffer_size or buffer_budget('zip_stream', 32 * MiB)
+        stream = ZipStream(lambda file: self._write_archive(manifest, file), buffer_size, chunk_size)
+        stream.start()
+        return stream
+
+    def _write_archive(self, manifest: Manifest, file) -> None:
+        self.report = CompressionReport()
+        if self.workers > 1:
+            # chunks waiting to be written, on top of the one each worker is compressing
+            max_in_flight = max(1, buffer_budget('zip_workers', 2 * self.workers * CHUNK_SIZE) // CHUNK_SIZE)
+            ParallelZipWriter(self.workers, self.policy, self.report, max_in_flight=max_in_flight).write(manifest, file)
+        else:
+            with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                self._write_entries(zip_file, manifest)
+
+    def _write_entries(self, zip_file: zipfile.ZipFile, manifest: Manifest) -> None:
+        base_dir = os.path.basename(os.path.normpath(manifest.root))
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        for index, (rel_path, size, mtime, mode) in enumerate(manifest):
+            file_path = manifest.full_path(index)
+            compress_type, level = self.policy.choose(file_path, size)
+            start = time.perf_counter()
+            info = self._write_entry(zip_file, file_path, f"{base_dir}/{rel_path}", compress_type, level, buffer)
+            self.report.add(compress_type, size, info.compress_size, time.perf_counter() - start)
+
+    def _write_entry(self, zip_file: zipfile.ZipFile, file_path: str, arcname: str, compress_type: int,
+                     level: int, buffer: bytearray) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo.from_file(file_path, arcname)
+        info.compress_type = compress_type
+        # what ZipFile.write sets, it's public as compress_level from 3.13
+        info._compresslevel = level
+        view = memoryview(buffer)
+        # ZIP64 is decided from the size the file had when it was opened, so no more than
+        # that is read and a file still growing can't overflow an entry without it
+        remaining = info.file_size
+        with open(file_path, 'rb', buffering=0) as src, zip_file.open(info, 'w') as dest:
+            while remaining:
+                read = src.readinto(view[:min(remaining, len(buffer))])
+                if not read:
+                    break
+                dest.write(view[:read])
+                remaining -= read
+        return info
+
+
+class _ChunkWriter:
+
+    # Deliberately has no seek/tell so the zip writers treat it as unseekable and
+    # write data descriptors instead of rewinding to patch local headers.
+
+    def __init__(self, stream: "ZipStream") -> None:
+        self._stream = stream
+        self._pending = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._pending += data
+        while len(self._pending) >= self._stream.chunk_size:
+            self._stream._put(bytes(self._pending[:self._stream.chunk_size]))
+            del self._pending[:self._stream.chunk_size]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> None:
+        if self._pending:
+            self._stream._put(bytes(self._pending))
+            self._pending.clear()
+
+
+class ZipStream(io.RawIOBase):
+
+    def __init__(self, write_archive, buffer_size: int, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self._write_archive = write_archive
+        self._queue = queue.Queue(maxsize=max(1, buffer_size // chunk_size))
+        self._current = b""
+        self._offset = 0
+        self._position = 0
+        self._finished = False
+        self._error = None
+        self._aborted = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name="zip-stream", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _produce(self) -> None:
+        writer = _ChunkWriter(self)
+        try:
+            self._write_archive(writer)
+            writer.drain()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._put(None)
+
+    def _put(self, chunk: bytes | None) -> None:
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.5)
+            except queue.Full:
+                continue
+            return
+        if chunk is not None:
+            raise IOError("Zip stream was closed by the reader")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            if self._offset >= len(self._current):
+                if self._finished:
+                    break
+                chunk = self._queue.get()
+                if chunk is None:
+                    self._finished = True
+                    if self._error:
+                        raise IOError(f"Zip stream failed: {self._error}") from self._error
+                    break
+                self._current = chunk
+                self._offset = 0
+            size = min(len(view) - filled, len(self._current) - self._offset)
+            view[filled:filled + size] = self._current[self._offset:self._offset + size]
+            self._offset += size
+            filled += size
+        self._position += filled
+        return filled
+
+    def close(self) -> None:
+        self._aborted.set()
+        super().close()
+
+    def join(self, timeout: float = None) -> None:
+        self._thread.join(timeout)
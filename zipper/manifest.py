@@ -0,0 +1,63 @@
+import os
+from array import array
+
+
+class Manifest:
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.paths = []
+        # typed arrays keep per-file metadata at 8 bytes a field instead of a python object each
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.modes = array('L')
+
+    def add(self, rel_path: str, size: int, mtime: float, mode: int) -> None:
+        self.paths.append(rel_path)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        self.modes.append(mode)
+
+    def full_path(self, index: int) -> str:
+        return os.path.join(self.root, self.paths[index])
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.sizes)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(zip(self.paths, self.sizes, self.mtimes, self.modes))
+
+
+def build_manifest(path: str) -> Manifest:
+    if not os.path.isdir(path):
+        manifest = Manifest(os.path.dirname(path))
+        stat = os.stat(path)
+        manifest.add(os.path.basename(path), stat.st_size, stat.st_mtime, stat.st_mode)
+        return manifest
+
+    manifest = Manifest(path)
+    # relative prefixes are carried down the walk so no relpath call is needed per file
+    pending = [(path, "")]
+    while pending:
+        directory, prefix = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                # like os.walk, symlinked directories are listed but not descended into
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        pending.append((entry.path, f"{prefix}{entry.name}/"))
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                manifest.add(f"{prefix}{entry.name}", stat.st_size, stat.st_mtime, stat.st_mode)
+    return manifest
@@ -0,0 +1,289 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZIP64_LIMIT
+
+from zipper.compression_policy import CompressionPolicy, CompressionReport
+from zipper.manifest import Manifest
+
+# large files are split into chunks that are deflated independently, each chunk
+# is primed with the 32 KiB preceding it so the ratio stays close to a serial deflate
+CHUNK_SIZE = 1024 * 1024 * 4
+DICTIONARY_SIZE = 1024 * 32
+
+# the zipper runs next to upload, progress and mail threads, a worker forked from that
+# process could inherit a lock one of them held; forkserver isn't available on Windows
+MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def _compress(data, zdict, level: int, final: bool) -> bytes:
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data)
+    # a sync flush ends on a byte boundary without setting BFINAL, so the next
+    # chunk's blocks can be appended directly to form one valid deflate stream
+    compressed += compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    return compressed
+
+
+def _deflate_chunk(file_path: str, offset: int, length: int, level: int, final: bool) -> tuple:
+    start = time.perf_counter()
+    if not length:
+        compressed = b"" if level is None else _compress(b"", b"", level, final)
+        return compressed, 0, 0, time.perf_counter() - start
+
+    # the chunk and the dictionary before it are mapped instead of read, so they're never
+    # copied onto the worker's heap and the pages are let go as soon as the map is closed
+    window = offset if level is None else max(0, offset - DICTIONARY_SIZE)
+    map_start = window - window % mmap.ALLOCATIONGRANULARITY
+    with open(file_path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), offset + length - map_start, access=mmap.ACCESS_READ, offset=map_start)
+    try:
+        with memoryview(mapped) as view, view[offset - map_start:] as data, \
+                view[window - map_start:offset - map_start] as zdict:
+            crc = zlib.crc32(data)
+            compressed = bytes(data) if level is None else _compress(data, zdict, level, final)
+    finally:
+        mapped.close()
+    return compressed, crc, length, time.perf_counter() - start
+
+
+def _gf2_matrix_times(matrix: list, vector: int) -> int:
+    total = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return total
+
+
+def _gf2_matrix_square(matrix: list) -> list:
+    return [_gf2_matrix_times(matrix, matrix[n]) for n in range(32)]
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    # port of zlib's crc32_combine, which the zlib module doesn't expose
+    if length2 <= 0:
+        return crc1
+
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    while True:
+        even = _gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
+
+
+def _dos_datetime(mtime: float) -> tuple:
+    local = time.localtime(mtime)
+    if local.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (local.tm_hour << 11) | (local.tm_min << 5) | (local.tm_sec // 2)
+    dos_date = ((local.tm_year - 1980) << 9) | (local.tm_mon << 5) | local.tm_mday
+    return dos_time, dos_date
+
+
+class ZipEntry:
+
+    def __init__(self, arcname: str, file_size: int, mtime: float, mode: int, compress_type: int) -> None:
+        self.arcname = arcname
+        self.compress_type = compress_type
+        self.file_size = file_size
+        self.mtime = mtime
+        self.mode = mode
+        self.crc = 0
+        self.compress_size = 0
+        self.seconds = 0.0
+        self.header_offset = 0
+        # compressed data can be slightly larger than the input
+        self.zip64 = file_size * 1.05 > ZIP64_LIMIT
+
+
+class ZipAssembler:
+
+    def __init__(self, fp) -> None:
+        self.fp = fp
+        self.entries = []
+        self.position = 0
+        self.seekable = hasattr(fp, 'seekable') and fp.seekable()
+        if self.seekable:
+            self.position = fp.tell()
+
+    def _write(self, data: bytes) -> None:
+        self.fp.write(data)
+        self.position += len(data)
+
+    def _flags(self, entry: ZipEntry) -> int:
+        flags = 0
+        if not entry.arcname.isascii():
+            flags |= 0x800
+        if not self.seekable:
+            flags |= 0x08
+        return flags
+
+    def _local_header(self, entry: ZipEntry) -> bytes:
+        name = entry.arcname.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        crc, compress_size, file_size = entry.crc, entry.compress_size, entry.file_size
+        if not self.seekable:
+            crc = compress_size = file_size = 0
+        extra = b""
+        version = 20
+        if entry.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+            compress_size = file_size = 0xffffffff
+            version = 45
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, version, self._flags(entry), entry.compress_type,
+                             dos_time, dos_date, crc, compress_size, file_size, len(name), len(extra))
+        return header + name + extra
+
+    def begin(self, entry: ZipEntry) -> None:
+        entry.header_offset = self.position
+        self._write(self._local_header(entry))
+
+    def write(self, data: bytes) -> None:
+        self._write(data)
+
+    def finish(self, entry: ZipEntry) -> None:
+        if self.seekable:
+            end = self.fp.tell()
+            self.fp.seek(entry.header_offset)
+            self.fp.write(self._local_header(entry))
+            self.fp.seek(end)
+        elif entry.zip64:
+            self._write(struct.pack('<IIQQ', 0x08074b50, entry.crc, entry.compress_size, entry.file_size))
+        else:
+            self._write(struct.pack('<IIII', 0x08074b50, entry.crc, entry.compress_size, entry.file_size))
+        self.entries.append(entry)
+
+    def _central_header(self, entry: ZipEntry) -> bytes:
+        name = entry.arcname.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+
+        zip64_fields = []
+        if file_size >= 0xffffffff:
+            zip64_fields.append(file_size)
+            file_size = 0xffffffff
+        if compress_size >= 0xffffffff:
+            zip64_fields.append(compress_size)
+            compress_size = 0xffffffff
+        if header_offset >= 0xffffffff:
+            zip64_fields.append(header_offset)
+            header_offset = 0xffffffff
+
+        extra = b""
+        version = 20
+        if zip64_fields:
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields)
+            version = 45
+        if entry.zip64:
+            version = 45
+
+        header = struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version,
+                             self._flags(entry), entry.compress_type, dos_time, dos_date, entry.crc,
+                             compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                             (entry.mode & 0xffff) << 16, header_offset)
+        return header + name + extra
+
+    def close(self) -> None:
+        start_dir = self.position
+        for entry in self.entries:
+            self._write(self._central_header(entry))
+        size_dir = self.position - start_dir
+
+        count = len(self.entries)
+        if count > 0xffff or start_dir >= 0xffffffff or size_dir >= 0xffffffff:
+            zip64_end = self.position
+            self._write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                    count, count, size_dir, start_dir))
+            self._write(struct.pack('<IIQI', 0x07064b50, 0, zip64_end, 1))
+            count = min(count, 0xffff)
+            start_dir = min(start_dir, 0xffffffff)
+            size_dir = min(size_dir, 0xffffffff)
+
+        self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size_dir, start_dir, 0))
+        if hasattr(self.fp, 'flush'):
+            self.fp.flush()
+
+
+class ParallelZipWriter:
+
+    def __init__(self, workers: int = None, policy: CompressionPolicy = None,
+                 report: CompressionReport = None, chunk_size: int = CHUNK_SIZE, max_in_flight: int = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.policy = policy or CompressionPolicy()
+        self.report = report or CompressionReport()
+        self.chunk_size = chunk_size
+        # results are written strictly in submission order, so capping the queue
+        # bounds memory to roughly max_in_flight * chunk_size
+        self.max_in_flight = max_in_flight or self.workers * 2
+
+    def _tasks(self, manifest: Manifest):
+        base_dir = os.path.basename(os.path.normpath(manifest.root))
+        for index, (rel_path, size, mtime, mode) in enumerate(manifest):
+            file_path = manifest.full_path(index)
+            compress_type, level = self.policy.choose(file_path, size)
+            entry = ZipEntry(f"{base_dir}/{rel_path}", size, mtime, mode, compress_type)
+
+            offset = 0
+            while True:
+                length = min(self.chunk_size, entry.file_size - offset)
+                final = offset + length >= entry.file_size
+                yield entry, offset == 0, (file_path, offset, length, level, final)
+                if final:
+                    break
+                offset += length
+
+    def _collect(self, assembler: ZipAssembler, in_flight: deque) -> None:
+        entry, first, final, future = in_flight.popleft()
+        compressed, crc, length, seconds = future.result()
+        entry.seconds += seconds
+        if first:
+            assembler.begin(entry)
+            entry.crc = crc
+        else:
+            entry.crc = crc32_combine(entry.crc, crc, length)
+        assembler.write(compressed)
+        entry.compress_size += len(compressed)
+        if final:
+            assembler.finish(entry)
+            self.report.add(entry.compress_type, entry.file_size, entry.compress_size, entry.seconds)
+
+    def write(self, manifest: Manifest, fp) -> None:
+        assembler = ZipAssembler(fp)
+        in_flight = deque()
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=MP_CONTEXT) as pool:
+            for entry, first, task in self._tasks(manifest):
+                final = task[-1]
+                in_flight.append((entry, first, final, pool.submit(_deflate_chunk, *task)))
+                if len(in_flight) >= self.max_in_flight:
+                    self._collect(assembler, in_flight)
+            while in_flight:
+                self._collect(assembler, in_flight)
+
+        assembler.close()